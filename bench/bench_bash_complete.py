@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks the latency of repeated bash completions, comparing a fresh bash
+per request with the persistent BashCompleteServer coprocess.
+
+Usage:
+    python3 bench/bench_bash_complete.py [completion-file] [command] [n]
+
+If no completion file is given, the system git completions are used if they
+exist, otherwise a small synthetic completion file is generated.
+"""
+import os
+import sys
+import time
+import shlex
+import builtins
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.environ import Env
+from xonsh.completer import (BashCompleteServer, BASH_COMPLETE_BODY,
+                             BASH_COMPLETE_SCRIPT)
+
+SYNTHETIC = """_bench_complete() {
+    local cur=${COMP_WORDS[COMP_CWORD]}
+    COMPREPLY=( $(compgen -W "alpha beta gamma delta epsilon" -- "$cur") )
+}
+complete -F _bench_complete benchcmd
+"""
+
+GIT_COMPLETIONS = '/usr/share/bash-completion/completions/git'
+
+
+def _setup(argv):
+    if len(argv) > 1:
+        fname, cmd, func = argv[1], argv[2], '_' + argv[2]
+    elif os.path.isfile(GIT_COMPLETIONS):
+        fname, cmd, func = GIT_COMPLETIONS, 'git', '__git_wrap__git_main'
+    else:
+        f = tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False)
+        f.write(SYNTHETIC)
+        f.close()
+        fname, cmd, func = f.name, 'benchcmd', '_bench_complete'
+    n = int(argv[3]) if len(argv) > 3 else 50
+    return fname, cmd, func, n
+
+
+def _fmt(cmd, func):
+    line = cmd + ' '
+    return dict(line=shlex.quote(cmd), comp_line=shlex.quote(line), n=1,
+                func=func, cmd=cmd, end=len(line) + 1, prefix='""',
+                prev=shlex.quote(cmd))
+
+
+def bench_oneshot(fname, fmt, n):
+    script = BASH_COMPLETE_SCRIPT.format(filename=fname, **fmt)
+    times = []
+    for _ in range(n):
+        t0 = time.monotonic()
+        subprocess.check_output(['bash'], input=script,
+                                universal_newlines=True,
+                                stderr=subprocess.DEVNULL)
+        times.append(time.monotonic() - t0)
+    return times
+
+
+def bench_server(fname, fmt, n):
+    server = BashCompleteServer()
+    body = BASH_COMPLETE_BODY.format(**fmt)
+    times = []
+    for _ in range(n):
+        t0 = time.monotonic()
+        server.complete(body, filename=fname, timeout=10.0)
+        times.append(time.monotonic() - t0)
+    server.close()
+    return times
+
+
+def _report(name, times):
+    first = times[0]
+    times = sorted(times)
+    print('{0:>10}: first {1:8.2f} ms, median {2:8.2f} ms, '
+          'max {3:8.2f} ms'.format(name, first * 1e3,
+                                   times[len(times) // 2] * 1e3,
+                                   times[-1] * 1e3))
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    builtins.__xonsh_env__ = Env(XONSH_ENCODING='utf-8',
+                                 XONSH_ENCODING_ERRORS='surrogateescape')
+    fname, cmd, func, n = _setup(argv)
+    fmt = _fmt(cmd, func)
+    print('completing {0!r} from {1} x {2}'.format(cmd + ' ', fname, n))
+    _report('one-shot', bench_oneshot(fname, fmt, n))
+    _report('server', bench_server(fname, fmt, n))
+
+
+if __name__ == '__main__':
+    main()
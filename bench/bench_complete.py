@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks completion at typing speed through the prompt_toolkit
+completer. A word is typed out one character at a time, and completions are
+requested after every keystroke. They are either computed from scratch each
+time, or narrowed down from those of the last keystroke where possible.
+
+Usage:
+    python3 bench/bench_complete.py [n]
+"""
+import os
+import sys
+import time
+import builtins
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.document import Document
+from prompt_toolkit.completion import CompleteEvent
+
+from xonsh import built_ins
+from xonsh.completer import Completer
+from xonsh.prompt_toolkit_completer import PromptToolkitCompleter
+
+# (text before the word, the word)
+LINES = [('', 'python3'), ('', 'sys.path'), ('ls ', 'bench/bench_complete.py')]
+
+
+def type_word(ptk_completer, before, word, narrow):
+    """Types out the word and returns the number of completions at each
+    keystroke.
+    """
+    counts = []
+    for i in range(1, len(word) + 1):
+        text = before + word[:i]
+        if not narrow:
+            ptk_completer.completer.new_prompt()
+        event = CompleteEvent(completion_requested=True)
+        comps = ptk_completer.get_completions(Document(text), event)
+        counts.append(len(list(comps)))
+    return counts
+
+
+def main(n=20):
+    built_ins.load_builtins(execer=None)
+    built_ins.ENV = builtins.__xonsh_env__
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    ctx = {'sys': sys, 'os': os}
+    ptk_completer = PromptToolkitCompleter(Completer(), ctx)
+    for before, word in LINES:
+        line = before + word
+        times = {}
+        for narrow in (False, True):
+            counts = type_word(ptk_completer, before, word, narrow)
+            ptk_completer.completer.new_prompt()
+            t0 = time.perf_counter()
+            for _ in range(n):
+                type_word(ptk_completer, before, word, narrow)
+                ptk_completer.completer.new_prompt()
+            times[narrow] = (time.perf_counter() - t0) / (n * len(word))
+        print('{0!r}: completions per keystroke {1}'.format(line, counts))
+        print('    from scratch {0:8.3f} ms/key, narrowed {1:8.3f} ms/key'
+              ''.format(times[False] * 1e3, times[True] * 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks for the hot paths of the xonsh environment: building it
+from os.environ, looking up variables, resolving ensurers, setting variables
+and detyping.
+
+Usage:
+    python3 bench/bench_env.py [n]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.environ import Env
+
+NVARS = 500
+
+
+def _make_env():
+    env = Env({'VAR{0}'.format(i): str(i) for i in range(NVARS)})
+    env['PATH'] = ['/usr/local/bin', '/usr/bin', '/bin']
+    env['ARGS'] = ['script.xsh', 'one', 'two']
+    return env
+
+
+def _environ():
+    """os.environ, with as many variables again as a CI host might have."""
+    environ = dict(os.environ)
+    for i in range(NVARS):
+        if i % 10 == 0:
+            path = os.pathsep.join(['/usr/bin'] * 5)
+            environ['CI_{0}_PATH'.format(i)] = path
+        else:
+            environ['CI_VAR_{0}'.format(i)] = 'value {0}'.format(i)
+    return environ
+
+
+def _build_cases(environ):
+    def look_up_all():
+        env = Env(environ)
+        for key in env:
+            env[key]
+        env.detype()
+    return [
+        ('Env(environ)', lambda: Env(environ)),
+        ('Env(environ).detype()', lambda: Env(environ).detype()),
+        # what building it cost when every variable was converted up front
+        ('... look up every var', look_up_all),
+    ]
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    environ = _environ()
+    print('building from {0} variables'.format(len(environ)))
+    nbuild = max(n // 1000, 1)
+    for name, stmt in _build_cases(environ):
+        t = min(timeit.repeat(stmt, number=nbuild, repeat=3))
+        print('{0:24s} {1:8.3f} ms'.format(name, 1e3 * t / nbuild))
+    env = _make_env()
+    env.detype()
+    counter = iter(range(10**9))
+    cases = [
+        ('get (set variable)', lambda: env.get('VAR42')),
+        ('get (default)', lambda: env.get('XONSH_SHOW_TRACEBACK')),
+        ('get (missing)', lambda: env.get('NOT_A_VARIABLE', None)),
+        ('get (ARGn)', lambda: env.get('ARG1')),
+        ('__getitem__', lambda: env['VAR42']),
+        ('get_ensurer (exact)', lambda: env.get_ensurer('XONSH_DEBUG')),
+        ('get_ensurer (regex)', lambda: env.get_ensurer('MY_PATH')),
+        ('get_ensurer (new key)',
+         lambda: env.get_ensurer('NEW{0}'.format(next(counter)))),
+        ('__setitem__', lambda: env.__setitem__('VAR42', 'x')),
+        ('detype (unchanged)', env.detype),
+    ]
+    for name, stmt in cases:
+        t = min(timeit.repeat(stmt, number=n, repeat=3))
+        print('{0:24s} {1:8.3f} us'.format(name, 1e6 * t / n))
+
+    def set_and_detype():
+        env['VAR42'] = 'y'
+        env.detype()
+    t = min(timeit.repeat(set_and_detype, number=n // 10, repeat=3))
+    print('{0:24s} {1:8.3f} us'.format('detype (after one set)',
+                                        1e6 * t / (n // 10)))
+    print('ensurer table size:   ', len(env.ensurers))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks highlighting a long block of code while a line is typed into
+it, at its end and in its middle, with the regex based pygments lexer, which
+highlights all of the code at every keystroke, and with the incremental lexer
+built on xonsh's own lexer.
+
+Usage:
+    python3 bench/bench_highlight.py [n_lines]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.pyghooks import XonshLexer, IncrementalXonshLexer
+
+BLOCK = '''for i, name in enumerate(names):
+    if name.startswith('_'):
+        continue  # private
+    echo @(name) $(ls -l @(name) | wc -l) > $HOME/out.txt
+    result[name] = """a
+    doc string""".format(i)
+'''
+LINE = 'cp -r $HOME/src /tmp/dst && print(len(result))'
+
+
+def type_line(lexer_tokens, before, after):
+    """Types LINE between before and after, highlighting at every key."""
+    for i in range(1, len(LINE) + 1):
+        lexer_tokens(before + LINE[:i] + after)
+    return len(LINE)
+
+
+def main(n_lines=300):
+    code = BLOCK * (n_lines // BLOCK.count('\n'))
+    mid = code.index('\n', len(code) // 2) + 1
+    places = [('end', code, ''), ('middle', code[:mid], '\n' + code[mid:])]
+    pyg = XonshLexer(stripnl=False, stripall=False, ensurenl=False)
+    print('{0} lines'.format(code.count('\n')))
+    for place, before, after in places:
+        inc = IncrementalXonshLexer({'names': [], 'result': {}})
+        inc.get_tokens(before + after)
+        kinds = [('pygments', lambda s: list(pyg.get_tokens(s))),
+                 ('incremental', inc.get_tokens)]
+        times = []
+        for _, tokens in kinds:
+            t0 = time.perf_counter()
+            keys = type_line(tokens, before, after)
+            times.append((time.perf_counter() - t0) / keys)
+        print('{0:>8}: pygments {1:8.3f} ms/key, incremental {2:8.3f} '
+              'ms/key'.format(place, times[0] * 1e3, times[1] * 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
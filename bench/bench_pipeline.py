@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks pipelines of three callable aliases, connected either through
+OS pipes or through in-process StreamPipes.
+
+Usage:
+    python3 bench/bench_pipeline.py [nlines] [n]
+"""
+import os
+import sys
+import time
+from subprocess import PIPE
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.proc import ProcProxy, SimpleProcProxy, StreamPipe
+
+LINE = 'x' * 60 + '\n'
+
+
+def _simple(nlines):
+    """Aliases of the (args, stdin=None) form, returning strings."""
+    def gen(args, stdin=None):
+        return LINE * nlines
+
+    def upper(args, stdin=None):
+        return stdin.upper()
+
+    def count(args, stdin=None):
+        return '{0}\n'.format(stdin.count('\n'))
+    return [(SimpleProcProxy, f) for f in (gen, upper, count)]
+
+
+def _lines(nlines):
+    """Aliases of the (args, stdin, stdout, stderr) form, working line by
+    line.
+    """
+    def gen(args, stdin, stdout, stderr):
+        for i in range(nlines):
+            stdout.write(LINE)
+
+    def upper(args, stdin, stdout, stderr):
+        for line in stdin:
+            stdout.write(line.upper())
+
+    def count(args, stdin, stdout, stderr):
+        n = 0
+        for line in stdin:
+            n += 1
+        stdout.write('{0}\n'.format(n))
+    return [(ProcProxy, f) for f in (gen, upper, count)]
+
+
+def run(procs, inproc):
+    stdin = None
+    for i, (cls, f) in enumerate(procs):
+        last = i == len(procs) - 1
+        stdout = StreamPipe() if inproc and not last else PIPE
+        proc = cls(f, [], stdin=stdin, stdout=stdout)
+        stdin = proc.stdout
+    proc.wait()
+    return proc.stdout.read()
+
+
+def main(argv):
+    nlines = int(argv[1]) if len(argv) > 1 else 100000
+    n = int(argv[2]) if len(argv) > 2 else 5
+    print('{0} lines of {1} characters'.format(nlines, len(LINE)))
+    for kind, make in [('strings', _simple), ('lines', _lines)]:
+        for name, inproc in [('OS pipes', False), ('in-process', True)]:
+            times = []
+            for i in range(n):
+                t0 = time.perf_counter()
+                out = run(make(nlines), inproc)
+                times.append(time.perf_counter() - t0)
+            assert int(out) == nlines, out
+            print('{0:8s} {1:12s} {2:8.1f} ms'.format(kind, name,
+                                                       1e3 * min(times)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
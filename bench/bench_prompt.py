@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks the work done by the prompt_toolkit shell to set up each prompt:
+formatting the prompt, splitting it into colored tokens, making the style
+class and the lexer. This is done either from scratch every time, or with the
+parsed templates, token splits, style classes and lexer kept between
+prompts.
+
+Usage:
+    python3 bench/bench_prompt.py [n]
+"""
+import os
+import sys
+import time
+import builtins
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.layout.lexers import PygmentsLexer
+from pygments.token import Token
+
+from xonsh import built_ins
+from xonsh.environ import format_prompt, PROMPT_FIELDS
+from xonsh.pyghooks import XonshLexer
+from xonsh.prompt_toolkit_shell import _xonsh_style, _prompt_style
+from xonsh.tools import format_prompt_for_prompt_toolkit, prompt_color_parts, \
+    TERM_COLORS
+
+
+def from_scratch(template):
+    p = format_prompt(template)
+    token_names, cstyles, strings = format_prompt_for_prompt_toolkit(p)
+    tokens = [getattr(Token, n) for n in token_names]
+    style = _xonsh_style(tokens, cstyles)
+    lexer = PygmentsLexer(XonshLexer)
+    return list(zip(tokens, strings)), style, lexer
+
+
+def cached(template, lexer):
+    p = format_prompt(template)
+    token_names, strings = prompt_color_parts(p)
+    tokens = [getattr(Token, n) for n in token_names]
+    return list(zip(tokens, strings)), _prompt_style(), lexer
+
+
+def main(n=500):
+    built_ins.load_builtins(execer=None)
+    built_ins.ENV = builtins.__xonsh_env__
+    # only the setup is timed, not the fields, which are all left fast
+    builtins.__xonsh_env__['FORMATTER_DICT'] = dict(
+        builtins.__xonsh_env__['FORMATTER_DICT'], curr_branch=' master',
+        branch_color=TERM_COLORS['BOLD_GREEN'])
+    template = builtins.__xonsh_env__.get('PROMPT')
+    lexer = PygmentsLexer(XonshLexer)
+    for name, func in [('from scratch', lambda: from_scratch(template)),
+                       ('cached', lambda: cached(template, lexer))]:
+        func()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            PROMPT_FIELDS.new_prompt()
+            func()
+        t = (time.perf_counter() - t0) / n
+        print('{0:<14} {1:8.3f} ms per prompt'.format(name, t * 1e3))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks the time to start a subprocess in its own process group, with
+a preexec_fn and through Popen's process_group argument, as the resident size
+of the parent grows. A preexec_fn forces a full fork, which copies the page
+tables of the parent, while process_group lets Popen use vfork.
+
+Usage:
+    python3 bench/bench_spawn.py [n] [max_mb]
+"""
+import os
+import sys
+import time
+import signal
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.built_ins import _subproc_pre
+from xonsh.jobs import ignore_sigtstp
+from xonsh.tools import VER_FULL, VER_3_11
+
+
+def rss_mb():
+    """The resident set size of this process, in MiB."""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def spawn_time(n, kwargs):
+    t0 = time.perf_counter()
+    for i in range(n):
+        subprocess.Popen(['true'], **kwargs).wait()
+    return (time.perf_counter() - t0) / n
+
+
+def main(n=200, max_mb=1024):
+    ignore_sigtstp()
+    kinds = [('preexec_fn', {'preexec_fn': _subproc_pre})]
+    if VER_FULL >= VER_3_11:
+        kinds.append(('process_group', {'process_group': 0}))
+    heap = []
+    mb = 0
+    print('{0:>10}'.format('rss (MiB)') +
+          ''.join('{0:>16}'.format(name) for name, _ in kinds) +
+          '  (ms per spawn)')
+    while mb <= max_mb:
+        times = [spawn_time(n, kwargs) for _, kwargs in kinds]
+        print('{0:>10.0f}'.format(rss_mb()) +
+              ''.join('{0:>16.3f}'.format(t * 1e3) for t in times))
+        # touch every page, so that it counts towards the resident size
+        grow = max(mb, 64)
+        heap.append(b'x' * (grow * 2**20))
+        mb += grow
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
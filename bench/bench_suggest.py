@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks "did you mean" suggestions for misspelt commands, with many
+commands on $PATH. Each typo is compared against every command, either in
+full or with the Levenshtein distance cut off at the threshold, or looked up
+in the fuzzy index of the commands cache, which is built on first use.
+
+Usage:
+    python3 bench/bench_suggest.py [ncmds] [n]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xonsh.environ import Env
+from xonsh.tools import levenshtein
+from xonsh.commands_cache import CommandsCache
+
+from tests.tools import mock_xonsh_env
+
+THRESH = 3
+TYPOS = ['gti', 'pyhton3', 'sl', 'grpe', 'mkdri', 'xonhs', 'dokcer-compose']
+
+
+def make_path(ncmds, ndirs=10):
+    """Creates ndirs directories holding ncmds empty files between them."""
+    rand = random.Random(42)
+    letters = 'abcdefghijklmnopqrstuvwxyz-'
+    dirs = [tempfile.mkdtemp() for _ in range(ndirs)]
+    for i in range(ncmds):
+        name = ''.join(rand.choice(letters) for _ in range(rand.randint(3, 14)))
+        with open(os.path.join(dirs[i % ndirs], name), 'w'):
+            pass
+    return dirs
+
+
+def scan(cache, typo, max_dist=float('inf')):
+    return [f for f in cache.all_commands()
+            if levenshtein(f.lower(), typo, max_dist) < THRESH]
+
+
+def main(ncmds=10000, n=5):
+    dirs = make_path(ncmds)
+    try:
+        with mock_xonsh_env(Env(PATH=dirs)):
+            cache = CommandsCache()
+            print('{0} commands on $PATH'.format(len(cache)))
+            t0 = time.perf_counter()
+            cache.fuzzy('', THRESH)
+            print('building the index {0:10.1f} ms'.format(
+                  (time.perf_counter() - t0) * 1e3))
+            kinds = [('full scan', lambda t: scan(cache, t)),
+                     ('cut-off scan', lambda t: scan(cache, t, THRESH)),
+                     ('index', lambda t: cache.fuzzy(t, THRESH))]
+            for name, func in kinds:
+                t0 = time.perf_counter()
+                for _ in range(n):
+                    for typo in TYPOS:
+                        func(typo)
+                t = (time.perf_counter() - t0) / (n * len(TYPOS))
+                print('{0:<18} {1:10.3f} ms per typo'.format(name, t * 1e3))
+    finally:
+        for d in dirs:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -3,6 +3,9 @@
 from __future__ import unicode_literals, print_function
 import os
 import re
+import sys
+import signal
+import subprocess
 
 import nose
 from nose.plugins.skip import SkipTest
@@ -12,9 +15,10 @@ from xonsh import built_ins
 from xonsh.built_ins import reglob, regexpath, helper, superhelper, \
     ensure_list_of_strs, expand_case_matching
 from xonsh.environ import Env
+from xonsh.jobs import ignore_sigtstp
 from xonsh.tools import ON_WINDOWS
 
-from tools import mock_xonsh_env
+from tools import mock_xonsh_env, skip_if
 
 
 def test_reglob_tests():
@@ -111,6 +115,59 @@ def test_expand_case_matching():
         obs = expand_case_matching(inp)
         yield assert_equal, exp, obs
 
+@skip_if(ON_WINDOWS)
+def test_subproc_pre_kwargs():
+    code = ('import os, signal; '
+            'print(os.getpgrp() == os.getpid(), '
+            'signal.getsignal(signal.SIGTSTP) == signal.SIG_DFL)')
+    old_handler = signal.getsignal(signal.SIGTSTP)
+    try:
+        for handler in (signal.SIG_IGN, None):
+            if handler is None:
+                ignore_sigtstp()
+            else:
+                signal.signal(signal.SIGTSTP, handler)
+            kwargs = built_ins._subproc_pre_kwargs()
+            out = subprocess.check_output([sys.executable, '-c', code],
+                                          **kwargs)
+            yield assert_equal, b'True True', out.strip()
+    finally:
+        signal.signal(signal.SIGTSTP, old_handler)
+
+
+ITER_ON_TTY = """
+from xonsh import built_ins
+built_ins.load_builtins(execer=None)
+lines = built_ins.run_subproc([['cat']], captured='iter')
+print('lines', list(lines), lines.returncode)
+"""
+
+@skip_if(ON_WINDOWS)
+def test_run_subproc_iter_on_tty():
+    import pty
+    import select
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.execve(sys.executable, [sys.executable, '-c', ITER_ON_TTY], env)
+    out = b''
+    try:
+        # cat must not be stopped for reading the terminal, which it may
+        # not have
+        while select.select([fd], [], [], 10)[0]:
+            try:
+                data = os.read(fd, 1024)
+            except OSError:
+                break
+            if len(data) == 0:
+                break
+            out += data
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    assert_true(b'lines [] 0' in out, out)
+
 
 if __name__ == '__main__':
     nose.runmodule()
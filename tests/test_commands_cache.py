@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Tests the xonsh commands cache."""
+from __future__ import unicode_literals, print_function
+import os
+import shutil
+import builtins
+import tempfile
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_false, assert_is
+
+from xonsh.tools import ON_WINDOWS
+from xonsh.environ import Env
+from xonsh.commands_cache import CommandsCache, hash_alias
+
+from tests.tools import mock_xonsh_env, skip_if
+
+TMPDIRS = []
+
+
+def setup():
+    for i in range(2):
+        d = tempfile.mkdtemp()
+        TMPDIRS.append(d)
+        for name in ['wakka', 'jawaka'][:i+1]:
+            with open(os.path.join(d, name), 'w'):
+                pass
+
+
+def teardown():
+    for d in TMPDIRS:
+        shutil.rmtree(d)
+    TMPDIRS.clear()
+
+
+def test_lookup_precedence():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        assert_equal(os.path.join(TMPDIRS[0], 'wakka'), cache.lookup('wakka'))
+        assert_equal(os.path.join(TMPDIRS[1], 'jawaka'), cache.lookup('jawaka'))
+        assert_equal(None, cache.lookup('nope'))
+        assert_equal(1, cache.hits['wakka'])
+
+
+def test_all_commands_stable():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        cmds = cache.all_commands()
+        assert_equal({'wakka', 'jawaka'}, set(cmds))
+        assert_is(cmds, cache.all_commands())
+
+
+@skip_if(ON_WINDOWS)
+def test_new_file_invalidates():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        assert_false('bizbaz' in cache)
+        fname = os.path.join(TMPDIRS[1], 'bizbaz')
+        with open(fname, 'w'):
+            pass
+        st = os.stat(TMPDIRS[1])
+        os.utime(TMPDIRS[1], (st.st_atime, st.st_mtime + 10))
+        assert_true('bizbaz' in cache)
+        os.remove(fname)
+
+
+def test_startswith():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        assert_equal(['jawaka', 'wakka'], cache.startswith(''))
+        assert_equal(['wakka'], cache.startswith('wa'))
+        assert_equal([], cache.startswith('WA'))
+        assert_equal(['wakka'], cache.startswith('WA', case_sensitive=False))
+        assert_equal([], cache.startswith('wakkaa'))
+
+
+@skip_if(ON_WINDOWS)
+def test_fuzzy():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        assert_equal([(1, 'wakka')], cache.fuzzy('WAKA', 2))
+        assert_equal([], cache.fuzzy('xonsh', 3))
+        # new commands are added to the index as they appear
+        fname = os.path.join(TMPDIRS[1], 'wakkb')
+        with open(fname, 'w'):
+            pass
+        st = os.stat(TMPDIRS[1])
+        os.utime(TMPDIRS[1], (st.st_atime, st.st_mtime + 10))
+        cache.update(force=True)
+        assert_equal([(0, 'wakka'), (1, 'wakkb')], sorted(cache.fuzzy('wakka', 2)))
+        os.remove(fname)
+
+
+@skip_if(ON_WINDOWS)
+def test_checked_once_per_prompt():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        cache.new_prompt()
+        assert_equal(['wakka'], cache.startswith('wa'))
+        fname = os.path.join(TMPDIRS[1], 'wazoo')
+        with open(fname, 'w'):
+            pass
+        st = os.stat(TMPDIRS[1])
+        os.utime(TMPDIRS[1], (st.st_atime, st.st_mtime + 10))
+        try:
+            assert_equal(['wakka'], cache.startswith('wa'))
+            cache.new_prompt()
+            assert_equal(['wakka', 'wazoo'], cache.startswith('wa'))
+            # a command that is not found makes the directories be checked
+            # again, even within the same prompt
+            with open(fname + '2', 'w'):
+                pass
+            os.utime(TMPDIRS[1], (st.st_atime, st.st_mtime + 20))
+            assert_equal(fname + '2', cache.lookup('wazoo2'))
+        finally:
+            os.remove(fname)
+            if os.path.exists(fname + '2'):
+                os.remove(fname + '2')
+
+
+def test_hash_alias():
+    cache = CommandsCache()
+    with mock_xonsh_env(Env(PATH=list(TMPDIRS))):
+        builtins.__xonsh_commands_cache__ = cache
+        out, err = hash_alias([])
+        assert_equal('hash: hash table empty\n', out)
+        cache.lookup('wakka')
+        out, err = hash_alias([])
+        assert_true(out.endswith('   1\t' + os.path.join(TMPDIRS[0], 'wakka') + '\n'))
+        out, err = hash_alias(['nope'])
+        assert_equal('xonsh: hash: nope: not found\n', err)
+        hash_alias(['-r'])
+        assert_equal({}, cache.hits)
+
+
+if __name__ == '__main__':
+    nose.runmodule()
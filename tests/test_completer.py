@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Tests the xonsh completer."""
+from __future__ import unicode_literals, print_function
+import os
+import builtins
+import tempfile
+import threading
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_false
+
+import xonsh.completer
+from xonsh.tools import ON_WINDOWS
+from xonsh.environ import Env
+from xonsh import built_ins
+from xonsh.built_ins import Aliases
+from xonsh.completer import BashCompleteServer, Completer, DirListing
+
+from tests.tools import mock_xonsh_env, skip_if
+
+ENV = Env(XONSH_ENCODING='utf-8', XONSH_ENCODING_ERRORS='strict')
+
+
+@skip_if(ON_WINDOWS)
+def test_bash_server_roundtrip():
+    server = BashCompleteServer()
+    with mock_xonsh_env(ENV):
+        assert_equal('hi\nthere\n', server.complete('echo hi; echo there'))
+        assert_equal('nonewline', server.complete('printf nonewline'))
+        assert_equal('', server.complete('true'))
+    server.close()
+
+
+@skip_if(ON_WINDOWS)
+def test_bash_server_keeps_state():
+    server = BashCompleteServer()
+    with mock_xonsh_env(ENV):
+        server.complete('XONSH_TEST_VAR=wakka')
+        assert_equal('wakka\n', server.complete('echo $XONSH_TEST_VAR'))
+    server.close()
+
+
+@skip_if(ON_WINDOWS)
+def test_bash_server_restarts():
+    server = BashCompleteServer()
+    with mock_xonsh_env(ENV):
+        assert_equal('', server.complete('exit 1'))
+        assert_equal('back\n', server.complete('echo back'))
+        assert_true(server.alive)
+    server.close()
+    assert_false(server.alive)
+
+
+@skip_if(ON_WINDOWS)
+def test_bash_server_timeout():
+    server = BashCompleteServer()
+    with mock_xonsh_env(ENV):
+        assert_equal('', server.complete('sleep 5; echo late', timeout=0.1))
+        assert_false(server.alive)
+        assert_equal('ok\n', server.complete('echo ok'))
+    server.close()
+
+
+def test_bash_completions_cache():
+    with tempfile.TemporaryDirectory() as d:
+        comp = os.path.join(d, 'wakka.bash')
+        with open(comp, 'w'):
+            pass
+        env = Env(XONSH_DATA_DIR=d,
+                  BASH_COMPLETIONS=[comp, os.path.join(d, 'missing')])
+        with mock_xonsh_env(env):
+            key = xonsh.completer._bash_completions_key()
+            assert_equal([[comp, os.stat(comp).st_mtime]], key)
+            load = xonsh.completer._load_bash_completions_cache
+            assert_equal(None, load(key))
+            funcs = {'wakka': '_wakka'}
+            files = {'wakka': comp}
+            xonsh.completer._save_bash_completions_cache(key, funcs, files)
+            assert_equal((funcs, files), load(key))
+            # a changed completion file invalidates the cache
+            st = os.stat(comp)
+            os.utime(comp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            newkey = xonsh.completer._bash_completions_key()
+            assert_true(newkey != key)
+            assert_equal(None, load(newkey))
+            # as does a broken one
+            with open(os.path.join(d, 'bash_completions.json'), 'w') as f:
+                f.write('{')
+            assert_equal(None, load(key))
+
+
+@skip_if(ON_WINDOWS)
+def test_complete_before_bash_ready():
+    with tempfile.TemporaryDirectory() as d:
+        comp = os.path.join(d, 'wakka.bash')
+        with open(comp, 'w'):
+            pass
+        built_ins.ENV = Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[comp],
+                            PATH=[])
+        with mock_xonsh_env(built_ins.ENV):
+            builtins.aliases = Aliases(wakka=['echo'])
+            key = xonsh.completer._bash_completions_key()
+            xonsh.completer._save_bash_completions_cache(
+                key, {'wakka': '_wakka'}, {'wakka': comp})
+            # hold the discovery back until the completions are in
+            loading = threading.Event()
+            bash_completions_key = xonsh.completer._bash_completions_key
+            def held_key():
+                loading.wait(5)
+                return bash_completions_key()
+            xonsh.completer._bash_completions_key = held_key
+            try:
+                completer = Completer()
+                paths = os.path.join(d, 'paths')
+                os.mkdir(paths)
+                with open(os.path.join(paths, 'wazoo'), 'w'):
+                    pass
+                prefix = os.path.join(paths, 'wa')
+                line = 'wakka ' + prefix
+                assert_false(completer.bash_complete_ready(0))
+                # commands fall back to path completion meanwhile
+                assert_equal(([os.path.join(paths, 'wazoo') + ' '],
+                              len(prefix)),
+                             completer.complete(prefix, line, 6, len(line)))
+                loading.set()
+                assert_true(completer.bash_complete_ready(5))
+            finally:
+                xonsh.completer._bash_completions_key = bash_completions_key
+            # and the functions come from the cache, without running bash
+            assert_true(completer.have_bash)
+            assert_equal({'wakka': '_wakka'}, completer.bash_complete_funcs)
+            assert_equal({'wakka': comp}, completer.bash_complete_files)
+
+
+def test_narrow_completions():
+    ctx = {'wakka': 1, 'wakkawakka': 2, 'wazoo': 3}
+    with tempfile.TemporaryDirectory() as d:
+        # budgets generous enough that no source is left out
+        built_ins.ENV = Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[], PATH=[],
+                            COMPLETION_BUDGETS={'python': 10, 'paths': 10})
+        with mock_xonsh_env(built_ins.ENV):
+            builtins.aliases = Aliases()
+            completer = Completer()
+            rtn, l = completer.complete('wa', 'wa', 0, 2, ctx)
+            assert_equal(['wakka', 'wakkawakka', 'wazoo'], rtn)
+            # extending the prefix narrows the last completions down
+            exp = Completer().complete('wakk', 'wakk', 0, 4, ctx)
+            assert_equal(exp, completer.narrow('wakk', 'wakk', 0, 4, ctx))
+            assert_equal(exp, completer.complete('wakk', 'wakk', 0, 4, ctx))
+            assert_equal((['wakkawakka'], 6),
+                         completer.narrow('wakkaw', 'wakkaw', 0, 6, ctx))
+            # but not across a dot, on another line, or after a new prompt
+            assert_equal(None, completer.narrow('wakkaw.', 'wakkaw.', 0, 7, ctx))
+            assert_equal(None, completer.narrow('wakkaw', 'x wakkaw', 2, 8, ctx))
+            completer.new_prompt()
+            assert_equal(None, completer.narrow('wakkaw', 'wakkaw', 0, 6, ctx))
+
+
+def test_complete_iter_budgets():
+    done = threading.Event()
+    def slow():
+        done.wait(5)
+        return {'xslow'}
+    sources = [('commands', lambda: {'xcmd'}), ('fast', lambda: {'xfast'}),
+               ('slow', slow)]
+    with tempfile.TemporaryDirectory() as d:
+        built_ins.ENV = Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[], PATH=[],
+                            COMPLETION_BUDGETS={'slow': 0.05})
+        with mock_xonsh_env(built_ins.ENV):
+            builtins.aliases = Aliases()
+            completer = Completer()
+            completer._sources = lambda *args: (sources, 1)
+            obs = list(completer.complete_iter('x', 'x', 0, 1))
+            assert_equal([(['xcmd'], 1), (['xfast'], 1)], obs)
+            assert_equal(1, completer.late['slow'])
+            # incomplete completions are not narrowed down
+            assert_equal(None, completer.narrow('xs', 'xs', 0, 2))
+            # the late source is picked up by the next identical request
+            done.set()
+            assert_equal((['xcmd', 'xfast', 'xslow'], 1),
+                         completer.complete('x', 'x', 0, 1))
+            assert_equal((['xslow'], 2), completer.narrow('xs', 'xs', 0, 2))
+            stats = completer.stats()
+            assert_equal({'commands', 'fast', 'slow'}, set(stats))
+            assert_equal(2, stats['commands']['n'])
+            assert_equal(1, stats['slow']['n'])
+            assert_equal(1, stats['slow']['late'])
+
+
+def test_complete_iter_failures_and_new_prompt():
+    done = threading.Event()
+    calls = []
+    def slow():
+        calls.append(len(calls) + 1)
+        if len(calls) == 1:
+            done.wait(5)
+        return {'xslow{0}'.format(len(calls))}
+    def broken():
+        raise ValueError('wakka')
+    sources = [('commands', lambda: {'xcmd'}), ('broken', broken),
+               ('fast', lambda: {'xfast'}), ('slow', slow)]
+    with tempfile.TemporaryDirectory() as d:
+        built_ins.ENV = Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[], PATH=[],
+                            COMPLETION_BUDGETS={'slow': 0.5, 'fast': 5,
+                                                'broken': 5})
+        with mock_xonsh_env(built_ins.ENV):
+            builtins.aliases = Aliases()
+            completer = Completer()
+            completer._sources = lambda *args: (sources, 1)
+            # a failing source is left out, and the others complete
+            assert_equal((['xcmd', 'xfast'], 1),
+                         completer.complete('x', 'x', 0, 1))
+            assert_equal(1, completer.stats()['broken']['failed'])
+            assert_equal(None, completer.narrow('xs', 'xs', 0, 2))
+            # a late source is not picked up after a command has been run
+            completer.new_prompt()
+            done.set()
+            assert_equal((['xcmd', 'xfast', 'xslow2'], 1),
+                         completer.complete('x', 'x', 0, 1))
+
+
+def test_dir_listing():
+    with tempfile.TemporaryDirectory() as d:
+        for name in ['wakka', 'Wazoo', 'jawaka']:
+            with open(os.path.join(d, name), 'w'):
+                pass
+        os.mkdir(os.path.join(d, 'WAKKAdir'))
+        listing = DirListing(d)
+        assert_equal(['wakka'], listing.startswith('wa'))
+        assert_equal({'WAKKAdir', 'wakka', 'Wazoo'},
+                     set(listing.startswith('wa', case_sensitive=False)))
+        assert_equal({'WAKKAdir'}, listing.dirs)
+        # without os.scandir, as on Python 3.4
+        have_scandir = xonsh.completer.HAVE_SCANDIR
+        xonsh.completer.HAVE_SCANDIR = False
+        try:
+            listed = DirListing(d)
+        finally:
+            xonsh.completer.HAVE_SCANDIR = have_scandir
+        assert_equal(listing.names, listed.names)
+        assert_equal(listing.dirs, listed.dirs)
+
+
+@skip_if(ON_WINDOWS)
+def test_path_complete_listing_cache():
+    with tempfile.TemporaryDirectory() as d:
+        built_ins.ENV = Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[], PATH=[],
+                            CASE_SENSITIVE_COMPLETIONS=True)
+        with mock_xonsh_env(built_ins.ENV):
+            builtins.aliases = Aliases()
+            completer = Completer()
+            # apart from the data dir, which completions may be saved to
+            d = os.path.join(d, 'paths')
+            os.mkdir(d)
+            os.mkdir(os.path.join(d, 'wakka'))
+            prefix = os.path.join(d, 'wa')
+            exp = {os.path.join(d, 'wakka') + os.sep}
+            assert_equal(exp, completer.path_complete(prefix, '', ''))
+            listing = completer._dir_listings[d]
+            assert_true(listing.racy)
+            # an entry made in the same tick as the listing leaves the mtime
+            # as it was, but a racy listing is not reused
+            with open(os.path.join(d, 'wazoo'), 'w'):
+                pass
+            st = os.stat(d)
+            os.utime(d, ns=(st.st_atime_ns, listing.mtime))
+            exp.add(os.path.join(d, 'wazoo') + ' ')
+            assert_equal(exp, completer.path_complete(prefix, '', ''))
+            # once the mtime is old enough, the listing is reused
+            mtime = st.st_mtime_ns - 2 * xonsh.completer.RACY_NS
+            os.utime(d, ns=(st.st_atime_ns, mtime))
+            assert_equal(exp, completer.path_complete(prefix, '', ''))
+            listing = completer._dir_listings[d]
+            assert_false(listing.racy)
+            assert_equal(exp, completer.path_complete(prefix, '', ''))
+            assert_true(listing is completer._dir_listings[d])
+            # a new entry changes the mtime, and so the directory is relisted
+            with open(os.path.join(d, 'wazzup'), 'w'):
+                pass
+            os.utime(d, ns=(st.st_atime_ns, mtime + 10**9))
+            exp.add(os.path.join(d, 'wazzup') + ' ')
+            assert_equal(exp, completer.path_complete(prefix, '', ''))
+
+
+class _Attrs(object):
+    evaluated = False
+    def __init__(self):
+        self.value = 1
+        self.func = len
+    @property
+    def prop(self):
+        _Attrs.evaluated = True
+        return len
+    def meth(self):
+        pass
+
+
+def test_attr_complete_static():
+    ctx = {'obj': _Attrs(), 'cls': _Attrs}
+    with tempfile.TemporaryDirectory() as d, \
+            mock_xonsh_env(Env(XONSH_DATA_DIR=d, BASH_COMPLETIONS=[],
+                               CASE_SENSITIVE_COMPLETIONS=True)):
+        completer = Completer()
+        obs = completer.attr_complete('obj.', ctx)
+        exp = {'obj.evaluated', 'obj.value', 'obj.func(', 'obj.prop',
+               'obj.meth('}
+        assert_equal(exp, obs)
+        assert_false(_Attrs.evaluated)
+        assert_equal({'cls.meth('}, completer.attr_complete('cls.me', ctx))
+        assert_equal(set(), completer.attr_complete('7.', ctx))
+        # the class is only looked through once
+        attrs = completer._static_attrs(_Attrs, instance=True)
+        completer.attr_complete('obj.v', ctx)
+        assert_true(attrs is completer._static_attrs(_Attrs, instance=True))
+
+
+if __name__ == '__main__':
+    nose.runmodule()
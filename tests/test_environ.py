@@ -2,12 +2,17 @@
 """Tests the xonsh environment."""
 from __future__ import unicode_literals, print_function
 import os
+import time
+import threading
 
 import nose
 from nose.tools import (assert_equal, assert_true, assert_not_in,
                         assert_is_instance, assert_in)
 
-from xonsh.environ import Env, format_prompt
+from xonsh.environ import Env, format_prompt, ENSURER_CACHE_SIZE, \
+    PromptFields
+
+from tools import mock_xonsh_env
 
 def test_env_normal():
     env = Env(VAR='wakka')
@@ -29,14 +34,82 @@ def test_env_detype_mutable_access_clear():
     env = Env(MYPATH=['wakka', 'jawaka'])
     assert_equal({'MYPATH': 'wakka' + os.pathsep + 'jawaka'}, env.detype())
     env['MYPATH'][0] = 'woah'
-    assert_equal(None, env._detyped)
     assert_equal({'MYPATH': 'woah' + os.pathsep + 'jawaka'}, env.detype())
 
+def test_env_detype_cached():
+    env = Env(VAR='wakka', MYPATH=['wakka'])
+    det = env.detype()
+    env.get('MYPATH')
+    assert_true(det is env.detype())
+
+def test_env_detype_incremental():
+    env = Env(VAR='wakka', MYPATH=['wakka'])
+    det = env.detype()
+    env['VAR'] = 'jawaka'
+    env['OTHER'] = 'yo'
+    del env['MYPATH']
+    assert_equal({'VAR': 'jawaka', 'OTHER': 'yo'}, env.detype())
+    # previously returned dicts are left alone
+    assert_equal({'VAR': 'wakka', 'MYPATH': 'wakka'}, det)
+
 def test_env_detype_no_dict():
     env = Env(YO={'hey': 42})
     det = env.detype()
     assert_not_in('YO', det)
 
+def test_env_ensurer_cache_bounded():
+    env = Env()
+    nensurers = len(env.ensurers)
+    for i in range(ENSURER_CACHE_SIZE + 10):
+        env['VAR{0}'.format(i)] = 'x'
+    assert_equal(nensurers, len(env.ensurers))
+    assert_equal(ENSURER_CACHE_SIZE, len(env._ensurer_cache))
+    env['MY_PATH'] = 'a' + os.pathsep + 'b'
+    assert_equal(['a', 'b'], env['MY_PATH'])
+
+def test_env_get_args():
+    env = Env(ARGS=['script', 'one'])
+    assert_equal('one', env.get('ARG1'))
+    assert_equal(None, env.get('ARGUMENT', None))
+    env['ARG1'] = 'set'
+    assert_equal('set', env.get('ARG1'))
+
+def test_env_lazy():
+    path = 'wakka' + os.pathsep + os.pathsep + 'jawaka'
+    env = Env(MYPATH=path, TEEPTY_MAX_SIZE='010')
+    assert_equal({}, env._d)
+    assert_equal(2, len(env))
+    assert_equal(['wakka', '', 'jawaka'], env['MYPATH'])
+    assert_equal(10, env['TEEPTY_MAX_SIZE'])
+    # the strings are passed on until the variables are changed
+    assert_equal({'MYPATH': path, 'TEEPTY_MAX_SIZE': '010'}, env.detype())
+    env['MYPATH'].remove('')
+    env['TEEPTY_MAX_SIZE'] = 10
+    assert_equal({'MYPATH': 'wakka' + os.pathsep + 'jawaka',
+                  'TEEPTY_MAX_SIZE': '10'}, env.detype())
+
+def test_env_lazy_del():
+    env = Env(VAR='wakka', OTHER='jawaka')
+    del env['VAR']
+    env.get('OTHER')
+    del env['OTHER']
+    assert_equal([], list(env))
+    assert_equal({}, env.detype())
+
+def test_env_lazy_iter():
+    env = Env(VAR='wakka', OTHER='jawaka', PATH='a')
+    env.get('PATH')
+    keys = []
+    for key in env:
+        # as a prompt field or completer might in another thread
+        env.get('VAR')
+        env.get('OTHER')
+        keys.append(key)
+    assert_equal({'VAR', 'OTHER', 'PATH'}, set(keys))
+    assert_equal(3, len(keys))
+    assert_equal({'VAR': 'wakka', 'OTHER': 'jawaka', 'PATH': ['a']},
+                 dict(env))
+
 def test_format_prompt():
     formatter_dict = {
         'a_string': 'cat',
@@ -72,5 +145,57 @@ def test_HISTCONTROL():
     assert_true('ignoreerr' in env['HISTCONTROL'])
     assert_true('ignoredups' in env['HISTCONTROL'])
 
+def test_prompt_fields_stale_while_revalidate():
+    fields = PromptFields()
+    changed = threading.Event()
+    fields.on_change = changed.set
+    values = ['old']
+    def slow():
+        time.sleep(0.01)
+        return values[0]
+    assert_equal('old', fields.get('slow', slow))
+    # the last value is shown, while the field is evaluated again once
+    values[0] = 'new'
+    assert_equal('old', fields.get('slow', slow))
+    fields.new_prompt()
+    assert_equal('old', fields.get('slow', slow))
+    for _ in range(500):
+        obs = fields.get('slow', slow)
+        if obs == 'new':
+            break
+        time.sleep(0.01)
+    assert_equal('new', obs)
+    assert_true(changed.is_set())
+    assert_equal(2, fields.stats()['slow']['n'])
+
+
+def test_prompt_fields_timeout():
+    fields = PromptFields()
+    changed = threading.Event()
+    fields.on_change = changed.set
+    go = threading.Event()
+    def late():
+        go.wait(5)
+        return 'late'
+    with mock_xonsh_env(Env(PROMPT_FIELD_TIMEOUTS={'late': 0.01})):
+        assert_equal(None, fields.get('late', late))
+        go.set()
+        assert_true(changed.wait(5))
+        assert_equal('late', fields.get('late', late))
+
+
+def test_prompt_fields_fast_inline():
+    fields = PromptFields()
+    calls = []
+    def fast():
+        calls.append(threading.current_thread())
+        return len(calls)
+    assert_equal(1, fields.get('fast', fast))
+    # once known to be fast, a field is called each time, on this thread
+    assert_equal(2, fields.get('fast', fast))
+    assert_equal(3, fields.get('fast', fast))
+    assert_true(calls[-1] is threading.current_thread())
+
+
 if __name__ == '__main__':
     nose.runmodule()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Tests the xonsh job table."""
+from __future__ import unicode_literals, print_function
+import time
+import signal
+import builtins
+import subprocess
+from contextlib import contextmanager
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_not_in
+
+from xonsh import jobs
+from xonsh.jobs import JobOutput
+from xonsh.tools import ON_WINDOWS
+
+from tools import skip_if
+
+
+@contextmanager
+def mock_jobs():
+    builtins.__xonsh_all_jobs__ = {}
+    builtins.__xonsh_active_job__ = None
+    yield builtins.__xonsh_all_jobs__
+    del builtins.__xonsh_all_jobs__
+    del builtins.__xonsh_active_job__
+    del jobs._finished_jobs[:]
+
+
+def _add_bg_job(cmd):
+    proc = subprocess.Popen(cmd)
+    jobs.add_job({'cmds': [cmd], 'pids': [proc.pid], 'obj': proc, 'bg': True})
+    return proc
+
+
+def test_clear_dead_jobs_polls():
+    with mock_jobs() as all_jobs:
+        proc = _add_bg_job(['python', '-c', 'pass'])
+        proc.wait()
+        jobs._clear_dead_jobs()
+        assert_equal({}, all_jobs)
+        assert_equal(None, builtins.__xonsh_active_job__)
+
+
+@skip_if(ON_WINDOWS)
+def test_sigchld_marks_bg_job_done():
+    old_handler = signal.getsignal(signal.SIGCHLD)
+    installed = jobs._sigchld_installed
+    try:
+        jobs.install_sigchld_handler()
+        with mock_jobs() as all_jobs:
+            proc = _add_bg_job(['python', '-c', 'pass'])
+            num = builtins.__xonsh_active_job__
+            t0 = time.time()
+            while all_jobs[num]['status'] != 'done' and time.time() - t0 < 10:
+                time.sleep(0.01)  # the handler runs when the sleep is interrupted
+            assert_equal('done', all_jobs[num]['status'])
+            assert_equal(0, proc.returncode)
+            assert_equal([num], jobs._finished_jobs)
+            # the job is kept until it has been reported
+            jobs._clear_dead_jobs()
+            assert_true(num in all_jobs)
+            jobs.print_finished_jobs()
+            assert_not_in(num, all_jobs)
+    finally:
+        signal.signal(signal.SIGCHLD, old_handler)
+        jobs._sigchld_installed = installed
+
+
+def test_job_output_ring():
+    out = JobOutput(maxsize=8, maxmem=100)
+    try:
+        out.write(b'abc')
+        out.write(b'defghij')
+        assert_equal(8, JobOutput.memory)
+        assert_equal(b'[... 2 bytes omitted ...]\ncdefghij', out.getvalue())
+        assert_true(not out.unread)
+    finally:
+        out.close()
+    assert_equal(0, JobOutput.memory)
+
+
+def test_job_output_spill():
+    small = JobOutput(maxsize=8, maxmem=10)
+    big = JobOutput(maxsize=8, maxmem=10)
+    try:
+        small.write(b'12345678')
+        big.write(b'abcd')
+        # over the shared budget, so the second buffer moves to a file
+        assert_equal(8, JobOutput.memory)
+        for c in b'efghijklmnopqrst':
+            big.write(bytes([c]))
+        assert_equal(8, JobOutput.memory)
+        assert_equal(b'[... 12 bytes omitted ...]\nmnopqrst', big.getvalue())
+        assert_equal(b'12345678', small.getvalue())
+    finally:
+        small.close()
+        big.close()
+    assert_equal(0, JobOutput.memory)
+
+
+def test_job_output_pipe():
+    out = JobOutput()
+    try:
+        proc = subprocess.Popen(['python', '-c', 'print("hello")'],
+                                stdout=out.fileno())
+        out.start()
+        proc.wait()
+        out._thread.join(10)
+        assert_true(out.eof)
+        assert_true(out.unread)
+        assert_equal(b'hello', out.getvalue().strip())
+        assert_true(out.done)
+    finally:
+        out.close()
+
+
+def test_jobs_output_command():
+    with mock_jobs() as all_jobs:
+        builtins.__xonsh_env__ = {'XONSH_ENCODING': 'utf-8',
+                                  'XONSH_ENCODING_ERRORS': 'strict'}
+        out = JobOutput()
+        out.write(b'built\n')
+        out.eof = True
+        proc = subprocess.Popen(['python', '-c', 'pass'])
+        proc.wait()
+        all_jobs[1] = {'cmds': [['make']], 'pids': [proc.pid], 'obj': proc,
+                       'bg': True, 'status': 'done', 'started': 0.0,
+                       'output': out}
+        try:
+            jobs._clear_dead_jobs()
+            assert_true(1 in all_jobs)  # its output has not been read yet
+            assert_equal(('built\n', None), jobs.jobs(['--output', '1']))
+            assert_not_in(1, all_jobs)
+            assert_equal('', jobs.jobs(['--output', '1'])[0])
+        finally:
+            del builtins.__xonsh_env__
+    assert_equal(0, JobOutput.memory)
+
+
+if __name__ == '__main__':
+    nose.runmodule()
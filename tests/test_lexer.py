@@ -8,10 +8,11 @@ sys.path.insert(0, os.path.abspath('..'))  # FIXME
 from pprint import pformat
 
 import nose
+from nose.tools import assert_equal, assert_in
 
 from ply.lex import LexToken
 
-from xonsh.lexer import Lexer
+from xonsh.lexer import Lexer, get_tokens
 
 LEXER_ARGS = {'lextab': 'lexer_test_table', 'debug': 0}
 
@@ -166,11 +167,27 @@ def test_float_literals():
     for s in cases:
         yield check_token, s, ['NUMBER', s, 0]
 
+def test_bang_lparen():
+    exp = [('BANG_LPAREN', '!(', 0), ('NAME', 'ls', 2), ('RPAREN', ')', 4)]
+    yield check_tokens, '!(ls)', exp
+
+def test_ne_not_bang():
+    exp = [('NAME', 'x', 0), ('NE', '!=', 2), ('NUMBER', '1', 5)]
+    yield check_tokens, 'x != 1', exp
+
 def test_ioredir():
     cases = ['2>1', 'err>out', 'o>', 'all>', 'e>o', 'e>', 'out>', '2>&1']
     for s in cases:
         yield check_tokens_subproc, s, [('IOREDIRECT', s, 2)]
 
+def test_watch():
+    seen = []
+    toks = [t.value for t in get_tokens('x = $(ls)', seen.append)]
+    assert_equal(['x', '=', '$(', 'ls', ')'], toks[:5])
+    strings = [t.string for t in seen]
+    for s in ['x', '=', '$', '(', 'ls', ')']:
+        assert_in(s, strings)
+
 
 if __name__ == '__main__':
     nose.runmodule()
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import tempfile
 
 import nose
-from nose.tools import assert_true
+from nose.tools import assert_true, assert_equal
 from nose.plugins.skip import SkipTest
 
 from xonsh.tools import ON_WINDOWS
@@ -36,5 +38,40 @@ def test_man_completion():
     assert_true('--help' in completions)
 
 
+YES_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'man1', 'yes.1.gz')
+
+
+def test_man_store():
+    rec = {'cmd': 'yes', 'path': YES_PAGE,
+           'mtime': os.stat(YES_PAGE).st_mtime, 'options': ['--yes']}
+    with tempfile.TemporaryDirectory() as d, mock_xonsh_env({}):
+        path = os.path.join(d, 'man_completions.jsonl')
+        with open(path, 'w') as f:
+            # an old record, and a torn line left by a crash
+            f.write(json.dumps(dict(rec, options=['--old'])) + '\n')
+            f.write(json.dumps(rec) + '\n{"cmd": "ls", "pa')
+        man_completer = ManCompleter(path=path)
+        # the man page has not changed, so man is not run
+        assert_equal({'--yes'}, man_completer.option_complete('--', 'yes'))
+        man_completer._append_record(dict(rec, cmd='no'))
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert_equal('no', json.loads(lines[-1])['cmd'])
+        assert_equal({'yes', 'no'}, set(ManCompleter(path=path)._records))
+
+
+def test_man_store_compact():
+    rec = {'cmd': 'yes', 'path': YES_PAGE, 'mtime': 0.0, 'options': []}
+    with tempfile.TemporaryDirectory() as d, mock_xonsh_env({}):
+        path = os.path.join(d, 'man_completions.jsonl')
+        with open(path, 'w') as f:
+            for i in range(20):
+                f.write(json.dumps(rec) + '\n')
+        ManCompleter(path=path)
+        with open(path) as f:
+            assert_equal(1, len(f.readlines()))
+
+
 if __name__ == '__main__':
     nose.runmodule()
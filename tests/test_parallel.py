@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Tests the parallel command runner."""
+from __future__ import unicode_literals, print_function
+import io
+import os
+import sys
+import builtins
+import tempfile
+import subprocess
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_false
+
+from xonsh.tools import ON_WINDOWS
+from xonsh.parallel import ParallelJobs, run_parallel, parallel, _make_cmds
+
+from tools import skip_if
+
+PY = sys.executable
+
+
+def _echo(s, delay=0.0):
+    code = 'import time; time.sleep({0}); print({1!r})'.format(delay, s)
+    return [PY, '-c', code]
+
+
+def test_make_cmds_append():
+    obs = _make_cmds(['gzip', '-9'], ['a', 'b'])
+    assert_equal([['gzip', '-9', 'a'], ['gzip', '-9', 'b']], obs)
+
+
+def test_make_cmds_slot():
+    obs = _make_cmds(['cp', '{}', '{}.bak'], ['a'])
+    assert_equal([['cp', 'a', 'a.bak']], obs)
+
+
+def test_run_parallel_keep_order():
+    out = io.StringIO()
+    cmds = [_echo('slow', 0.5), _echo('fast')]
+    rtns = run_parallel(cmds, max_procs=2, keep_order=True, stdout=out)
+    assert_equal([0, 0], rtns)
+    assert_equal('slow\nfast\n', out.getvalue())
+
+
+def test_run_parallel_finish_order():
+    out = io.StringIO()
+    cmds = [_echo('slow', 0.5), _echo('fast')]
+    run_parallel(cmds, max_procs=2, stdout=out)
+    assert_equal('fast\nslow\n', out.getvalue())
+
+
+def test_run_parallel_line_output():
+    out = io.StringIO()
+    cmds = [_echo('a'), _echo('b'), _echo('c')]
+    rtns = run_parallel(cmds, max_procs=1, output='line', stdout=out)
+    assert_equal([0, 0, 0], rtns)
+    assert_equal('a\nb\nc\n', out.getvalue())
+
+
+def test_run_parallel_failures():
+    out = io.StringIO()
+    cmds = [[PY, '-c', 'raise SystemExit(3)'], ['xonsh-no-such-command']]
+    group = ParallelJobs(cmds, stdout=out)
+    assert_equal([3, 127], group.run())
+    assert_equal(2, group.returncode)
+    assert_true('xonsh-no-such-command' in out.getvalue())
+
+
+def test_parallel_job_table():
+    builtins.__xonsh_all_jobs__ = {}
+    builtins.__xonsh_active_job__ = None
+    seen = []
+    def alias(args, stdin=None):
+        seen.append(dict(builtins.__xonsh_all_jobs__))
+        return args[0] + '\n'
+    try:
+        out = io.StringIO()
+        run_parallel([[alias, 'x']], stdout=out)
+        assert_equal('x\n', out.getvalue())
+        assert_equal([1], list(seen[0]))
+        assert_true(isinstance(seen[0][1]['obj'], ParallelJobs))
+        assert_false(seen[0][1]['bg'])
+        assert_equal({}, builtins.__xonsh_all_jobs__)
+        assert_equal(None, builtins.__xonsh_active_job__)
+    finally:
+        del builtins.__xonsh_all_jobs__
+        del builtins.__xonsh_active_job__
+
+
+def test_parallel_alias_inputs():
+    out, err = io.StringIO(), io.StringIO()
+    args = ['-k', '-j', '2', PY, '-c', 'import sys; print(sys.argv[1])',
+            ':::', 'a', 'b']
+    assert_equal(0, parallel(args, None, out, err))
+    assert_equal('a\nb\n', out.getvalue())
+
+
+def test_parallel_alias_stdin():
+    out, err = io.StringIO(), io.StringIO()
+    stdin = io.StringIO('a\n\nb\n')
+    args = ['-k', PY, '-c', 'import sys; print(sys.argv[1] * 2)']
+    assert_equal(0, parallel(args, stdin, out, err))
+    assert_equal('aa\nbb\n', out.getvalue())
+
+
+CTRL_C_ALIAS = """
+import os, sys, time, signal, threading
+from xonsh import built_ins
+built_ins.load_builtins(execer=None)
+# each input leaves a file behind, and exits 1 on SIGINT
+code = ('import sys, time, signal; '
+        'signal.signal(signal.SIGINT, lambda *a: sys.exit(1)); '
+        'open(sys.argv[1], "w").close(); time.sleep(1)')
+cmd = ['parallel', '-j', '2', sys.executable, '-c', code, ':::']
+cmd += [os.path.join(sys.argv[1], x) for x in 'abcdef']
+threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGINT)).start()
+try:
+    built_ins.run_subproc([cmd], captured=False)
+except KeyboardInterrupt:
+    print('interrupted')
+for t in threading.enumerate():
+    if t is not threading.current_thread():
+        t.join(10)
+print(''.join(sorted(os.listdir(sys.argv[1]))))
+"""
+
+
+@skip_if(ON_WINDOWS)
+def test_parallel_alias_ctrl_c():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    with tempfile.TemporaryDirectory() as d:
+        out = subprocess.check_output([PY, '-c', CTRL_C_ALIAS, d], env=env,
+                                      universal_newlines=True, timeout=30)
+    # the alias runs in a thread, yet ctrl-c still cancels the group
+    assert_equal(['interrupted', 'ab'], out.split())
+
+
+if __name__ == '__main__':
+    nose.runmodule()
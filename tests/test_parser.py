@@ -1487,6 +1487,12 @@ def test_ls_envvar_strval():
 def test_ls_envvar_listval():
     yield check_xonsh_ast, {'WAKKA': ['.', '.']}, '$(ls $WAKKA)', False
 
+def test_bang_sub():
+    yield check_xonsh_ast, {}, '!(ls)', False
+
+def test_bang_sub_space():
+    yield check_xonsh_ast, {}, '!(ls -l )', False
+
 def test_question():
     yield check_xonsh_ast, {}, 'range?'
 
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Tests the process proxies and their pipes."""
+from __future__ import unicode_literals, print_function
+from threading import Thread
+from subprocess import Popen, PIPE
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_raises
+
+from xonsh.tools import ON_WINDOWS
+from xonsh.proc import StreamPipe, ProcProxy, SimpleProcProxy, CapturedLines
+
+from tests.tools import skip_if
+
+
+def test_stream_pipe_read():
+    p = StreamPipe(bufsize=1)
+    p.write('ab')
+    p.write('c\nde\n')
+    p.write('f')
+    p.close()
+    assert_equal('a', p.read(1))
+    assert_equal('bc\n', p.readline())
+    assert_equal(['de\n', 'f'], list(p))
+    assert_equal('', p.read())
+
+
+def test_stream_pipe_chunks():
+    p = StreamPipe()
+    for s in ['one', 'two', 'three']:
+        p.write(s)
+        p.flush()
+    p.close()
+    assert_equal(['one', 'two', 'three'], list(p.chunks()))
+
+
+def test_stream_pipe_blocks_writer():
+    p = StreamPipe(maxsize=2, bufsize=1)
+
+    def writer():
+        try:
+            p.writelines(map(str, range(100)))
+        except BrokenPipeError:
+            pass
+    t = Thread(target=writer)
+    t.start()
+    assert_equal('0', p.read(1))
+    t.join(0.05)
+    assert_true(t.is_alive())
+    p.close_read()
+    t.join(1.0)
+    assert_true(not t.is_alive())
+    assert_raises(BrokenPipeError, p.write, 'x')
+
+
+def test_proc_proxy_in_process():
+    def gen(args, stdin, stdout, stderr):
+        for i in range(3):
+            print(i, file=stdout)
+
+    def upper(args, stdin, stdout, stderr):
+        assert_true(isinstance(stdin, StreamPipe))
+        for line in stdin:
+            stdout.write(line + '-')
+
+    def total(args, stdin=None):
+        return stdin.replace('\n', '')
+
+    p = StreamPipe()
+    q = StreamPipe()
+    ProcProxy(gen, [], stdout=p)
+    ProcProxy(upper, [], stdin=p, stdout=q)
+    proc = SimpleProcProxy(total, [], stdin=q, stdout=PIPE)
+    proc.wait()
+    assert_equal(b'0-1-2-', proc.stdout.read())
+    assert_equal(0, proc.returncode)
+
+
+def test_proc_proxy_reader_never_reads():
+    def gen(args, stdin, stdout, stderr):
+        stdout.write('x')
+
+    def ignore(args, stdin, stdout, stderr):
+        pass
+
+    p = StreamPipe()
+    consumer = ProcProxy(ignore, [], stdin=p)
+    consumer.join()
+    producer = ProcProxy(gen, [], stdout=p)
+    producer.join()
+    assert_equal(0, consumer.returncode)
+    assert_equal(1, producer.returncode)
+
+
+@skip_if(ON_WINDOWS)
+def test_captured_lines():
+    proc = Popen(['printf', 'a\\r\\nb\\nc'], stdout=PIPE)
+    lines = CapturedLines([proc])
+    assert_equal(None, lines.returncode)
+    assert_equal('a\n', next(lines))
+    assert_equal(['b\n', 'c'], list(lines))
+    assert_equal(0, lines.returncode)
+
+
+@skip_if(ON_WINDOWS)
+def test_captured_lines_chunks():
+    proc = Popen(['sh', '-c', 'printf "x\\n"; exit 3'], stdout=PIPE)
+    lines = CapturedLines([proc])
+    assert_equal('x\n', ''.join(lines.chunks()))
+    assert_equal(3, lines.returncode)
+
+
+@skip_if(ON_WINDOWS)
+def test_captured_lines_close_early():
+    proc = Popen(['yes'], stdout=PIPE)
+    with CapturedLines([proc]) as lines:
+        assert_equal('y\n', next(iter(lines)))
+    assert_true(lines.closed)
+    proc.wait()
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -3,10 +3,10 @@
 from __future__ import unicode_literals, print_function
 
 import nose
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_true
 
 import builtins
-from xonsh.tools import format_prompt_for_prompt_toolkit
+from xonsh.tools import format_prompt_for_prompt_toolkit, prompt_color_parts
 from xonsh.tools import TERM_COLORS
 from xonsh.environ import format_prompt, Env
 
@@ -22,5 +22,14 @@ def test_format_prompt_for_prompt_toolkit():
     assert_equal(strings, ['>>> ', '~/xonsh ', ' (main)', ''])
 
 
+def test_prompt_color_parts():
+    templ = ('{GREEN}user{BOLD_BLUE} ~ $ ')
+    prompt = format_prompt(templ, TERM_COLORS)
+    parts = prompt_color_parts(prompt)
+    assert_equal((('GREEN', 'BOLD_BLUE'), ('user', ' ~ $ ')), parts)
+    # the parts of a prompt are only worked out once
+    assert_true(parts is prompt_color_parts(prompt))
+
+
 if __name__ == '__main__':
     nose.runmodule()
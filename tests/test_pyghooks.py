@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests the incremental highlighting lexer."""
+from __future__ import unicode_literals, print_function
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_in
+
+from pygments.token import (Name, Keyword, String, Text, Operator, Number,
+                            Punctuation)
+
+from xonsh.pyghooks import IncrementalXonshLexer
+
+BLOCK = '''for i, name in enumerate(names):
+    if name.startswith('_'):
+        continue  # private
+    echo @(name) $(ls -l @(name)) > $HOME/out.txt
+    doc = """a
+    doc string"""
+'''
+
+
+def visible(tokens):
+    return [(t, v) for t, v in tokens if v.strip()]
+
+
+def test_modes():
+    lexer = IncrementalXonshLexer({'x': 1})
+    toks = visible(lexer.get_tokens('x -l\nls -l | grep x\ny = 1\ny -l'))
+    assert_equal([(Name, 'x'), (Operator, '-'), (Name, 'l'),
+                  (Name.Builtin, 'ls'), (Text, '-'), (Text, 'l'),
+                  (Operator, '|'), (Name.Builtin, 'grep'), (Text, 'x'),
+                  (Name, 'y'), (Operator, '='), (Number, '1'),
+                  (Name, 'y'), (Operator, '-'), (Name, 'l')], toks)
+
+
+def test_explicit_modes():
+    lexer = IncrementalXonshLexer()
+    toks = visible(lexer.get_tokens('print($(ls -l @(len(x))))'))
+    assert_equal([(Name.Builtin, 'print'), (Punctuation, '('),
+                  (Keyword, '$('), (Name.Builtin, 'ls'), (Text, '-'),
+                  (Text, 'l'), (Keyword, '@('), (Name.Builtin, 'len'),
+                  (Punctuation, '('), (Name, 'x'), (Punctuation, ')'),
+                  (Keyword, ')'), (Keyword, ')'), (Punctuation, ')')], toks)
+
+
+def test_incremental():
+    code = BLOCK * 50
+    lexer = IncrementalXonshLexer({'names': []})
+    line = 'cp -r $HOME/src /tmp/dst'
+    mid = code.index('    if', len(code) // 2)
+    for before, after in [(code, ''), (code[:mid], '\n' + code[mid:])]:
+        lexer.get_tokens(before + after)
+        for i in range(1, len(line) + 1):
+            text = before + line[:i] + after
+            toks = lexer.get_tokens(text)
+            assert_true(lexer.lexed <= 7, lexer.lexed)
+            assert_equal(''.join(v for _, v in toks), text)
+            fresh = IncrementalXonshLexer({'names': []}).get_tokens(text)
+            assert_equal(fresh, toks)
+
+
+def test_unterminated_string():
+    lexer = IncrementalXonshLexer()
+    toks = lexer.get_tokens('x = 1\ny = """abc\ndef')
+    assert_in((String, '"""abc'), toks)
+    assert_equal((String, 'def'), toks[-1])
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Tests the tee'd psuedo-terminal buffers."""
+from __future__ import unicode_literals, print_function
+import os
+import tempfile
+
+import nose
+from nose.tools import assert_equal, assert_true
+
+from xonsh.tools import ON_WINDOWS
+
+from tests.tools import skip_if
+
+if not ON_WINDOWS:
+    from xonsh.teepty import TeePTY, TeeBuffer
+
+
+def _sanatize_chunks(chunks, remove_color=True):
+    tpty = TeePTY(remove_color=remove_color)
+    for chunk in chunks:
+        tpty.teebuf.write(tpty._sanatize_data(chunk))
+    tpty._flush_carry()
+    return tpty.teebuf.getvalue()
+
+
+@skip_if(ON_WINDOWS)
+def test_tee_buffer_unbounded():
+    buf = TeeBuffer()
+    for i in range(100):
+        buf.write(b'0123456789')
+    assert_equal(b'0123456789' * 100, buf.getvalue())
+
+
+@skip_if(ON_WINDOWS)
+def test_tee_buffer_head_tail():
+    buf = TeeBuffer(maxsize=10)
+    buf.write(b'abc')
+    buf.write(b'defghijklmnopq')
+    buf.write(b'rst')
+    assert_equal(10, len(buf))
+    assert_equal(b'abcde\n[... 10 bytes omitted ...]\npqrst', buf.getvalue())
+
+
+@skip_if(ON_WINDOWS)
+def test_tee_buffer_utf8_boundary():
+    buf = TeeBuffer(maxsize=8)
+    buf.write('aaaébbbbbbéccc'.encode('utf-8'))
+    # the cut falls inside both two byte characters, which are dropped
+    obs = buf.getvalue().decode('utf-8')
+    assert_equal('aaa\n[... 10 bytes omitted ...]\nccc', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_sanatize_color_split():
+    obs = _sanatize_chunks([b'red: \033[0;', b'31mhot\033', b'[0m done'])
+    assert_equal(b'red: hot done', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_sanatize_keep_color():
+    obs = _sanatize_chunks([b'\033[31mhot\033[0m'], remove_color=False)
+    assert_equal(b'\033[31mhot\033[0m', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_sanatize_hidden_split():
+    obs = _sanatize_chunks([b'a\001hid', b'den\002b'])
+    assert_equal(b'ab', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_sanatize_alt_mode():
+    obs = _sanatize_chunks([b'before\033[?1049h', b'in vim\033[?10',
+                            b'49lafter'])
+    assert_equal(b'beforeafter', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_sanatize_trailing_escape():
+    obs = _sanatize_chunks([b'abc\033['])
+    assert_equal(b'abc\033[', obs)
+
+
+@skip_if(ON_WINDOWS)
+def test_open_stdin_file():
+    tpty = TeePTY()
+    with tempfile.TemporaryFile() as f:
+        assert_equal(f.fileno(), tpty._open_stdin(f))
+    assert_equal(None, tpty._stdin_fd)
+
+
+@skip_if(ON_WINDOWS)
+def test_open_stdin_feed():
+    tpty = TeePTY(bufsize=4)
+    r = tpty._open_stdin('some data')
+    try:
+        chunks = []
+        data = tpty._read_stdin_src()
+        while data:
+            os.write(tpty._stdin_fd, data)
+            chunks.append(data)
+            data = tpty._read_stdin_src()
+        tpty._close_stdin()
+        assert_equal([b'some', b' dat', b'a'], chunks)
+        assert_equal(b'some data', os.read(r, 100))
+        assert_equal(b'', os.read(r, 100))
+    finally:
+        os.close(r)
+
+
+if __name__ == '__main__':
+    nose.runmodule()
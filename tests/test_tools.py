@@ -10,7 +10,8 @@ from xonsh.lexer import Lexer
 from xonsh.tools import subproc_toks, subexpr_from_unbalanced, is_int, \
     always_true, always_false, ensure_string, is_env_path, str_to_env_path, \
     env_path_to_str, escape_windows_title_string, is_bool, to_bool, bool_to_str, \
-    ensure_int_or_slice, is_float, is_string, check_for_partial_string
+    ensure_int_or_slice, is_float, is_string, check_for_partial_string, \
+    levenshtein, FuzzyIndex
 
 LEXER = Lexer()
 LEXER.build()
@@ -311,5 +312,28 @@ def test_partial_string():
                             yield assert_equal, _res, (len(l+_test+f+l2), None, s2)
 
 
+def test_levenshtein():
+    assert_equal(3, levenshtein('kitten', 'sitting'))
+    assert_equal(0, levenshtein('', ''))
+    assert_equal(4, levenshtein('', 'wakk'))
+    # past max_dist, the distance is not worked out
+    assert_equal(float('inf'), levenshtein('kitten', 'sitting', 2))
+    assert_equal(3, levenshtein('kitten', 'sitting', 3))
+
+
+def test_fuzzy_index_search():
+    words = ['wakka', 'jawaka', 'wazoo', 'wakkawakka', 'waka', 'xonsh']
+    index = FuzzyIndex(words + ['gone'])
+    index.add('wakka')
+    index.discard('gone')
+    assert_equal(len(words), len(index))
+    assert_false('gone' in index)
+    for word in ['wakka', 'wak', 'jawaka', 'zzz', 'akkaw']:
+        for thresh in [1, 2, 2.5, 3]:
+            exp = sorted((levenshtein(word, w), w) for w in words
+                         if levenshtein(word, w) < thresh)
+            assert_equal(exp, sorted(index.search(word, thresh)))
+
+
 if __name__ == '__main__':
     nose.runmodule()
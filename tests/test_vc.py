@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Tests reading version control status for the prompt."""
+from __future__ import unicode_literals, print_function
+import os
+import shutil
+import struct
+import tempfile
+import subprocess
+
+import nose
+from nose.tools import assert_equal, assert_true, assert_false
+
+from xonsh import vc
+
+from tools import skip_if
+
+HAVE_GIT = shutil.which('git') is not None
+
+
+def _git(root, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME='x', GIT_AUTHOR_EMAIL='x@x',
+               GIT_COMMITTER_NAME='x', GIT_COMMITTER_EMAIL='x@x')
+    subprocess.check_output(['git'] + list(args), cwd=root, env=env,
+                            stderr=subprocess.STDOUT)
+
+
+def _bump(path):
+    """Moves the mtime of path on, as a later change would."""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def _make_git_repo(root):
+    _git(root, 'init', '-q', '-b', 'wakka')
+    os.mkdir(os.path.join(root, 'sub'))
+    for name in ['a', os.path.join('sub', 'b')]:
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(name)
+    _git(root, 'add', '.')
+    _git(root, 'commit', '-q', '-m', 'first')
+
+
+def _settle(root, names=('a', os.path.join('sub', 'b'))):
+    """Moves the mtimes of the files of a fresh index, and of the
+    directories, back, so that they are not racily clean.
+    """
+    for name in names:
+        st = os.stat(os.path.join(root, name))
+        os.utime(os.path.join(root, name),
+                 ns=(st.st_atime_ns, st.st_mtime_ns - 10**9))
+    for path, dirnames, _ in os.walk(root):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns,
+                           st.st_mtime_ns - 2 * vc.RACY_NS))
+    _git(root, 'status', '--porcelain')
+
+
+def test_find_repo():
+    with tempfile.TemporaryDirectory() as d:
+        os.makedirs(os.path.join(d, 'repo', '.hg'))
+        os.makedirs(os.path.join(d, 'repo', 'x', 'y'))
+        assert_equal(('hg', os.path.join(d, 'repo')),
+                     vc.find_repo(os.path.join(d, 'repo', 'x', 'y')))
+
+
+@skip_if(not HAVE_GIT)
+def test_git_branch():
+    with tempfile.TemporaryDirectory() as d:
+        _make_git_repo(d)
+        sub = os.path.join(d, 'sub')
+        assert_equal(('git', d), vc.find_repo(sub))
+        assert_equal('wakka', vc.git_branch(d))
+        _git(d, 'checkout', '-q', '-b', 'jawaka')
+        _git(d, 'pack-refs', '--all')
+        assert_equal('jawaka', vc.git_branch(d))
+        _git(d, 'checkout', '-q', '--detach')
+        with open(os.path.join(d, '.git', 'HEAD')) as f:
+            sha = f.read().strip()
+        assert_equal('({0}...)'.format(sha[:7]), vc.git_branch(d))
+
+
+@skip_if(not HAVE_GIT)
+def test_git_dirty():
+    with tempfile.TemporaryDirectory() as d:
+        _make_git_repo(d)
+        _settle(d)
+        status = vc._git_status
+        calls = []
+        def counted(root):
+            calls.append(root)
+            return status(root)
+        vc._git_status = counted
+        try:
+            assert_false(vc.git_dirty(d))
+            # git is not asked again until something changes
+            assert_false(vc.git_dirty(d))
+            assert_equal(1, len(calls))
+        finally:
+            vc._git_status = status
+        # a file that is touched but not changed
+        _bump(os.path.join(d, 'a'))
+        assert_false(vc.git_dirty(d))
+        with open(os.path.join(d, 'sub', 'b'), 'a') as f:
+            f.write('changed')
+        _bump(os.path.join(d, 'sub', 'b'))
+        assert_true(vc.git_dirty(d))
+        _git(d, 'checkout', '-q', '--', 'sub')
+        assert_false(vc.git_dirty(d))
+        # a change of mode alone
+        os.chmod(os.path.join(d, 'a'), 0o755)
+        assert_true(vc.git_dirty(d))
+        os.chmod(os.path.join(d, 'a'), 0o644)
+        assert_false(vc.git_dirty(d))
+        # a new file changes the mtime of its directory
+        with open(os.path.join(d, 'sub', 'c'), 'w'):
+            pass
+        _bump(os.path.join(d, 'sub'))
+        assert_true(vc.git_dirty(d))
+
+
+@skip_if(not HAVE_GIT)
+def test_git_untracked_dirs():
+    with tempfile.TemporaryDirectory() as d:
+        _make_git_repo(d)
+        with open(os.path.join(d, '.gitignore'), 'w') as f:
+            f.write('build/\n')
+        _git(d, 'add', '.gitignore')
+        _git(d, 'commit', '-q', '-m', 'ignore')
+        os.mkdir(os.path.join(d, 'build'))
+        with open(os.path.join(d, 'build', 'a.o'), 'w'):
+            pass
+        os.mkdir(os.path.join(d, 'emptydir'))
+        _settle(d, ['a', os.path.join('sub', 'b'), '.gitignore'])
+        assert_false(vc.git_dirty(d))
+        # a new file in a directory without tracked files
+        new = os.path.join(d, 'emptydir', 'new.txt')
+        with open(new, 'w'):
+            pass
+        _bump(os.path.join(d, 'emptydir'))
+        assert_true(vc.git_dirty(d))
+        os.remove(new)
+        _bump(os.path.join(d, 'emptydir'))
+        assert_false(vc.git_dirty(d))
+        # ignored directories are not looked at, and the work tree is only
+        # walked after git is run
+        _settle(d, [])
+        assert_false(vc.git_dirty(d))
+        status, walk = vc._git_status, vc._git_watched_dirs
+        calls = []
+        def counted(f):
+            def wrapper(*args):
+                calls.append(f)
+                return f(*args)
+            return wrapper
+        vc._git_status = counted(status)
+        vc._git_watched_dirs = counted(walk)
+        try:
+            with open(os.path.join(d, 'build', 'out'), 'w'):
+                pass
+            _bump(os.path.join(d, 'build'))
+            assert_false(vc.git_dirty(d))
+            assert_equal([], calls)
+        finally:
+            vc._git_status, vc._git_watched_dirs = status, walk
+
+
+@skip_if(not HAVE_GIT)
+def test_git_index_versions():
+    with tempfile.TemporaryDirectory() as d:
+        _make_git_repo(d)
+        for version in ['2', '3', '4']:
+            _git(d, 'update-index', '--index-version', version)
+            with open(os.path.join(d, '.git', 'index'), 'rb') as f:
+                entries = vc._parse_git_index(f.read())
+            assert_equal(['a', 'sub/b'], [e[0] for e in entries])
+            assert_equal([1, 5], [e[2] for e in entries])
+            assert_equal([0o100644] * 2, [e[3] for e in entries])
+
+
+def test_hg():
+    with tempfile.TemporaryDirectory() as d:
+        hgdir = os.path.join(d, '.hg')
+        os.mkdir(hgdir)
+        assert_equal('default', vc.hg_branch(d))
+        with open(os.path.join(hgdir, 'branch'), 'w') as f:
+            f.write('wakka\n')
+        with open(os.path.join(hgdir, 'bookmarks.current'), 'w') as f:
+            f.write('jawaka')
+        assert_equal('wakka, jawaka', vc.hg_branch(d))
+        with open(os.path.join(d, 'a'), 'w') as f:
+            f.write('a')
+        st = os.stat(os.path.join(d, 'a'))
+        def dirstate(state):
+            name = b'a'
+            return b'\0' * 40 + struct.pack('>cllll', state, 0o644, 1,
+                                            int(st.st_mtime), len(name)) + name
+        with open(os.path.join(hgdir, 'dirstate'), 'wb') as f:
+            f.write(dirstate(b'n'))
+        assert_false(vc.hg_dirty(d))
+        with open(os.path.join(hgdir, 'dirstate'), 'wb') as f:
+            f.write(dirstate(b'a'))
+        _bump(os.path.join(hgdir, 'dirstate'))
+        assert_true(vc.hg_dirty(d))
+
+
+if __name__ == '__main__':
+    nose.runmodule()
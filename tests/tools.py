@@ -11,6 +11,7 @@ from contextlib import contextmanager
 from nose.plugins.skip import SkipTest
 
 from xonsh.built_ins import ensure_list_of_strs
+from xonsh.commands_cache import CommandsCache
 
 
 VER_3_4 = (3, 4)
@@ -38,6 +39,7 @@ def mock_xonsh_env(xenv):
     builtins.__xonsh_subproc_captured__ = sp
     builtins.__xonsh_subproc_uncaptured__ = sp
     builtins.__xonsh_ensure_list_of_strs__ = ensure_list_of_strs
+    builtins.__xonsh_commands_cache__ = CommandsCache()
     builtins.evalx = eval
     builtins.execx = None
     builtins.compilex = None
@@ -54,6 +56,7 @@ def mock_xonsh_env(xenv):
     del builtins.__xonsh_subproc_captured__
     del builtins.__xonsh_subproc_uncaptured__
     del builtins.__xonsh_ensure_list_of_strs__
+    del builtins.__xonsh_commands_cache__
     del builtins.evalx
     del builtins.execx
     del builtins.compilex
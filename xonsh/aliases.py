@@ -9,7 +9,9 @@ from argparse import ArgumentParser
 
 from xonsh.dirstack import cd, pushd, popd, dirs
 from xonsh.jobs import jobs, fg, bg, kill_all_jobs
+from xonsh.commands_cache import hash_alias
 from xonsh.timings import timeit_alias
+from xonsh.parallel import parallel
 from xonsh.tools import ON_MAC, ON_WINDOWS, XonshError, to_bool
 from xonsh.history import main as history_alias
 from xonsh.replay import main as replay_main
@@ -162,6 +164,28 @@ def bang_bang(args, stdin=None):
     return bang_n(['-1'])
 
 
+def completion_stats(args, stdin=None):
+    """Shows how long each source of tab-completions has recently taken, in
+    milliseconds, and how many times it ran over its budget or failed.
+    """
+    shell = getattr(builtins, '__xonsh_shell__', None)
+    if shell is None:
+        return None, 'xonsh: completion-stats: no interactive shell\n'
+    stats = shell.completer.stats()
+    if len(stats) == 0:
+        return 'completion-stats: no completions yet\n', None
+    row = '{0:<10}{1:>6}{2:>10}{3:>10}{4:>10}{5:>6}{6:>8}\n'
+    out = [row.format('source', 'n', 'median', 'p95', 'max', 'late',
+                      'failed')]
+    for name in sorted(stats):
+        s = stats[name]
+        ms = ['{0:.1f}'.format(s[k] * 1e3) if s[k] is not None else '-'
+              for k in ('median', 'p95', 'max')]
+        cols = [name, s['n']] + ms + [s['late'], s['failed']]
+        out.append(row.format(*cols))
+    return ''.join(out), None
+
+
 DEFAULT_ALIASES = {
     'cd': cd,
     'pushd': pushd,
@@ -170,6 +194,7 @@ DEFAULT_ALIASES = {
     'jobs': jobs,
     'fg': fg,
     'bg': bg,
+    'hash': hash_alias,
     'EOF': exit,
     'exit': exit,
     'quit': exit,
@@ -182,6 +207,8 @@ DEFAULT_ALIASES = {
     '!!': bang_bang,
     '!n': bang_n,
     'timeit': timeit_alias,
+    'completion-stats': completion_stats,
+    'parallel': parallel,
     'scp-resume': ['rsync', '--partial', '-h', '--progress', '--rsh=ssh'],
     'ipynb': ['ipython', 'notebook', '--no-browser'],
 }
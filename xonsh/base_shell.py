@@ -9,7 +9,8 @@ import builtins
 from xonsh.tools import XonshError, escape_windows_title_string, ON_WINDOWS, \
     print_exception
 from xonsh.completer import Completer
-from xonsh.environ import multiline_prompt, format_prompt
+from xonsh.environ import multiline_prompt, format_prompt, PROMPT_FIELDS
+from xonsh.jobs import print_finished_jobs
 
 
 class _TeeOut(object):
@@ -216,6 +217,10 @@ class BaseShell(object):
                     print_exception()
                     self.mlprompt = '<multiline prompt error> '
             return self.mlprompt
+        print_finished_jobs()
+        builtins.__xonsh_commands_cache__.new_prompt()
+        self.completer.new_prompt()
+        PROMPT_FIELDS.new_prompt()
         env = builtins.__xonsh_env__  # pylint: disable=no-member
         p = env.get('PROMPT')
         try:
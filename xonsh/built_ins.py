@@ -16,20 +16,23 @@ import builtins
 import subprocess
 from io import TextIOWrapper, StringIO
 from glob import glob, iglob
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE, STDOUT, DEVNULL
 from contextlib import contextmanager
 from collections import Sequence, MutableMapping, Iterable, namedtuple, \
     MutableSequence, MutableSet
 
 from xonsh.tools import suggest_commands, XonshError, ON_POSIX, ON_WINDOWS, \
-    string_types, expandvars
+    string_types, expandvars, VER_FULL, VER_3_11
 from xonsh.inspectors import Inspector
 from xonsh.environ import Env, default_env, locate_binary
 from xonsh.aliases import DEFAULT_ALIASES
-from xonsh.jobs import add_job, wait_for_active_job
-from xonsh.proc import ProcProxy, SimpleProcProxy, TeePTYProc
+from xonsh.jobs import add_job, wait_for_active_job, cancel_thread_jobs, \
+    JobOutput
+from xonsh.proc import (ProcProxy, SimpleProcProxy, TeePTYProc, StreamPipe,
+                        CapturedLines)
 from xonsh.history import History
 from xonsh.foreign_shells import load_foreign_aliases
+from xonsh.commands_cache import CommandsCache
 
 ENV = None
 BUILTINS_LOADED = False
@@ -285,18 +288,7 @@ RE_SHEBANG = re.compile(r'#![ \t]*(.+?)$')
 def _get_runnable_name(fname):
     if os.path.isfile(fname) and fname != os.path.basename(fname):
         return fname
-    for d in builtins.__xonsh_env__.get('PATH'):
-        if os.path.isdir(d):
-            files = os.listdir(d)
-            if ON_WINDOWS:
-                PATHEXT = builtins.__xonsh_env__.get('PATHEXT')
-                for dirfile in files:
-                    froot, ext = os.path.splitext(dirfile)
-                    if fname == froot and ext.upper() in PATHEXT:
-                        return os.path.join(d, dirfile)
-            if fname in files:
-                return os.path.join(d, fname)
-    return None
+    return builtins.__xonsh_commands_cache__.lookup(fname)
 
 
 def _is_binary(fname, limit=80):
@@ -380,6 +372,20 @@ def _subproc_pre():
     signal.signal(signal.SIGTSTP, lambda n, f: signal.pause())
 
 
+def _subproc_pre_kwargs():
+    """The keyword arguments to Popen that start a subprocess in its own
+    process group, with the default action for SIGTSTP. Where Popen can set
+    the process group itself, no Python code has to run in the child, so it
+    is started with vfork and the cost does not grow with the size of the
+    shell. SIGTSTP needs no care then, unless the shell ignores it, since
+    signals that are caught are reset to their default by exec.
+    """
+    if VER_FULL >= VER_3_11 and \
+            signal.getsignal(signal.SIGTSTP) not in (signal.SIG_IGN, None):
+        return {'process_group': 0}
+    return {'preexec_fn': _subproc_pre}
+
+
 _REDIR_NAME = "(o(?:ut)?|e(?:rr)?|a(?:ll)?|&?\d?)"
 _REDIR_REGEX = re.compile("{r}(>?>|<){r}$".format(r=_REDIR_NAME))
 _MODES = {'>>': 'a', '>': 'w', '<': 'r'}
@@ -475,6 +481,17 @@ def _redirect_io(streams, r, loc=None):
         raise XonshError('Unrecognized redirection command: {}'.format(r))
 
 
+def _next_is_callable_alias(cmds):
+    """Returns whether the first command in cmds is a callable alias, in
+    which case it can read from an in-process pipe.
+    """
+    for cmd in cmds:
+        if isinstance(cmd, string_types):
+            continue
+        return len(cmd) > 0 and callable(builtins.aliases.get(cmd[0], None))
+    return False
+
+
 def run_subproc(cmds, captured=True):
     """Runs a subprocess, in its many forms. This takes a list of 'commands,'
     which may be a list of command line arguments or a string, representing
@@ -486,7 +503,12 @@ def run_subproc(cmds, captured=True):
 
         [['ls'], '|', ['grep', 'wakka']]
 
-    Lastly, the captured argument affects only the last real command.
+    Lastly, the captured argument affects only the last real command. If it
+    is 'iter', the output is not waited for but returned as a CapturedLines
+    iterator, which decodes it as it is written. These commands are not
+    made a job, and stay in the shell's process group, so that they get
+    ctrl-c while the shell iterates. As they cannot have the terminal, their
+    input is /dev/null unless it is redirected.
     """
     global ENV
     background = False
@@ -498,6 +520,10 @@ def run_subproc(cmds, captured=True):
     prev = None
     procs = []
     prev_proc = None
+    job_output = None
+    if background and not captured and ENV.get('XONSH_JOB_OUTPUT'):
+        job_output = JobOutput(maxsize=ENV.get('XONSH_JOB_OUTPUT_SIZE'),
+                               maxmem=ENV.get('XONSH_JOB_OUTPUT_MEMORY'))
     for ix, cmd in enumerate(cmds):
         stdin = None
         stdout = None
@@ -525,6 +551,8 @@ def run_subproc(cmds, captured=True):
             stdin = streams['stdin']
         elif prev_proc is not None:
             stdin = prev_proc.stdout
+        elif captured == 'iter':
+            stdin = DEVNULL
         # set standard output
         if 'stdout' in streams:
             if ix != last_cmd:
@@ -571,6 +599,13 @@ def run_subproc(cmds, captured=True):
             else:
                 e = 'Expected callable with 2 or 4 arguments, not {}'
                 raise XonshError(e.format(numargs))
+            if (cls is SimpleProcProxy and stdout is PIPE
+                    and ix != last_cmd
+                    and _next_is_callable_alias(cmds[ix+1:])):
+                # Hand the returned string straight to the next alias. Line
+                # by line writers are left on an OS pipe, whose buffered
+                # writes are done in C.
+                stdout = StreamPipe()
             proc = cls(aliased_cmd, cmd[1:],
                        stdin, stdout, stderr,
                        universal_newlines=uninew)
@@ -580,8 +615,14 @@ def run_subproc(cmds, captured=True):
                      ENV.get('XONSH_STORE_STDOUT', False)
             cls = TeePTYProc if usetee else Popen
             subproc_kwargs = {}
-            if ON_POSIX and cls is Popen:
-                subproc_kwargs['preexec_fn'] = _subproc_pre
+            if ON_POSIX and cls is Popen and captured != 'iter':
+                subproc_kwargs.update(_subproc_pre_kwargs())
+            if job_output is not None:
+                # keep the job from writing over the interactive terminal
+                if stdout is None:
+                    stdout = job_output.fileno()
+                if stderr is None:
+                    stderr = job_output.fileno()
             try:
                 proc = cls(aliased_cmd,
                            universal_newlines=uninew,
@@ -597,23 +638,35 @@ def run_subproc(cmds, captured=True):
                 cmd = aliased_cmd[0]
                 e = 'xonsh: subprocess mode: command not found: {0}'.format(cmd)
                 sug = suggest_commands(cmd, ENV, builtins.aliases)
-                if len(sug.strip()) > 0:
-                    e += '\n' + suggest_commands(cmd, ENV, builtins.aliases)
+                if sug is not None and len(sug.strip()) > 0:
+                    e += '\n' + sug
                 raise XonshError(e)
         procs.append(proc)
         prev = None
         prev_proc = proc
-    for proc in procs[:-1]:
+    for proc, nextproc in zip(procs[:-1], procs[1:]):
+        if isinstance(nextproc, ProcProxy):
+            # the alias reads from this very object, not from a copy
+            continue
         try:
             proc.stdout.close()
         except OSError:
             pass
+    if job_output is not None:
+        if prev_is_proxy:
+            # there is no job to keep it with
+            job_output.to_terminal()
+        job_output.start()
+    if captured == 'iter':
+        return CapturedLines(procs, encoding=ENV.get('XONSH_ENCODING'),
+                             errors=ENV.get('XONSH_ENCODING_ERRORS'))
     if not prev_is_proxy:
         add_job({
             'cmds': cmds,
             'pids': [i.pid for i in procs],
             'obj': prev_proc,
-            'bg': background
+            'bg': background,
+            'output': job_output,
         })
     if ENV.get('XONSH_INTERACTIVE') and not ENV.get('XONSH_STORE_STDOUT'):
         # set title here to get current command running
@@ -624,7 +677,11 @@ def run_subproc(cmds, captured=True):
     if background:
         return
     if prev_is_proxy:
-        prev_proc.wait()
+        try:
+            prev_proc.wait()
+        except KeyboardInterrupt:
+            cancel_thread_jobs(procs)
+            raise
     wait_for_active_job()
     hist = builtins.__xonsh_history__
     hist.last_cmd_rtn = prev_proc.returncode
@@ -651,6 +708,13 @@ def subproc_captured(*cmds):
     return run_subproc(cmds, captured=True)
 
 
+def subproc_captured_iter(*cmds):
+    """Runs a subprocess, capturing the output lazily. Returns an iterator
+    over the lines of stdout, which are decoded as they are produced.
+    """
+    return run_subproc(cmds, captured='iter')
+
+
 def subproc_uncaptured(*cmds):
     """Runs a subprocess, without capturing the output. Returns the stdout
     that was produced as a str.
@@ -691,10 +755,12 @@ def load_builtins(execer=None):
         del builtins.quit
     builtins.__xonsh_subproc_captured__ = subproc_captured
     builtins.__xonsh_subproc_uncaptured__ = subproc_uncaptured
+    builtins.__xonsh_subproc_captured_iter__ = subproc_captured_iter
     builtins.__xonsh_execer__ = execer
     builtins.__xonsh_all_jobs__ = {}
     builtins.__xonsh_active_job__ = None
     builtins.__xonsh_ensure_list_of_strs__ = ensure_list_of_strs
+    builtins.__xonsh_commands_cache__ = CommandsCache()
     # public built-ins
     builtins.evalx = None if execer is None else execer.eval
     builtins.execx = None if execer is None else execer.exec
@@ -738,6 +804,7 @@ def unload_builtins():
              '__xonsh_pyquit__',
              '__xonsh_subproc_captured__',
              '__xonsh_subproc_uncaptured__',
+             '__xonsh_subproc_captured_iter__',
              '__xonsh_execer__',
              'evalx',
              'execx',
@@ -746,6 +813,7 @@ def unload_builtins():
              '__xonsh_all_jobs__',
              '__xonsh_active_job__',
              '__xonsh_ensure_list_of_strs__',
+             '__xonsh_commands_cache__',
              '__xonsh_history__',
              ]
     for name in names:
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""A hash table of the commands available on $PATH, similar to bash's hash
+builtin. Directories are only re-listed when their modification time changes.
+"""
+import os
+import builtins
+from bisect import bisect_left
+from argparse import ArgumentParser
+
+from xonsh.tools import ON_WINDOWS, FuzzyIndex
+
+
+class CommandsCache(object):
+    """Maps command names to their full paths for every directory in $PATH.
+
+    Each directory is listed once and then only re-listed when its mtime
+    changes. Directories earlier in $PATH take precedence, as with a normal
+    path search. On Windows, commands may also be looked up without any of the
+    extensions in $PATHEXT.
+
+    Once new_prompt() has been called, as the shell does before each prompt,
+    the directories are only checked once per prompt, rather than on every
+    call, unless $PATH itself changes or a command is not found.
+
+    Names close to a misspelt command are found with fuzzy(), from an index
+    that is built on first use and then only has new names added to it.
+    """
+
+    def __init__(self):
+        self._dirs = {}  # dir -> (mtime, {name: full path})
+        self._path = None
+        self._pathext = None
+        self._table = {}
+        self._names = frozenset()
+        self._sorted = None  # (names, lowercase names, names by lowercase)
+        self._index = None  # FuzzyIndex of lowercase names
+        self._indexed = set()  # the lowercase names in the index
+        self._bylow = None  # lowercase name -> names
+        self._per_prompt = False
+        self._checked = False
+        self.hits = {}
+
+    def new_prompt(self):
+        """Marks the start of a new prompt, after which the directories are
+        checked again, once.
+        """
+        self._per_prompt = True
+        self._checked = False
+
+    def _scan_dir(self, d, pathext):
+        """Lists a single directory, returning its name table."""
+        names = {}
+        try:
+            files = os.listdir(d)
+        except OSError:
+            return names
+        if ON_WINDOWS:
+            stripped = {}
+            for f in files:
+                names[f] = os.path.join(d, f)
+                froot, ext = os.path.splitext(f)
+                if ext.upper() in pathext and froot not in stripped:
+                    stripped[froot] = names[f]
+            names.update(stripped)
+        else:
+            for f in files:
+                names[f] = os.path.join(d, f)
+        return names
+
+    def update(self, force=False):
+        """Brings the table up to date with $PATH, re-listing only the
+        directories whose mtime has changed. Returns True if the table changed.
+        If the directories were already checked since the last prompt, they
+        are only checked again if $PATH changed or force is True.
+        """
+        env = builtins.__xonsh_env__
+        path = tuple(env.get('PATH', ()))
+        pathext = frozenset(env.get('PATHEXT', ())) if ON_WINDOWS else None
+        changed = path != self._path or pathext != self._pathext
+        if not changed and not force and self._per_prompt and self._checked:
+            return False
+        self._checked = True
+        if pathext != self._pathext:
+            self._dirs.clear()
+        dirs = {}
+        for d in path:
+            if d in dirs:
+                continue
+            try:
+                mtime = os.stat(d).st_mtime
+            except OSError:
+                continue
+            cached = self._dirs.get(d)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, self._scan_dir(d, pathext))
+                changed = True
+            dirs[d] = cached
+        if len(dirs) != len(self._dirs):
+            changed = True
+        self._dirs = dirs
+        self._path = path
+        self._pathext = pathext
+        if changed:
+            table = {}
+            for d in reversed(path):
+                if d in dirs:
+                    table.update(dirs[d][1])
+            self._table = table
+            self._names = frozenset(table)
+            self._sorted = None
+            self._bylow = None
+            if self._index is not None:
+                self._update_index()
+        return changed
+
+    def _update_index(self):
+        """Adds the names that are new since the index was last updated, and
+        removes those that are gone.
+        """
+        lows = {n.lower() for n in self._names}
+        for low in self._indexed - lows:
+            self._index.discard(low)
+        for low in lows - self._indexed:
+            self._index.add(low)
+        self._indexed = lows
+
+    def lookup(self, name, hit=True):
+        """Returns the full path to the command name, or None if it is not on
+        $PATH. If hit is True, the lookup is counted towards the hits that
+        the hash command reports.
+        """
+        self.update()
+        fname = self._table.get(name)
+        if fname is None and self._per_prompt:
+            # it may have been installed since the last prompt
+            self.update(force=True)
+            fname = self._table.get(name)
+        if hit and fname is not None:
+            self.hits[name] = self.hits.get(name, 0) + 1
+        return fname
+
+    def all_commands(self):
+        """Returns a frozenset of every command name on $PATH. The same object
+        is returned for as long as the table does not change.
+        """
+        self.update()
+        return self._names
+
+    def startswith(self, prefix, case_sensitive=True):
+        """Returns a sorted list of the command names that start with prefix,
+        found by bisection in a sorted index. Without case_sensitive, names
+        that start with prefix when both are lowercased are returned too.
+        """
+        self.update()
+        if self._sorted is None:
+            names = sorted(self._names)
+            bylow = sorted((n.lower(), n) for n in names)
+            self._sorted = (names, [low for low, _ in bylow],
+                            [n for _, n in bylow])
+        names, lows, bylow = self._sorted
+        if case_sensitive:
+            keys, vals = names, names
+        else:
+            keys, vals, prefix = lows, bylow, prefix.lower()
+        i = j = bisect_left(keys, prefix)
+        n = len(keys)
+        while j < n and keys[j].startswith(prefix):
+            j += 1
+        return vals[i:j]
+
+    def fuzzy(self, name, thresh):
+        """Returns a list of (distance, command name) pairs for the commands
+        whose lowercase names are less than thresh edits away from the
+        lowercase name.
+        """
+        self.update()
+        if self._index is None:
+            self._index = FuzzyIndex()
+            self._update_index()
+        if self._bylow is None:
+            bylow = {}
+            for n in self._names:
+                bylow.setdefault(n.lower(), []).append(n)
+            self._bylow = bylow
+        rtn = []
+        for d, low in self._index.search(name.lower(), thresh):
+            rtn.extend((d, n) for n in self._bylow.get(low, ()))
+        return rtn
+
+    def items(self):
+        """Iterates over (name, full path) pairs of every command on $PATH."""
+        self.update()
+        return self._table.items()
+
+    def clear(self):
+        """Forgets every directory listing, and all hit counts."""
+        self._dirs.clear()
+        self._path = None
+        self._table = {}
+        self._names = frozenset()
+        self._sorted = None
+        self._index = None
+        self._indexed = set()
+        self._bylow = None
+        self._checked = False
+        self.hits.clear()
+
+    def __contains__(self, name):
+        return name in self.all_commands()
+
+    def __len__(self):
+        return len(self.all_commands())
+
+
+_HASH_PARSER = None
+
+
+def _ensure_hash_parser():
+    global _HASH_PARSER
+    if _HASH_PARSER is not None:
+        return _HASH_PARSER
+    desc = ('Displays or resets the table of commands that have been looked '
+            'up on $PATH.')
+    parser = ArgumentParser('hash', description=desc)
+    parser.add_argument('-r', action='store_true', default=False,
+                        dest='reset', help='forget all remembered locations')
+    parser.add_argument('names', nargs='*',
+                        help='commands to look up and remember')
+    _HASH_PARSER = parser
+    return parser
+
+
+def hash_alias(args, stdin=None):
+    """xonsh command: hash
+
+    With no arguments, lists the commands that have been run along with how
+    often they were found. Names given as arguments are looked up anew, and -r
+    resets the table.
+    """
+    cache = builtins.__xonsh_commands_cache__
+    ns = _ensure_hash_parser().parse_args(args)
+    if ns.reset:
+        cache.clear()
+    err = []
+    for name in ns.names:
+        cache.hits.pop(name, None)
+        if cache.lookup(name, hit=False) is None:
+            err.append('xonsh: hash: {0}: not found\n'.format(name))
+        else:
+            cache.hits[name] = 0
+    if ns.reset or ns.names:
+        return None, ''.join(err) or None
+    if len(cache.hits) == 0:
+        return 'hash: hash table empty\n', None
+    out = ['hits\tcommand\n']
+    for name in sorted(cache.hits):
+        fname = cache.lookup(name, hit=False)
+        if fname is not None:
+            out.append('{0:4d}\t{1}\n'.format(cache.hits[name], fname))
+    return ''.join(out), None
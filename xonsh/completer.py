@@ -4,10 +4,20 @@ import os
 import re
 import ast
 import sys
+import json
+import time
 import shlex
-import pickle
+import types
+import select
+import inspect
+import weakref
 import builtins
+import itertools
 import subprocess
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from xonsh.built_ins import iglobpath, expand_path
 from xonsh.tools import subexpr_from_unbalanced, get_sep, check_for_partial_string, RE_STRING_START
@@ -17,6 +27,15 @@ from xonsh.tools import ON_WINDOWS
 RE_DASHF = re.compile(r'-F\s+(\w+)')
 RE_ATTR = re.compile(r'(\S+(\..+)*)\.(\w*)$')
 RE_WIN_DRIVE = re.compile(r'^([a-zA-Z]):\\')
+RE_WORD_CHARS = re.compile(r'[\w-]*\Z')
+RE_GLOB_MAGIC = re.compile(r'[*?[]')
+
+HAVE_SCANDIR = hasattr(os, 'scandir')
+
+# how far apart the mtime of a directory and the time it was listed have to
+# be for the listing to be trusted, as mtimes are only updated once a tick,
+# or on some file systems once a second
+RACY_NS = 2 * 10**9
 
 
 def _path_from_partial_string(inp, pos=None):
@@ -59,24 +78,30 @@ XONSH_TOKENS = {
     'pass', 'raise ', 'return ', 'try:', 'while ', 'with ', 'yield ', '+', '-',
     '/', '//', '%', '**', '|', '&', '~', '^', '>>', '<<', '<', '<=', '>', '>=',
     '==', '!=', '->', '=', '+=', '-=', '*=', '/=', '%=', '**=', '>>=', '<<=',
-    '&=', '^=', '|=', '//=', ',', ';', ':', '?', '??', '$(', '${', '$[', '..',
-    '...'
+    '&=', '^=', '|=', '//=', ',', ';', ':', '?', '??', '$(', '${', '$[', '!(',
+    '..', '...'
 }
 
 COMPLETION_SKIP_TOKENS = {'sudo', 'time', 'man'}
 
 COMPLETION_WRAP_TOKENS = {' ',',','[',']','(',')','{','}'}
 
-BASH_COMPLETE_SCRIPT = """source {filename}
-COMP_WORDS=({line})
+# the seconds that each source of completions may take, by default; bash
+# completion gets $BASH_COMPLETE_TIMEOUT
+DEFAULT_COMPLETION_BUDGETS = {'python': 0.2, 'paths': 0.5, 'man': 1.0}
+
+BASH_COMPLETE_BODY = """COMP_WORDS=({line})
 COMP_LINE={comp_line}
 COMP_POINT=${{#COMP_LINE}}
 COMP_COUNT={end}
 COMP_CWORD={n}
-{func} {cmd} {prefix} {prev}
+COMPREPLY=()
+{func} {cmd} {prefix} {prev} </dev/null
 for ((i=0;i<${{#COMPREPLY[*]}};i++)) do echo ${{COMPREPLY[i]}}; done
 """
 
+BASH_COMPLETE_SCRIPT = "source {filename}\n" + BASH_COMPLETE_BODY
+
 WS = set(' \t\r\n')
 
 def startswithlow(x, start, startlow=None):
@@ -127,24 +152,127 @@ def completionwrap(s):
            if s[-1:].isalnum() else
            s)
 
+class DirListing(object):
+    """The entries of a directory, listed with os.scandir where there is one
+    (Python 3.5+), and sorted so that the names that start with a prefix are
+    found by bisection. A listing is racy if the directory was changed so
+    shortly before it was listed that a later change may leave its mtime as
+    it is, in which case the listing is not to be reused.
+    """
+
+    def __init__(self, path):
+        """Lists the directory at path, which raises OSError if it cannot be
+        listed.
+        """
+        listed = int(time.time() * 10**9)
+        self.mtime = os.stat(path).st_mtime_ns
+        self.racy = self.mtime >= listed - RACY_NS
+        names = []
+        dirs = set()
+        if HAVE_SCANDIR:
+            for e in os.scandir(path):
+                names.append(e.name)
+                try:
+                    if e.is_dir():
+                        dirs.add(e.name)
+                except OSError:
+                    pass
+        else:
+            for name in os.listdir(path):
+                names.append(name)
+                if os.path.isdir(os.path.join(path, name)):
+                    dirs.add(name)
+        names.sort()
+        self.names = names
+        self.dirs = dirs
+        self._folded = None
+
+    def startswith(self, prefix, case_sensitive=True):
+        """Returns a list of the names that start with prefix. Without
+        case_sensitive, the names and prefix are compared casefolded.
+        """
+        if case_sensitive:
+            keys, names = self.names, self.names
+        else:
+            if self._folded is None:
+                folded = list(map(str.casefold, self.names))
+                order = sorted(range(len(folded)), key=folded.__getitem__)
+                self._folded = ([folded[i] for i in order],
+                                [self.names[i] for i in order])
+            keys, names = self._folded
+            prefix = prefix.casefold()
+        i = j = bisect_left(keys, prefix)
+        n = len(keys)
+        while j < n and keys[j].startswith(prefix):
+            j += 1
+        return names[i:j]
+
+
 class Completer(object):
     """This provides a list of optional completions for the xonsh shell."""
 
     def __init__(self):
-        # initialize command cache
-        self._path_checksum = None
-        self._alias_checksum = None
-        self._path_mtime = -1
-        self._cmds_cache = frozenset()
         self._man_completer = ManCompleter()
-        try:
-            # FIXME this could be threaded for faster startup times
-            self._load_bash_complete_funcs()
-            # or we could make this lazy
-            self._load_bash_complete_files()
-            self.have_bash = True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            self.have_bash = False
+        # bash completions are discovered in the background, until they are
+        # ready, commands simply fall back to path completion.
+        self.bash_complete_funcs = {}
+        self.bash_complete_files = {}
+        self.have_bash = False
+        self._bash_ready = threading.Event()
+        self._bash_server = None
+        t = threading.Thread(target=self._load_bash_complete, daemon=True)
+        t.start()
+        # the last request: (context key, prefix, completions), or None
+        self._session = None
+        # absolute directory path -> DirListing, least recently used first
+        self._dir_listings = OrderedDict()
+        # (id of a module or type, instance) -> (weakref, size of its
+        # __dict__, {attribute name: whether it is callable})
+        self._attr_cache = OrderedDict()
+        # sources other than commands run here, within their budgets
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self._lock = threading.Lock()
+        # (source name, request) -> future of a source that ran late
+        self._late = OrderedDict()
+        # source name -> recent latencies in seconds, times ran late, and
+        # times failed
+        self.latencies = defaultdict(lambda: deque(maxlen=100))
+        self.late = Counter()
+        self.failed = Counter()
+
+    def new_prompt(self):
+        """Forgets the last completions, and those of sources that ran late,
+        which may be out of date once a command has been run.
+        """
+        self._session = None
+        with self._lock:
+            self._late.clear()
+
+    def _session_key(self, line, begidx, endidx, ctx):
+        return (line[:begidx], line[endidx:], id(ctx), os.getcwd(),
+                builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS'),
+                len(self.bash_complete_funcs))
+
+    def narrow(self, prefix, line, begidx, endidx, ctx=None):
+        """Returns the completions of prefix by filtering those of the last
+        request, if it was for a shorter prefix in the same place, and if
+        prefix only adds word characters to it. Otherwise returns None.
+        """
+        session = self._session
+        if session is None:
+            return None
+        key, last, rtn = session
+        if not prefix.startswith(last) or \
+                not RE_WORD_CHARS.match(prefix, len(last)) or \
+                key != self._session_key(line, begidx, endidx, ctx):
+            return None
+        if len(prefix) > len(last):
+            csc = key[4]
+            startswither = startswithnorm if csc else startswithlow
+            prefixlow = prefix.lower()
+            rtn = [s for s in rtn if startswither(s, prefix, prefixlow)]
+            self._session = (key, prefix, rtn)
+        return rtn, len(prefix)
 
     def complete(self, prefix, line, begidx, endidx, ctx=None):
         """Complete the string, given a possible execution context.
@@ -170,6 +298,90 @@ class Completer(object):
             Length of the prefix to be replaced in the completion
             (only used with prompt_toolkit)
         """
+        rtn = set()
+        lprefix = len(prefix)
+        for comps, lprefix in self.complete_iter(prefix, line, begidx,
+                                                 endidx, ctx):
+            rtn.update(comps)
+        return sorted(rtn), lprefix
+
+    def complete_iter(self, prefix, line, begidx, endidx, ctx=None):
+        """Completes the string like complete(), but yields the completions
+        of each source as soon as they are found, as (completions, lprefix)
+        pairs. Commands are completed right away, while the other sources run
+        in worker threads, each for at most its budget in
+        $COMPLETION_BUDGETS. A source that runs over its budget is left out,
+        and carries on in the background, so that its completions are ready
+        when the same prefix is completed again. A source that fails is left
+        out as well.
+        """
+        narrowed = self.narrow(prefix, line, begidx, endidx, ctx)
+        if narrowed is not None:
+            yield narrowed
+            return
+        sources, lprefix = self._sources(prefix, line, begidx, endidx, ctx)
+        reqkey = (prefix, line, begidx, endidx, id(ctx), os.getcwd())
+        budgets = self._budgets()
+        seen = set()
+        pending = {}
+        complete = True
+        now = time.monotonic()
+        for name, func in sources:
+            if name == 'commands':
+                try:
+                    rtn = self._timed(name, func)
+                except Exception:  # pylint:disable=broad-except
+                    self._fail(name)
+                    complete = False
+                    continue
+                seen.update(rtn)
+                yield sorted(rtn), lprefix
+                continue
+            with self._lock:
+                fut = self._late.pop((name, reqkey), None)
+            if fut is None:
+                fut = self._executor.submit(self._timed, name, func)
+            pending[fut] = (name, now + budgets.get(name, 1.0))
+        while pending:
+            deadline = min(d for _, d in pending.values())
+            timeout = max(0.0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=timeout,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, _ = pending.pop(fut)
+                try:
+                    rtn = fut.result() - seen
+                except Exception:  # pylint:disable=broad-except
+                    self._fail(name)
+                    complete = False
+                    continue
+                seen.update(rtn)
+                if len(rtn) > 0:
+                    yield sorted(rtn), lprefix
+            now = time.monotonic()
+            for fut, (name, deadline) in list(pending.items()):
+                if deadline <= now:
+                    del pending[fut]
+                    complete = False
+                    self._keep_late(name, reqkey, fut)
+        if len(seen) == 0:
+            yield [], lprefix
+        # completions can only be narrowed if they are all there, and plain
+        # extensions of the prefix, e.g. not quoted or expanded paths
+        self._session = None
+        if complete and len(prefix) > 0 and lprefix == len(prefix):
+            csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
+            startswither = startswithnorm if csc else startswithlow
+            prefixlow = prefix.lower()
+            if all(startswither(s, prefix, prefixlow) for s in seen):
+                key = self._session_key(line, begidx, endidx, ctx)
+                self._session = (key, prefix, sorted(seen))
+
+    def _sources(self, prefix, line, begidx, endidx, ctx=None):
+        """Works out where the completions of the string come from. Returns
+        a list of (source name, function) pairs, where each function returns
+        a set of completions, and the length of the prefix to be replaced.
+        """
         space = ' '  # intern some strings for faster appending
         slash = '/'
         dot = '.'
@@ -195,11 +407,12 @@ class Completer(object):
             line = line.split(' ', 1)[1]
         csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
         startswither = startswithnorm if csc else startswithlow
-        if begidx == 0:
-            # the first thing we're typing; could be python or subprocess, so
-            # anything goes.
-            rtn = self.cmd_complete(prefix)
-        elif cmd in self.bash_complete_funcs:
+        if begidx > 0 and cmd not in self.bash_complete_funcs and \
+                self._is_command(cmd):
+            # start on the options in the man page, which are likely next
+            self._man_completer.prefetch(cmd)
+
+        def bash():
             rtn = set()
             for s in self.bash_complete(prefix, line, begidx, endidx):
                 if os.path.isdir(s.rstrip()):
@@ -207,36 +420,109 @@ class Completer(object):
                 rtn.add(s)
             if len(rtn) == 0:
                 rtn = self.path_complete(prefix, path_str_start, path_str_end)
+            return rtn
+
+        def python():
+            rtn = {s for s in XONSH_TOKENS
+                   if startswither(s, prefix, prefixlow)}
+            if ctx is not None:
+                if dot in prefix:
+                    rtn |= self.attr_complete(prefix, ctx)
+                else:
+                    rtn |= {s for s in ctx
+                            if startswither(s, prefix, prefixlow)}
+            rtn |= {s for s in dir(builtins)
+                    if startswither(s, prefix, prefixlow)}
+            rtn |= {s + space for s in builtins.aliases
+                    if startswither(s, prefix, prefixlow)}
+            return rtn
+
+        def paths(cdpath=False):
+            return self.path_complete(prefix, path_str_start, path_str_end,
+                                      cdpath=cdpath)
+
+        sources = []
+        if begidx == 0:
+            # the first thing we're typing; could be python or subprocess, so
+            # anything goes.
+            sources.append(('commands', lambda: self.cmd_complete(prefix)))
+        elif cmd in self.bash_complete_funcs:
+            sources.append(('bash', bash))
         elif prefix.startswith('${') or prefix.startswith('@('):
             # python mode explicitly
-            rtn = set()
+            pass
         elif prefix.startswith('-'):
-            return sorted(self._man_completer.option_complete(prefix, cmd)), lprefix
+            def man():
+                return self._man_completer.option_complete(prefix, cmd)
+            return [('man', man)], lprefix
         elif cmd not in ctx:
             if cmd == 'import' and begidx == len('import '):
                 # completing module to import
-                return sorted(self.module_complete(prefix)), lprefix
-            if cmd in self._all_commands():
+                return [('python', lambda: self.module_complete(prefix))], \
+                       lprefix
+            if self._is_command(cmd):
                 # subproc mode; do path completions
-                return sorted(self.path_complete(prefix, path_str_start, path_str_end, cdpath=True)), lprefix
-            else:
-                # if we're here, could be anything
-                rtn = set()
-        else:
-            # if we're here, we're not a command, but could be anything else
-            rtn = set()
-        rtn |= {s for s in XONSH_TOKENS if startswither(s, prefix, prefixlow)}
-        if ctx is not None:
-            if dot in prefix:
-                rtn |= self.attr_complete(prefix, ctx)
-            else:
-                rtn |= {s for s in ctx if startswither(s, prefix, prefixlow)}
-        rtn |= {s for s in dir(builtins) if startswither(s, prefix, prefixlow)}
-        rtn |= {s + space for s in builtins.aliases
-                if startswither(s, prefix, prefixlow)}
-        rtn |= self.path_complete(prefix, path_str_start, path_str_end)
-        return sorted(rtn), lprefix
+                return [('paths', lambda: paths(cdpath=True))], lprefix
+        sources.append(('python', python))
+        sources.append(('paths', paths))
+        return sources, lprefix
+
+    def _budgets(self):
+        """The number of seconds each source may take, by name."""
+        env = builtins.__xonsh_env__
+        budgets = dict(DEFAULT_COMPLETION_BUDGETS)
+        budgets['bash'] = env.get('BASH_COMPLETE_TIMEOUT')
+        budgets.update(env.get('COMPLETION_BUDGETS'))
+        return budgets
 
+    def _timed(self, name, func):
+        """Calls func, recording how long it took for the source name."""
+        t0 = time.perf_counter()
+        try:
+            return set(func())
+        finally:
+            t = time.perf_counter() - t0
+            with self._lock:
+                self.latencies[name].append(t)
+
+    def _keep_late(self, name, reqkey, fut):
+        """Keeps the future of a source that ran over its budget, so that
+        the next identical request can pick its completions up.
+        """
+        with self._lock:
+            self.late[name] += 1
+            self._late[(name, reqkey)] = fut
+            while len(self._late) > 16:
+                self._late.popitem(last=False)
+
+    def _fail(self, name):
+        """Counts a failure of the source name, whose completions are left
+        out so that the other sources still complete.
+        """
+        with self._lock:
+            self.failed[name] += 1
+
+    def stats(self):
+        """Returns a map from each source name to a dict of the number of
+        recent requests, the median, 95th percentile and maximum of their
+        latencies in seconds, how many times it ran over its budget, and how
+        many times it failed.
+        """
+        rtn = {}
+        with self._lock:
+            names = set(self.latencies) | set(self.late) | set(self.failed)
+            for name in names:
+                ts = sorted(self.latencies.get(name, ()))
+                n = len(ts)
+                rtn[name] = {
+                    'n': n,
+                    'median': ts[n // 2] if n else None,
+                    'p95': ts[min(n - 1, int(0.95 * n))] if n else None,
+                    'max': ts[-1] if n else None,
+                    'late': self.late.get(name, 0),
+                    'failed': self.failed.get(name, 0),
+                    }
+        return rtn
 
     def find_and_complete(self, line, idx, ctx=None):
         """Finds the completions given only the full code line and a current cursor
@@ -303,9 +589,11 @@ class Completer(object):
         cmdlow = cmd.lower()
         csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
         startswither = startswithnorm if csc else startswithlow
-        return {s + space
-                for s in self._all_commands()
+        cmds = builtins.__xonsh_commands_cache__.startswith(cmd, csc)
+        rtn = {s + space for s in cmds}
+        rtn |= {s + space for s in builtins.aliases
                 if startswither(s, cmd, cmdlow)}
+        return rtn
 
     def module_complete(self, prefix):
         """Completes a name of a module to import."""
@@ -315,7 +603,8 @@ class Completer(object):
         startswither = startswithnorm if csc else startswithlow
         return {s for s in modules if startswither(s, prefix, prefixlow)}
 
-    def _quote_paths(self, paths, start, end):
+    def _quote_paths(self, paths, start, end, isdir=None):
+        isdir = {} if isdir is None else isdir
         out = set()
         space = ' '
         backslash = '\\'
@@ -326,7 +615,10 @@ class Completer(object):
                     (space in s or (backslash in s and slash != backslash))):
                 start = "'"
                 end = "'"
-            if os.path.isdir(expand_path(s)):
+            is_dir = isdir.get(s)
+            if is_dir is None:
+                is_dir = os.path.isdir(expand_path(s))
+            if is_dir:
                 _tail = slash
             elif end == '':
                 _tail = space
@@ -342,22 +634,84 @@ class Completer(object):
         return out
 
 
+    def _list_dir(self, path):
+        """Returns the DirListing of path, reusing the last one unless it is
+        racy or the directory has been modified since, or None if it cannot
+        be listed.
+        """
+        path = os.path.abspath(path)
+        listings = self._dir_listings
+        with self._lock:
+            listing = listings.get(path)
+        try:
+            if listing is None or listing.racy or \
+                    os.stat(path).st_mtime_ns != listing.mtime:
+                listing = DirListing(path)
+        except OSError:
+            with self._lock:
+                listings.pop(path, None)
+            return None
+        with self._lock:
+            listings[path] = listing
+            listings.move_to_end(path)
+            while len(listings) > 16:
+                listings.popitem(last=False)
+        return listing
+
+    def _scan_paths(self, prefix, csc):
+        """Finds the paths that start with prefix, like globbing for
+        prefix + '*' would. Returns the directory part of the prefix, the
+        matching names in it, and the listing, or None if the prefix needs a
+        real glob.
+        """
+        # expanded with the star, exactly as the glob would be
+        pattern = expand_path(prefix + '*')[:-1]
+        if RE_GLOB_MAGIC.search(pattern) is not None:
+            return None
+        dirname, base = os.path.split(pattern)
+        if not csc and dirname and not os.path.isdir(dirname):
+            # the directory may only match with another case
+            return None
+        listing = self._list_dir(dirname or os.curdir)
+        if listing is None:
+            return dirname, [], None
+        names = listing.startswith(base, csc)
+        if not base.startswith('.'):
+            names = [n for n in names if not n.startswith('.')]
+        return dirname, names, listing
+
     def path_complete(self, prefix, start, end, cdpath=False):
         """Completes based on a path name."""
         space = ' '  # intern some strings for faster appending
         tilde = '~'
-        paths = set()
+        home = os.path.expanduser(tilde)
         csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
-        for s in iglobpath(prefix + '*', ignore_case=(not csc)):
-            paths.add(s)
-        if tilde in prefix:
-            home = os.path.expanduser(tilde)
-            paths = {s.replace(home, tilde) for s in paths}
+        scanned = self._scan_paths(prefix, csc)
+        isdir = {}
+        if scanned is None:
+            paths = set(iglobpath(prefix + '*', ignore_case=(not csc)))
+            if tilde in prefix:
+                paths = {s.replace(home, tilde) for s in paths}
+        else:
+            paths = set()
+            dirname, names, listing = scanned
+            if tilde in prefix:
+                dirname = dirname.replace(home, tilde)
+            # normalize the directory once, rather than every path in it
+            head = _normpath(os.path.join(dirname, 'x'))[:-1]
+            for name in names:
+                if name[-1:].isspace():
+                    s = _normpath(os.path.join(dirname, name))
+                else:
+                    s = head + name
+                isdir[s] = name in listing.dirs
         self._add_env(paths, prefix)
         self._add_dots(paths, prefix)
         if cdpath:
             self._add_cdpaths(paths, prefix)
-        return self._quote_paths({_normpath(s) for s in paths}, start, end)
+        paths = {_normpath(s) for s in paths}
+        paths.update(isdir)
+        return self._quote_paths(paths, start, end, isdir)
 
     def bash_complete(self, prefix, line, begidx, endidx):
         """Attempts BASH completion."""
@@ -380,22 +734,30 @@ class Completer(object):
         else:
             prefix = shlex.quote(prefix)
 
-        script = BASH_COMPLETE_SCRIPT.format(filename=fnme,
-                                             line=' '.join(shlex.quote(p) for p in splt),
-                                             comp_line=shlex.quote(line),
-                                             n=n,
-                                             func=func,
-                                             cmd=cmd,
-                                             end=endidx + 1,
-                                             prefix=prefix,
-                                             prev=shlex.quote(prev))
-        try:
-            out = subprocess.check_output(['bash'],
-                                          input=script,
-                                          universal_newlines=True,
-                                          stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError:
-            out = ''
+        fmt = dict(line=' '.join(shlex.quote(p) for p in splt),
+                   comp_line=shlex.quote(line),
+                   n=n,
+                   func=func,
+                   cmd=cmd,
+                   end=endidx + 1,
+                   prefix=prefix,
+                   prev=shlex.quote(prev))
+        if ON_WINDOWS:
+            # no select() on pipes here, so run a fresh bash each time.
+            script = BASH_COMPLETE_SCRIPT.format(filename=fnme, **fmt)
+            try:
+                out = subprocess.check_output(['bash'],
+                                              input=script,
+                                              universal_newlines=True,
+                                              stderr=subprocess.PIPE)
+            except subprocess.CalledProcessError:
+                out = ''
+        else:
+            if self._bash_server is None:
+                self._bash_server = BashCompleteServer()
+            timeout = builtins.__xonsh_env__.get('BASH_COMPLETE_TIMEOUT')
+            out = self._bash_server.complete(BASH_COMPLETE_BODY.format(**fmt),
+                                             filename=fnme, timeout=timeout)
 
         rtn = set(map(completionwrap, out.splitlines()))
         return rtn
@@ -410,11 +772,41 @@ class Completer(object):
                 srcs.append('source ' + f)
         return srcs
 
+    def bash_complete_ready(self, timeout=None):
+        """Waits up to timeout seconds (forever if None) for the bash
+        completion functions to be discovered. Returns whether they are ready.
+        """
+        return self._bash_ready.wait(timeout)
+
+    def _load_bash_complete(self):
+        """Discovers the bash completion functions and files, either from the
+        cache or by sourcing $BASH_COMPLETIONS. Runs in a background thread.
+        """
+        try:
+            key = _bash_completions_key()
+            cached = _load_bash_completions_cache(key)
+            if cached is None:
+                funcs = self._load_bash_complete_funcs()
+                files = self._load_bash_complete_files(funcs)
+                _save_bash_completions_cache(key, funcs, files)
+            else:
+                funcs, files = cached
+            # files must be in place before the funcs are looked up.
+            self.bash_complete_files = files
+            self.bash_complete_funcs = funcs
+            self.have_bash = True
+        except Exception:  # pylint:disable=broad-except
+            # no bash, or a broken completion file; this must not take down
+            # the shell from a background thread.
+            self.have_bash = False
+        finally:
+            self._bash_ready.set()
+
     def _load_bash_complete_funcs(self):
-        self.bash_complete_funcs = bcf = {}
+        bcf = {}
         inp = self._source_completions()
         if len(inp) == 0:
-            return
+            return bcf
         inp.append('complete -p\n')
         out = subprocess.check_output(['bash'], input='\n'.join(inp),
                                       universal_newlines=True)
@@ -426,15 +818,15 @@ class Completer(object):
             if m is None:
                 continue
             bcf[cmd] = m.group(1)
+        return bcf
 
-    def _load_bash_complete_files(self):
+    def _load_bash_complete_files(self, funcs):
         inp = self._source_completions()
         if len(inp) == 0:
-            self.bash_complete_files = {}
-            return
-        if self.bash_complete_funcs:
+            return {}
+        if funcs:
             inp.append('shopt -s extdebug')
-            bash_funcs = set(self.bash_complete_funcs.values())
+            bash_funcs = set(funcs.values())
             inp.append('declare -F ' + ' '.join([f for f in bash_funcs]))
             inp.append('shopt -u extdebug\n')
         out = subprocess.check_output(['bash'], input='\n'.join(inp),
@@ -443,11 +835,70 @@ class Completer(object):
         for line in out.splitlines():
             parts = line.split()
             func_files[parts[0]] = parts[-1]
-        self.bash_complete_files = {
-            cmd: func_files[func]
-            for cmd, func in self.bash_complete_funcs.items()
-            if func in func_files
-        }
+        return {cmd: func_files[func]
+                for cmd, func in funcs.items()
+                if func in func_files}
+
+    def _static_attrs(self, owner, instance=False):
+        """Maps the attribute names of a module or type to whether each is
+        callable, without running any property or other descriptor. With
+        instance, the names are those that instances of the type get from
+        it. The maps are cached for as long as the same object, with the same
+        number of names in its __dict__, is completed.
+        """
+        key = (id(owner), instance)
+        size = len(getattr(owner, '__dict__', ()))
+        with self._lock:
+            cached = self._attr_cache.get(key)
+            if cached is not None and cached[0]() is owner and \
+                    cached[1] == size:
+                self._attr_cache.move_to_end(key)
+                return cached[2]
+        attrs = {}
+        mro = owner.__mro__ if instance else ()
+        for name in dir(owner):
+            try:
+                if instance:
+                    a = next(c.__dict__[name] for c in mro
+                             if name in c.__dict__)
+                else:
+                    a = inspect.getattr_static(owner, name)
+            except (AttributeError, StopIteration):
+                continue
+            attrs[name] = callable(a) or isinstance(a, (classmethod,
+                                                        staticmethod))
+        try:
+            ref = weakref.ref(owner)
+        except TypeError:
+            return attrs
+        with self._lock:
+            self._attr_cache[key] = (ref, size, attrs)
+            while len(self._attr_cache) > 64:
+                self._attr_cache.popitem(last=False)
+        return attrs
+
+    def _attrs(self, val):
+        """Maps the attribute names of val to whether each is callable."""
+        if isinstance(val, (types.ModuleType, type)):
+            return self._static_attrs(val)
+        cls_attrs = self._static_attrs(type(val), instance=True)
+        try:
+            names = dir(val)
+        except Exception:  # pylint:disable=broad-except
+            return cls_attrs
+        inst_dict = getattr(val, '__dict__', None)
+        if not isinstance(inst_dict, dict):
+            inst_dict = {}
+        attrs = {}
+        for name in names:
+            if name in inst_dict:
+                attrs[name] = callable(inst_dict[name])
+            elif name in cls_attrs:
+                attrs[name] = cls_attrs[name]
+            else:
+                # only given by __dir__ and __getattr__, so not looked up
+                attrs[name] = False
+        return attrs
 
     def attr_complete(self, prefix, ctx):
         """Complete attributes of an object."""
@@ -459,118 +910,356 @@ class Completer(object):
         expr = subexpr_from_unbalanced(expr, '(', ')')
         expr = subexpr_from_unbalanced(expr, '[', ']')
         expr = subexpr_from_unbalanced(expr, '{', '}')
-        _ctx = None
+        try:
+            # attributes cannot be written after some expressions, e.g. 7.imag
+            compile('{0}.x'.format(expr), '<attr>', 'eval')
+        except SyntaxError:
+            return attrs
         try:
             val = eval(expr, ctx)
-            _ctx = ctx
         except:  # pylint:disable=bare-except
             try:
                 val = eval(expr, builtins.__dict__)
-                _ctx = builtins.__dict__
             except:  # pylint:disable=bare-except
                 return attrs  # anything could have gone wrong!
-        _opts = dir(val)
-        # check whether these options actually work (e.g., disallow 7.imag)
-        opts = []
-        for i in _opts:
-            try:
-                v = eval('{0}.{1}'.format(expr, i), _ctx)
-                opts.append(i)
-            except:  # pylint:disable=bare-except
-                continue
+        opts = self._attrs(val)
         if len(attr) == 0:
-            opts = [o for o in opts if not o.startswith('_')]
+            names = [o for o in opts if not o.startswith('_')]
         else:
             csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
             startswither = startswithnorm if csc else startswithlow
             attrlow = attr.lower()
-            opts = [o for o in opts if startswither(o, attr, attrlow)]
+            names = [o for o in opts if startswither(o, attr, attrlow)]
         prelen = len(prefix)
-        for opt in opts:
-            a = getattr(val, opt)
-            rpl = opt + '(' if callable(a) else opt
+        for opt in names:
+            rpl = opt + '(' if opts[opt] else opt
             # note that prefix[:prelen-len(attr)] != prefix[:-len(attr)]
             # when len(attr) == 0.
             comp = prefix[:prelen - len(attr)] + rpl
             attrs.add(comp)
         return attrs
 
-    def _all_commands(self):
-        path = builtins.__xonsh_env__.get('PATH', [])
-        # did PATH change?
-        path_hash = hash(tuple(path))
-        cache_valid = path_hash == self._path_checksum
-        self._path_checksum = path_hash
-        # did aliases change?
-        al_hash = hash(tuple(sorted(builtins.aliases.keys())))
-        cache_valid = cache_valid and al_hash == self._alias_checksum
-        self._alias_checksum = al_hash
-        pm = self._path_mtime
-        # did the contents of any directory in PATH change?
-        for d in filter(os.path.isdir, path):
-            m = os.stat(d).st_mtime
-            if m > pm:
-                pm = m
-                cache_valid = False
-        self._path_mtime = pm
-        if cache_valid:
-            return self._cmds_cache
-        allcmds = set()
-        for d in filter(os.path.isdir, path):
-            allcmds |= set(os.listdir(d))
-        allcmds |= set(builtins.aliases.keys())
-        self._cmds_cache = frozenset(allcmds)
-        return self._cmds_cache
-
-
-OPTIONS_PATH = os.path.expanduser('~') + "/.xonsh_man_completions"
+    def _is_command(self, cmd):
+        return cmd in builtins.aliases or \
+               cmd in builtins.__xonsh_commands_cache__
+
+
+class BashCompleteServer(object):
+    """A long-lived bash coprocess that answers completion requests.
+
+    Each completion file is sourced only once per bash process. Requests are
+    written to the coprocess's stdin and their replies are framed on stdout by
+    a unique sentinel line. If bash dies or a request times out, the process is
+    killed and transparently restarted on the next request.
+    """
+
+    def __init__(self, bash='bash'):
+        self.bash = bash
+        self._proc = None
+        self._sourced = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self):
+        """Whether the bash coprocess is currently running."""
+        return self._proc is not None and self._proc.poll() is None
+
+    def _start(self):
+        self._proc = subprocess.Popen([self.bash], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL, bufsize=0)
+        self._sourced = set()
+
+    def close(self):
+        """Terminates the bash coprocess, if it is running."""
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait()
+        except OSError:
+            pass
+        for f in (proc.stdin, proc.stdout):
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def __del__(self):
+        self.close()
+
+    def complete(self, body, filename=None, timeout=None):
+        """Runs the bash code in body after sourcing filename (if it has not
+        already been sourced) and returns everything that it printed to stdout.
+        If the coprocess does not answer within timeout seconds, it is killed
+        and the empty string is returned.
+        """
+        with self._lock:
+            for _ in range(2):
+                if not self.alive:
+                    self.close()
+                    self._start()
+                try:
+                    return self._request(body, filename, timeout)
+                except (BrokenPipeError, EOFError):
+                    # bash died underneath us, try again with a fresh one
+                    self.close()
+                except TimeoutError:
+                    self.close()
+                    break
+        return ''
+
+    def _request(self, body, filename, timeout):
+        sentinel = '__XONSH_COMPLETE_END_{0}_{1}__'.format(os.getpid(),
+                                                            next(self._counter))
+        lines = ['cd {0} 2>/dev/null'.format(shlex.quote(os.getcwd()))]
+        if filename is not None and filename not in self._sourced:
+            lines.append('source {0}'.format(filename))
+            self._sourced.add(filename)
+        lines.append(body)
+        # the extra echo guarantees that the sentinel starts its own line
+        lines.append('echo; echo ' + sentinel + '\n')
+        env = builtins.__xonsh_env__
+        enc = env.get('XONSH_ENCODING')
+        errors = env.get('XONSH_ENCODING_ERRORS')
+        self._proc.stdin.write('\n'.join(lines).encode(enc, errors))
+        out = self._read_until(sentinel.encode(), timeout)
+        return out.decode(enc, errors)
+
+    def _read_until(self, sentinel, timeout):
+        fd = self._proc.stdout.fileno()
+        end = b'\n' + sentinel + b'\n'
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf = b'\n'
+        while True:
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0.0:
+                    raise TimeoutError
+            r, _, _ = select.select([fd], [], [], remaining)
+            if not r:
+                raise TimeoutError
+            data = os.read(fd, 65536)
+            if len(data) == 0:
+                raise EOFError
+            buf += data
+            i = buf.find(end)
+            if i >= 0:
+                return buf[1:i]
+
+
+def _bash_completions_cache_path():
+    return os.path.join(builtins.__xonsh_env__.get('XONSH_DATA_DIR'),
+                        'bash_completions.json')
+
+
+def _bash_completions_key():
+    """The key for the bash completions cache, which is the list of
+    [filename, mtime] pairs for every existing file in $BASH_COMPLETIONS.
+    """
+    key = []
+    for f in builtins.__xonsh_env__.get('BASH_COMPLETIONS'):
+        try:
+            key.append([f, os.stat(f).st_mtime])
+        except OSError:
+            continue
+    return key
+
+
+def _load_bash_completions_cache(key):
+    """Returns the cached (funcs, files) tuple if the cache is valid for
+    the given key, otherwise None.
+    """
+    try:
+        with open(_bash_completions_cache_path(), 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get('key') != key:
+        return None
+    return cache.get('funcs', {}), cache.get('files', {})
+
+
+def _save_bash_completions_cache(key, funcs, files):
+    """Writes the discovered completions to the cache, atomically."""
+    fname = _bash_completions_cache_path()
+    tmp = fname + '.{0}.tmp'.format(os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'funcs': funcs, 'files': files}, f)
+        os.replace(tmp, fname)
+    except OSError:
+        pass
+
+
 SCRAPE_RE = re.compile(r'^(?:\s*(?:-\w|--[a-z0-9-]+)[\s,])+', re.M)
 INNER_OPTIONS_RE = re.compile(r'-\w|--[a-z0-9-]+')
 
 
+def _man_completions_path():
+    data_dir = builtins.__xonsh_env__.get('XONSH_DATA_DIR')
+    if not data_dir:
+        return None
+    return os.path.join(data_dir, 'man_completions.jsonl')
+
+
+def _man_page_path(cmd):
+    """The file of the man page for cmd, or None if there is none."""
+    try:
+        out = subprocess.check_output(['man', '-w', cmd],
+                                      stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    lines = out.decode('utf-8', 'replace').splitlines()
+    return lines[0].strip() if len(lines) > 0 else None
+
+
+def _scrape_man_options(cmd):
+    """Runs man for cmd and returns the options that it lists."""
+    manpage = subprocess.Popen(["man", cmd], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+    # This is a trick to get rid of reverse line feeds
+    text = subprocess.check_output(["col", "-b"], stdin=manpage.stdout)
+    manpage.stdout.close()
+    manpage.wait()
+    text = text.decode('utf-8', 'replace')
+    scraped_text = ' '.join(SCRAPE_RE.findall(text))
+    return sorted(set(INNER_OPTIONS_RE.findall(scraped_text)))
+
+
 class ManCompleter(object):
-    """Helper class that loads completions derived from man pages."""
+    """Helper class that loads completions derived from man pages.
 
-    def __init__(self):
-        self._load_cached_options()
+    The options of a command are scraped by a small pool of worker threads,
+    which starts as soon as the command is known, so that they are usually
+    ready by the time that an option is completed. Scraped options are kept in
+    a store of JSON lines, which is only ever appended to, one command at a
+    time. Each record holds the path and mtime of the man page, so that the
+    options are scraped again once the man page changes.
+    """
 
-    def __del__(self):
-        try:
-            self._save_cached_options()
-        except Exception:
-            pass
+    def __init__(self, path=None, max_workers=2):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            The store of scraped options, $XONSH_DATA_DIR/man_completions.jsonl
+            by default. Nothing is stored if this cannot be found.
+        max_workers : int, optional
+            The number of man pages that may be scraped at once.
+        """
+        self.path = _man_completions_path() if path is None else path
+        self._lock = threading.Lock()
+        self._options = {}  # cmd -> options checked this session
+        self._futures = {}  # cmd -> scraping in progress
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._needs_newline = False
+        self._load_records()
+
+    def prefetch(self, cmd):
+        """Starts finding the options of cmd, unless they are already known,
+        and returns a future that holds them.
+        """
+        with self._lock:
+            fut = self._futures.get(cmd)
+            if fut is None:
+                fut = self._executor.submit(self._find_options, cmd)
+                self._futures[cmd] = fut
+        return fut
 
     def option_complete(self, prefix, cmd):
         """Completes an option name, basing on content of man page."""
         csc = builtins.__xonsh_env__.get('CASE_SENSITIVE_COMPLETIONS')
         startswither = startswithnorm if csc else startswithlow
-        if cmd not in self._options.keys():
+        opts = self._options.get(cmd)
+        if opts is None:
             try:
-                manpage = subprocess.Popen(["man", cmd],
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.DEVNULL)
-                # This is a trick to get rid of reverse line feeds
-                text = subprocess.check_output(["col", "-b"],
-                                               stdin=manpage.stdout)
-                text = text.decode('utf-8')
-                scraped_text = ' '.join(SCRAPE_RE.findall(text))
-                matches = INNER_OPTIONS_RE.findall(scraped_text)
-                self._options[cmd] = matches
-            except:
+                opts = self.prefetch(cmd).result()
+            except Exception:
                 return set()
         prefixlow = prefix.lower()
-        return {s for s in self._options[cmd]
-                if startswither(s, prefix, prefixlow)}
+        return {s for s in opts if startswither(s, prefix, prefixlow)}
 
-    def _load_cached_options(self):
-        """Load options from file at startup."""
+    def _find_options(self, cmd):
+        rec = self._records.get(cmd)
+        if rec is not None:
+            try:
+                if os.stat(rec['path']).st_mtime == rec['mtime']:
+                    self._options[cmd] = rec['options']
+                    return rec['options']
+            except OSError:
+                pass
+        path = _man_page_path(cmd)
+        try:
+            mtime = os.stat(path).st_mtime if path else None
+        except OSError:
+            mtime = None
         try:
-            with open(OPTIONS_PATH, 'rb') as f:
-                self._options = pickle.load(f)
-        except:
-            self._options = {}
-
-    def _save_cached_options(self):
-        """Save completions to file."""
-        with open(OPTIONS_PATH, 'wb') as f:
-            pickle.dump(self._options, f)
+            opts = _scrape_man_options(cmd)
+        except (OSError, subprocess.CalledProcessError):
+            opts = []
+        self._options[cmd] = opts
+        if mtime is not None:
+            rec = {'cmd': cmd, 'path': path, 'mtime': mtime, 'options': opts}
+            self._records[cmd] = rec
+            self._append_record(rec)
+        return opts
+
+    def _load_records(self):
+        """Reads the store, where later records replace earlier ones. A torn
+        line, as left by a crash in the middle of a write, is skipped. The
+        store is rewritten once most of its records have been replaced.
+        """
+        self._records = {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        self._needs_newline = len(data) > 0 and not data.endswith(b'\n')
+        lines = data.splitlines()
+        for line in lines:
+            try:
+                rec = json.loads(line.decode('utf-8'))
+                self._records[rec['cmd']] = rec
+            except (ValueError, TypeError, KeyError, UnicodeDecodeError):
+                continue
+        if len(lines) > 2 * len(self._records) + 16:
+            self._compact()
+
+    def _append_record(self, rec):
+        """Appends one record to the store, in a single write."""
+        if self.path is None:
+            return
+        line = json.dumps(rec, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._needs_newline:
+                line = '\n' + line
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                             0o644)
+                try:
+                    os.write(fd, line.encode('utf-8'))
+                finally:
+                    os.close(fd)
+            except OSError:
+                return
+            self._needs_newline = False
+
+    def _compact(self):
+        """Rewrites the store with only the current records, atomically."""
+        tmp = self.path + '.{0}.tmp'.format(os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                for rec in self._records.values():
+                    f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+            os.replace(tmp, self.path)
+        except OSError:
+            return
+        self._needs_newline = False
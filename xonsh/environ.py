@@ -5,22 +5,27 @@ import re
 import json
 import socket
 import string
+import time
 import locale
 import builtins
+import threading
 import subprocess
 from warnings import warn
-from functools import wraps
-from collections import MutableMapping, MutableSequence, MutableSet, namedtuple
+from functools import lru_cache
+from collections import MutableMapping, MutableSequence, MutableSet, \
+    namedtuple, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from xonsh import __version__ as XONSH_VERSION
 from xonsh.tools import (
     TERM_COLORS, ON_WINDOWS, ON_MAC, ON_LINUX, ON_ARCH, IS_ROOT,
     always_true, always_false, ensure_string, is_env_path, str_to_env_path,
     env_path_to_str, is_bool, to_bool, bool_to_str, is_history_tuple, to_history_tuple,
-    history_tuple_to_str, is_float, string_types, is_string, DEFAULT_ENCODING,
+    history_tuple_to_str, is_float, is_int, string_types, is_string, DEFAULT_ENCODING,
     is_completions_display_value, to_completions_display_value, is_string_set,
     csv_to_set, set_to_csv, get_sep
 )
+from xonsh import vc
 from xonsh.dirstack import _get_cwd
 from xonsh.foreign_shells import DEFAULT_SHELLS, load_foreign_envs
 
@@ -54,6 +59,7 @@ represent environment variable validation, conversion, detyping.
 DEFAULT_ENSURERS = {
     'AUTO_CD': (is_bool, to_bool, bool_to_str),
     'AUTO_SUGGEST': (is_bool, to_bool, bool_to_str),
+    'BASH_COMPLETE_TIMEOUT': (is_float, float, str),
     'BASH_COMPLETIONS': (is_env_path, str_to_env_path, env_path_to_str),
     'CASE_SENSITIVE_COMPLETIONS': (is_bool, to_bool, bool_to_str),
     re.compile('\w*DIRS$'): (is_env_path, str_to_env_path, env_path_to_str),
@@ -69,16 +75,22 @@ DEFAULT_ENSURERS = {
     'LC_TIME': (always_false, locale_convert('LC_TIME'), ensure_string),
     'MOUSE_SUPPORT': (is_bool, to_bool, bool_to_str),
     re.compile('\w*PATH$'): (is_env_path, str_to_env_path, env_path_to_str),
-    'TEEPTY_PIPE_DELAY': (is_float, float, str),
+    'TEEPTY_MAX_SIZE': (is_int, int, str),
     'XONSHRC': (is_env_path, str_to_env_path, env_path_to_str),
     'XONSH_ENCODING': (is_string, ensure_string, ensure_string),
     'XONSH_ENCODING_ERRORS': (is_string, ensure_string, ensure_string),
     'XONSH_HISTORY_SIZE': (is_history_tuple, to_history_tuple, history_tuple_to_str),
+    'XONSH_JOB_OUTPUT': (is_bool, to_bool, bool_to_str),
+    'XONSH_JOB_OUTPUT_MEMORY': (is_int, int, str),
+    'XONSH_JOB_OUTPUT_SIZE': (is_int, int, str),
     'XONSH_LOGIN': (is_bool, to_bool, bool_to_str),
     'XONSH_STORE_STDOUT': (is_bool, to_bool, bool_to_str),
     'VI_MODE': (is_bool, to_bool, bool_to_str),
 }
 
+# the maximum number of keys whose ensurers are remembered by an Env
+ENSURER_CACHE_SIZE = 1024
+
 #
 # Defaults
 #
@@ -132,6 +144,7 @@ DEFAULT_VALUES = {
     'AUTO_CD': False,
     'AUTO_PUSHD': False,
     'AUTO_SUGGEST': True,
+    'BASH_COMPLETE_TIMEOUT': 2.0,
     'BASH_COMPLETIONS': (('/usr/local/etc/bash_completion',
                              '/opt/local/etc/profile.d/bash_completion.sh')
                         if ON_MAC else
@@ -142,6 +155,7 @@ DEFAULT_VALUES = {
                              '/usr/share/bash-completion/completions/git')),
     'CASE_SENSITIVE_COMPLETIONS': ON_LINUX,
     'CDPATH': (),
+    'COMPLETION_BUDGETS': {},
     'COMPLETIONS_DISPLAY': 'multi',
     'DIRSTACK_SIZE': 20,
     'EXPAND_ENV_VARS': True,
@@ -159,6 +173,7 @@ DEFAULT_VALUES = {
     'PATH': (),
     'PATHEXT': (),
     'PROMPT': DEFAULT_PROMPT,
+    'PROMPT_FIELD_TIMEOUTS': {},
     'PROMPT_TOOLKIT_COLORS': {},
     'PROMPT_TOOLKIT_STYLES': None,
     'PUSHD_MINUS': False,
@@ -167,7 +182,7 @@ DEFAULT_VALUES = {
     'SUGGEST_COMMANDS': True,
     'SUGGEST_MAX_NUM': 5,
     'SUGGEST_THRESHOLD': 3,
-    'TEEPTY_PIPE_DELAY': 0.01,
+    'TEEPTY_MAX_SIZE': 1048576,
     'TITLE': DEFAULT_TITLE,
     'VI_MODE': False,
     'XDG_CONFIG_HOME': os.path.expanduser(os.path.join('~', '.config')),
@@ -183,6 +198,9 @@ DEFAULT_VALUES = {
     'XONSH_ENCODING_ERRORS': 'surrogateescape',
     'XONSH_HISTORY_FILE': os.path.expanduser('~/.xonsh_history.json'),
     'XONSH_HISTORY_SIZE': (8128, 'commands'),
+    'XONSH_JOB_OUTPUT': False,
+    'XONSH_JOB_OUTPUT_MEMORY': 8388608,
+    'XONSH_JOB_OUTPUT_SIZE': 1048576,
     'XONSH_LOGIN': False,
     'XONSH_SHOW_TRACEBACK': False,
     'XONSH_STORE_STDOUT': False,
@@ -212,6 +230,10 @@ class Env(MutableMapping):
 
     An Env instance may be converted to an untyped version suitable for
     use in a subprocess.
+
+    Variables given as strings are only converted to their type when they
+    are first looked up, and the strings are used to detype them until
+    they are changed.
     """
 
     _arg_regex = re.compile(r'ARG(\d+)')
@@ -219,30 +241,93 @@ class Env(MutableMapping):
     def __init__(self, *args, **kwargs):
         """If no initial environment is given, os.environ is used."""
         self._d = {}
+        # the strings variables were given as, until they are changed
+        self._raw = {}
         self.ensurers = {k: Ensurer(*v) for k, v in DEFAULT_ENSURERS.items()}
+        self._ensurer_cache = OrderedDict()
         self.defaults = DEFAULT_VALUES
         if len(args) == 0 and len(kwargs) == 0:
             args = (os.environ, )
-        for key, val in dict(*args, **kwargs).items():
-            self[key] = val
         self._detyped = None
+        self._stale = set()
+        self._mutable = {}
+        for key, val in dict(*args, **kwargs).items():
+            # setting a locale variable sets the locale, so it is not put off
+            if isinstance(val, string_types) and key not in LOCALE_CATS:
+                self._raw[key] = val
+            else:
+                self[key] = val
         self._orig_env = None
 
     def detype(self):
-        if self._detyped is not None:
-            return self._detyped
-        ctx = {}
-        for key, val in self._d.items():
-            if callable(val) or isinstance(val, MutableMapping):
-                continue
-            if not isinstance(key, string_types):
-                key = str(key)
-            ensurer = self.get_ensurer(key)
-            val = ensurer.detype(val)
-            ctx[key] = val
+        """Returns a dict of the environment as strings, suitable for passing
+        to a subprocess. Each variable's string form is cached and only
+        recomputed when the variable is set, deleted, or, for mutable
+        containers such as path lists and sets, when their contents change.
+        A new dict is returned whenever anything changed, so previously
+        returned dicts are never modified.
+        """
+        ctx = self._detyped
+        if ctx is None:
+            keys = self._d.keys() | self._raw.keys()
+            ctx = {}
+        else:
+            keys = self._stale
+            for key, snap in list(self._mutable.items()):
+                if snap is None or snap != _snapshot(self._d[key]):
+                    keys = keys | {key}
+            if len(keys) == 0:
+                return ctx
+            ctx = dict(ctx)
+        for key in keys:
+            self._detype_key(key, ctx)
+        self._stale = set()
         self._detyped = ctx
         return ctx
 
+    def _detype_key(self, key, ctx):
+        """Updates the detyped ctx dict for a single key."""
+        skey = key if isinstance(key, string_types) else str(key)
+        raw = self._current_raw(key)
+        if raw is not None:
+            ctx[skey] = raw
+            return
+        if key not in self._d:
+            ctx.pop(skey, None)
+            return
+        val = self._d[key]
+        if callable(val) or isinstance(val, MutableMapping):
+            ctx.pop(skey, None)
+            return
+        if key in self._mutable:
+            self._mutable[key] = _snapshot(val)
+        ensurer = self.get_ensurer(key)
+        ctx[skey] = ensurer.detype(val)
+
+    def _current_raw(self, key):
+        """Returns the string that key was given as, or None if it has been
+        changed since, even in place.
+        """
+        raw = self._raw.get(key)
+        if raw is None or key not in self._mutable:
+            return raw
+        snap = self._mutable[key]
+        if snap is not None and snap == _snapshot(self._d[key]):
+            return raw
+        self._raw.pop(key, None)
+        return None
+
+    def lazy_items(self):
+        """Returns (key, value) pairs of the variables, where those that have
+        not been changed are given as the strings they were given as, so that
+        they are not converted to be passed on to another Env.
+        """
+        items = []
+        for key in list(self):
+            raw = self._current_raw(key)
+            items.append((key, self[key] if raw is None else raw))
+        return items
+
     def replace_env(self):
         """Replaces the contents of os.environ with a detyped version
         of the xonsh environement.
@@ -263,9 +348,16 @@ class Env(MutableMapping):
 
     def get_ensurer(self, key,
                     default=Ensurer(always_true, None, ensure_string)):
-        """Gets an ensurer for the given key."""
+        """Gets an ensurer for the given key. Ensurers for keys that are only
+        matched by a regular expression are remembered in a bounded cache.
+        """
         if key in self.ensurers:
             return self.ensurers[key]
+        cache = self._ensurer_cache
+        ens = cache.get(key)
+        if ens is not None:
+            cache.move_to_end(key)
+            return ens
         for k, ensurer in self.ensurers.items():
             if isinstance(k, string_types):
                 continue
@@ -275,7 +367,9 @@ class Env(MutableMapping):
                 break
         else:
             ens = default
-        self.ensurers[key] = ens
+        cache[key] = ens
+        if len(cache) > ENSURER_CACHE_SIZE:
+            cache.popitem(last=False)
         return ens
 
     #
@@ -290,48 +384,75 @@ class Env(MutableMapping):
         if not ensurer.validate(val):
             val = ensurer.convert(val)
         self._d[key] = val
-        self._detyped = None
+        self._raw.pop(key, None)
+        self._stale.add(key)
+        if isinstance(val, (MutableSequence, MutableSet)):
+            self._mutable[key] = None
+        else:
+            self._mutable.pop(key, None)
 
     def __delitem__(self, key):
-        del self._d[key]
-        self._detyped = None
+        if self._raw.pop(key, None) is None or key in self._d:
+            del self._d[key]
+        self._stale.add(key)
+        self._mutable.pop(key, None)
 
     def get(self, key, default=DefaultNotGiven):
         """The environment will look up default values from its own defaults if a
         default is not given here.
         """
-        m = self._arg_regex.match(key)
-        if (m is not None) and (key not in self._d) and ('ARGS' in self._d):
-            args = self._d['ARGS']
+        d = self._d
+        if key in d:
+            return d[key]
+        raw = self._raw.get(key)
+        if raw is not None:
+            return self._convert(key, raw)
+        m = None
+        if key[:3] == 'ARG' and 'ARGS' in d:
+            m = self._arg_regex.match(key)
+        if m is not None:
+            args = d['ARGS']
             ix = int(m.group(1))
             if ix >= len(args):
                 e = "Not enough arguments given to access ARG{0}."
                 raise IndexError(e.format(ix))
-            val = self._d['ARGS'][ix]
-        elif key in self._d:
-            val = self._d[key]
+            val = args[ix]
         elif default is DefaultNotGiven:
             val = self.defaults.get(key, None)
             if is_callable_default(val):
                 val = val(self)
         else:
             val = default
-        if isinstance(val, (MutableSet, MutableSequence, MutableMapping)):
-            self._detyped = None
+        return val
+
+    def _convert(self, key, raw):
+        """Converts the string a variable was given as on its first lookup."""
+        ensurer = self.get_ensurer(key)
+        val = raw if ensurer.validate(raw) else ensurer.convert(raw)
+        self._d[key] = val
+        if isinstance(val, (MutableSequence, MutableSet)):
+            # so that detype can tell if it is changed in place
+            self._mutable[key] = _snapshot(val)
         return val
 
     def __iter__(self):
-        yield from self._d
+        # lookups in other threads may convert variables meanwhile, which
+        # adds them to self._d but leaves them in self._raw
+        raw = list(self._raw)
+        keys = list(self._d)
+        seen = set(keys)
+        keys.extend(key for key in raw if key not in seen)
+        return iter(keys)
 
     def __len__(self):
-        return len(self._d)
+        return len(self._d) + len(self._raw.keys() - self._d.keys())
 
     def __str__(self):
-        return str(self._d)
+        return str(dict(self))
 
     def __repr__(self):
         return '{0}.{1}({2})'.format(self.__class__.__module__,
-                                     self.__class__.__name__, self._d)
+                                     self.__class__.__name__, dict(self))
 
     def _repr_pretty_(self, p, cycle):
         name = '{0}.{1}'.format(self.__class__.__module__,
@@ -344,6 +465,16 @@ class Env(MutableMapping):
                 p.pretty(dict(self))
 
 
+def _snapshot(val):
+    """A cheap, comparable copy of a mutable container's contents, used to
+    tell whether it has been changed in place. None means always changed.
+    """
+    try:
+        return frozenset(val) if isinstance(val, MutableSet) else tuple(val)
+    except TypeError:
+        return None
+
+
 def locate_binary(name, cwd):
     # StackOverflow for `where` tip: http://stackoverflow.com/a/304447/90297
     locator = 'where' if ON_WINDOWS else 'which'
@@ -360,131 +491,24 @@ def locate_binary(name, cwd):
     return binary_location
 
 
-def ensure_git(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        # Get cwd or bail
-        kwargs['cwd'] = kwargs.get('cwd', _get_cwd())
-        if kwargs['cwd'] is None:
-            return
-
-        # step out completely if git is not installed
-        if locate_binary('git', kwargs['cwd']) is None:
-            return
-
-        return func(*args, **kwargs)
-    return wrapper
-
-
-def ensure_hg(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        kwargs['cwd'] = kwargs.get('cwd', _get_cwd())
-        if kwargs['cwd'] is None:
-            return
-
-        # walk up the directory tree to see if we are inside an hg repo
-        path = kwargs['cwd'].split(os.path.sep)
-        while len(path) > 0:
-            if os.path.exists(os.path.sep.join(path + ['.hg'])):
-                break
-            del path[-1]
-
-        # bail if we aren't inside a repository
-        if path == []:
-            return
-
-        kwargs['root'] = os.path.sep.join(path)
-
-        # step out completely if hg is not installed
-        if locate_binary('hg', kwargs['cwd']) is None:
-            return
-
-        return func(*args, **kwargs)
-    return wrapper
-
-
-@ensure_git
 def get_git_branch(cwd=None):
-    branch = None
-
-    if not ON_WINDOWS:
-        prompt_scripts = ['/usr/lib/git-core/git-sh-prompt',
-                          '/usr/local/etc/bash_completion.d/git-prompt.sh']
-
-        for script in prompt_scripts:
-            # note that this is about 10x faster than bash -i "__git_ps1"
-            _input = ('source {}; __git_ps1 "${{1:-%s}}"'.format(script))
-            try:
-                branch = subprocess.check_output(['bash', ],
-                                                 cwd=cwd,
-                                                 input=_input,
-                                                 stderr=subprocess.PIPE,
-                                                 universal_newlines=True)
-                if len(branch) == 0:
-                    branch = None
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                continue
-
-    # fall back to using the git binary if the above failed
-    if branch is None:
-        try:
-            cmd = ['git', 'rev-parse', '--abbrev-ref', 'HEAD']
-            s = subprocess.check_output(cmd,
-                                        stderr=subprocess.PIPE,
-                                        cwd=cwd,
-                                        universal_newlines=True)
-            s = s.strip()
-            if len(s) > 0:
-                branch = s
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            pass
-
-    return branch
-
-
-def call_hg_command(command, cwd):
-    # Override user configurations settings and aliases
-    hg_env = os.environ.copy()
-    hg_env['HGRCPATH'] = ""
-
-    s = None
-    try:
-        s = subprocess.check_output(['hg'] + command,
-                                    stderr=subprocess.PIPE,
-                                    cwd=cwd,
-                                    universal_newlines=True,
-                                    env=hg_env)
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        pass
-
-    return s
-
-
-@ensure_hg
-def get_hg_branch(cwd=None, root=None):
-    branch = None
-    active_bookmark = None
-
-    if root is not None:
-        branch_path = os.path.sep.join([root, '.hg', 'branch'])
-        bookmark_path = os.path.sep.join([root, '.hg', 'bookmarks.current'])
-
-        if os.path.exists(branch_path):
-            with open(branch_path, 'r') as branch_file:
-                branch = branch_file.read()
-        else:
-            branch = call_hg_command(['branch'], cwd)
-
-        if os.path.exists(bookmark_path):
-            with open(bookmark_path, 'r') as bookmark_file:
-                active_bookmark = bookmark_file.read()
+    """Returns the branch checked out in the git repository that cwd (by
+    default the current directory) is in, or None.
+    """
+    repo = vc.find_repo(cwd or _get_cwd())
+    if repo is None or repo[0] != 'git':
+        return None
+    return vc.git_branch(repo[1])
 
-    if active_bookmark is not None:
-        return "{0}, {1}".format(
-            *(b.strip(os.linesep) for b in (branch, active_bookmark)))
 
-    return branch.strip(os.linesep) if branch else None
+def get_hg_branch(cwd=None):
+    """Returns the branch, and active bookmark, of the mercurial repository
+    that cwd (by default the current directory) is in, or None.
+    """
+    repo = vc.find_repo(cwd or _get_cwd())
+    if repo is None or repo[0] != 'hg':
+        return None
+    return vc.hg_branch(repo[1])
 
 
 def current_branch(pad=True):
@@ -500,32 +524,29 @@ def current_branch(pad=True):
     return branch or ''
 
 
-@ensure_git
 def git_dirty_working_directory(cwd=None):
-    try:
-        cmd = ['git', 'status', '--porcelain']
-        s = subprocess.check_output(cmd,
-                                    stderr=subprocess.PIPE,
-                                    cwd=cwd,
-                                    universal_newlines=True)
-        return bool(s)
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    """Returns whether the git repository that cwd is in has changes."""
+    repo = vc.find_repo(cwd or _get_cwd())
+    if repo is None or repo[0] != 'git':
         return False
+    return bool(vc.git_dirty(repo[1]))
 
 
-@ensure_hg
-def hg_dirty_working_directory(cwd=None, root=None):
-    id = call_hg_command(['identify', '--id'], cwd)
-    if id is None:
+def hg_dirty_working_directory(cwd=None):
+    """Returns whether the mercurial repository that cwd is in has
+    uncommitted changes.
+    """
+    repo = vc.find_repo(cwd or _get_cwd())
+    if repo is None or repo[0] != 'hg':
         return False
-    return id.strip(os.linesep).endswith('+')
+    return bool(vc.hg_dirty(repo[1]))
 
 
 def dirty_working_directory(cwd=None):
     """Returns a boolean as to whether there are uncommitted files in version
     control repository we are inside. Currently supports git and hg.
     """
-    return git_dirty_working_directory() or hg_dirty_working_directory()
+    return git_dirty_working_directory(cwd) or hg_dirty_working_directory(cwd)
 
 
 def branch_color():
@@ -597,23 +618,144 @@ DEFAULT_VALUES['FORMATTER_DICT'] = dict(FORMATTER_DICT)
 
 _FORMATTER = string.Formatter()
 
+# the seconds that a prompt field with no last known value is waited on
+DEFAULT_PROMPT_FIELD_TIMEOUT = 0.1
+
+# fields that have taken at most this many seconds are simply called
+PROMPT_FIELD_INLINE_TIME = 0.005
+
+
+class PromptFields(object):
+    """Evaluates the callable fields of prompts, keeping their last values.
+
+    Fields that have proved fast are called as the prompt is formatted. The
+    others are evaluated in a thread pool, at most once per prompt: if there
+    is a last known value for the field in the current directory, it is used
+    right away, otherwise the field is waited on for up to its timeout in
+    $PROMPT_FIELD_TIMEOUTS. When a fresh value turns out to differ from what
+    was shown, on_change is called, so that the shell can redraw the prompt.
+    The last 100 evaluation times of each field are kept in timings.
+    """
+
+    def __init__(self, max_workers=4):
+        self.on_change = None
+        self.timings = defaultdict(lambda: deque(maxlen=100))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._values = {}  # (name, cwd) -> (field, value)
+        self._pending = {}  # (name, cwd) -> future
+        self._fresh = set()  # keys evaluated since the prompt started
+
+    def new_prompt(self):
+        """Marks the start of a new prompt, for which fields are evaluated
+        again.
+        """
+        with self._lock:
+            self._fresh.clear()
+
+    def _timed(self, name, field):
+        t0 = time.perf_counter()
+        try:
+            return field()
+        finally:
+            t = time.perf_counter() - t0
+            with self._lock:
+                self.timings[name].append(t)
+
+    def _is_fast(self, name):
+        with self._lock:
+            ts = self.timings.get(name)
+            return bool(ts) and max(ts) <= PROMPT_FIELD_INLINE_TIME
+
+    def _timeout(self, name):
+        env = getattr(builtins, '__xonsh_env__', None)
+        timeouts = {} if env is None else env.get('PROMPT_FIELD_TIMEOUTS')
+        return timeouts.get(name, DEFAULT_PROMPT_FIELD_TIMEOUT)
+
+    def _submit(self, key, field):
+        """Evaluates a field in the pool, unless it is already underway."""
+        with self._lock:
+            fut = self._pending.get(key)
+            if fut is not None:
+                return fut
+            self._fresh.add(key)
+            fut = self._executor.submit(self._timed, key[0], field)
+            self._pending[key] = fut
+        fut.add_done_callback(lambda f: self._done(key, field, f))
+        return fut
+
+    def _done(self, key, field, fut):
+        with self._lock:
+            self._pending.pop(key, None)
+            if fut.exception() is not None:
+                return
+            value = fut.result()
+            last = self._values.get(key)
+            self._values[key] = (field, value)
+            changed = last is None or last[0] is not field or last[1] != value
+        if changed and self.on_change is not None:
+            self.on_change()
+
+    def get(self, name, field):
+        """Returns the value of the callable field called name."""
+        key = (name, _get_cwd())
+        if self._is_fast(name):
+            value = self._timed(name, field)
+            with self._lock:
+                self._values[key] = (field, value)
+            return value
+        with self._lock:
+            last = self._values.get(key)
+            fresh = key in self._fresh
+        if last is not None and last[0] is field:
+            if not fresh:
+                self._submit(key, field)
+            return last[1]
+        fut = self._submit(key, field)
+        try:
+            return fut.result(timeout=self._timeout(name))
+        except TimeoutError:
+            # shown once it is known, by way of on_change
+            return None
+
+    def stats(self):
+        """Returns a map from each field name to a dict of the number of
+        recent evaluations, and the median and maximum of their times in
+        seconds.
+        """
+        with self._lock:
+            return {name: {'n': len(ts),
+                           'median': sorted(ts)[len(ts) // 2],
+                           'max': max(ts)}
+                    for name, ts in self.timings.items() if len(ts) > 0}
+
+
+PROMPT_FIELDS = PromptFields()
+
+
+@lru_cache(maxsize=64)
+def _template_names(template):
+    """The names of the fields in a prompt template, parsed once."""
+    return frozenset(i[1] for i in _FORMATTER.parse(template)
+                     if i[1] is not None)
+
+
 def format_prompt(template=DEFAULT_PROMPT, formatter_dict=None):
-    """Formats a xonsh prompt template string."""
+    """Formats a xonsh prompt template string. Callable fields are evaluated
+    by PROMPT_FIELDS.
+    """
     template = template() if callable(template) else template
     if formatter_dict is None:
         fmtter = builtins.__xonsh_env__.get('FORMATTER_DICT', FORMATTER_DICT)
     else:
         fmtter = formatter_dict
-    included_names = set(i[1] for i in _FORMATTER.parse(template))
     fmt = {}
-    for name in included_names:
-        if name is None:
-            continue
+    for name in _template_names(template):
         if name.startswith('$'):
             v = builtins.__xonsh_env__[name[1:]]
         else:
             v = fmtter[name]
-        val = v() if callable(v) else v
+        val = PROMPT_FIELDS.get(name, v) if callable(v) else v
         val = '' if val is None else val
         fmt[name] = val
     return template.format(**fmt)
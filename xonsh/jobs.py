@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """Job control for the xonsh shell."""
+import io
 import os
 import sys
 import time
 import signal
 import builtins
+import tempfile
+import threading
+from collections import deque
 from subprocess import TimeoutExpired
 
 from xonsh.tools import ON_WINDOWS
@@ -14,6 +18,203 @@ try:
 except OSError:
     _shell_tty = None
 
+# whether the job table is kept up to date by a SIGCHLD handler, rather than
+# by polling each job before use.
+_sigchld_installed = False
+# numbers of the background jobs that finished since the last prompt
+_finished_jobs = []
+
+
+def _stdout_buffer():
+    """The binary stream under the terminal's stdout."""
+    stdout = sys.__stdout__
+    return getattr(stdout, 'buffer', stdout)
+
+
+class JobOutput(object):
+    """Captures the output of a background job through a pipe, which a thread
+    reads into a bounded ring buffer. Only the last ``maxsize`` bytes are kept.
+    The buffers of all jobs share a budget of ``maxmem`` bytes of memory, past
+    which a buffer moves its data to a temporary file. Once the job is brought
+    to the foreground, the output goes straight to the terminal instead.
+    """
+
+    _lock = threading.RLock()  # guards the buffers and the memory budget
+    memory = 0  # bytes held in memory by all buffers
+
+    def __init__(self, maxsize=1048576, maxmem=8388608):
+        """
+        Parameters
+        ----------
+        maxsize : int, optional
+            The number of bytes of the most recent output to keep.
+        maxmem : int, optional
+            The number of bytes that all job buffers together keep in memory.
+        """
+        self.maxsize = maxsize
+        self.maxmem = maxmem
+        self.omitted = 0
+        self.unread = False
+        self.eof = False
+        self._chunks = deque()
+        self._size = 0  # bytes in chunks or the file
+        self._file = None
+        self._passthrough = None
+        self._closed = False
+        self._rfd = self._wfd = None
+        self._thread = None
+
+    def fileno(self):
+        """The write end of the pipe, which the job's processes write to."""
+        if self._wfd is None:
+            self._rfd, self._wfd = os.pipe()
+        return self._wfd
+
+    def start(self):
+        """Starts reading, once the job's processes have been spawned."""
+        if self._wfd is None:
+            self.eof = True  # nothing writes to it
+            return
+        os.close(self._wfd)
+        self._wfd = None
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        rfd = self._rfd
+        while True:
+            data = os.read(rfd, 65536)
+            if len(data) == 0:
+                break
+            self.write(data)
+        os.close(rfd)
+        self.eof = True
+
+    def write(self, data):
+        """Adds output to the buffer, or to the terminal if passing through."""
+        with self._lock:
+            if self._closed:
+                return
+            if self._passthrough is not None:
+                self._passthrough.write(data)
+                self._passthrough.flush()
+                return
+            self.unread = True
+            if self._file is None and \
+                    JobOutput.memory + len(data) > self.maxmem:
+                self._spill()
+            if self._file is None:
+                self._chunks.append(data)
+                self._size += len(data)
+                JobOutput.memory += len(data)
+                self._trim_chunks()
+            else:
+                self._file.write(data)
+                self._size += len(data)
+                if self._size > 2 * self.maxsize:
+                    self._trim_file()
+
+    def _trim_chunks(self):
+        chunks = self._chunks
+        excess = self._size - self.maxsize
+        while excess > 0:
+            first = chunks[0]
+            if len(first) <= excess:
+                chunks.popleft()
+                n = len(first)
+            else:
+                chunks[0] = first[excess:]
+                n = excess
+            excess -= n
+            self._size -= n
+            self.omitted += n
+            JobOutput.memory -= n
+
+    def _spill(self):
+        """Moves the buffered data from memory to a temporary file."""
+        self._file = f = tempfile.TemporaryFile()
+        for chunk in self._chunks:
+            f.write(chunk)
+        self._chunks.clear()
+        JobOutput.memory -= self._size
+
+    def _trim_file(self):
+        """Keeps only the last maxsize bytes of the temporary file, which is
+        done once it holds twice that, so that each byte is copied at most
+        once on average.
+        """
+        old = self._file
+        old.seek(self._size - self.maxsize)
+        self._file = new = tempfile.TemporaryFile()
+        new.write(old.read())
+        old.close()
+        self.omitted += self._size - self.maxsize
+        self._size = self.maxsize
+
+    def getvalue(self):
+        """Returns the kept output as bytes, marking it as read."""
+        with self._lock:
+            if self._file is None:
+                data = b''.join(self._chunks)
+            else:
+                f = self._file
+                size = min(self._size, self.maxsize)
+                f.seek(self._size - size)
+                data = f.read(size)
+                f.seek(0, io.SEEK_END)
+            omitted = self.omitted + self._size - len(data)
+            self.unread = False
+        if omitted > 0:
+            marker = '[... {0} bytes omitted ...]\n'.format(omitted).encode()
+            data = marker + data
+        return data
+
+    def clear(self):
+        """Drops the kept output."""
+        with self._lock:
+            if self._file is None:
+                JobOutput.memory -= self._size
+                self._chunks.clear()
+            else:
+                self._file.close()
+                self._file = None
+            self._size = self.omitted = 0
+            self.unread = False
+
+    def to_terminal(self):
+        """Writes the kept output to the terminal, and any later output too."""
+        stream = _stdout_buffer()
+        with self._lock:
+            if self._size > 0:
+                stream.write(self.getvalue())
+                stream.flush()
+                self.clear()
+            self._passthrough = stream
+
+    def to_buffer(self):
+        """Goes back to keeping the output, after to_terminal()."""
+        with self._lock:
+            self._passthrough = None
+
+    @property
+    def done(self):
+        """Whether the output may be released: it has all been read or shown."""
+        return not self.unread and (self.eof or self._passthrough is not None)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Releases the buffer, later output is discarded."""
+        with self._lock:
+            self.clear()
+            self._closed = True
+        if self._wfd is not None:
+            # never started
+            os.close(self._wfd)
+            os.close(self._rfd)
+            self._wfd = None
+
 
 if ON_WINDOWS:
     def _continue(obj):
@@ -31,6 +232,11 @@ if ON_WINDOWS:
     def _set_pgrp(info):
         pass
 
+
+    def install_sigchld_handler():
+        pass
+
+
     def wait_for_active_job(signal_to_send=None):
         """
         Wait for the active job to finish, to be killed by SIGINT, or to be
@@ -42,7 +248,8 @@ if ON_WINDOWS:
             return
         job = builtins.__xonsh_all_jobs__[act]
         obj = job['obj']
-        if job['bg']:
+        if job['bg'] or obj.pid is None:
+            # a group of commands is waited for by the thread that runs it
             return
         while obj.returncode is None:
             try:
@@ -52,6 +259,7 @@ if ON_WINDOWS:
             except KeyboardInterrupt:
                 obj.kill()
         if obj.poll() is not None:
+            job['status'] = 'done'
             builtins.__xonsh_active_job__ = None
 
 else:
@@ -60,11 +268,23 @@ else:
 
 
     def _kill(obj):
-        os.kill(obj.pid, signal.SIGKILL)
+        if obj.pid is None:
+            obj.kill()  # not a single process, e.g. a parallel group
+        else:
+            os.kill(obj.pid, signal.SIGKILL)
+
+
+    def _ignore_signal(signum, frame):
+        pass
 
 
     def ignore_sigtstp():
-        signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+        """Keeps ctrl-z from stopping the shell. The signal is caught and
+        dropped, rather than ignored, because ignored signals are inherited by
+        subprocesses, while caught ones are reset to their default by exec.
+        """
+        signal.signal(signal.SIGTSTP, _ignore_signal)
+        signal.siginterrupt(signal.SIGTSTP, False)
 
 
     def _set_pgrp(info):
@@ -74,6 +294,36 @@ else:
             pass
 
 
+    def _sigchld_handler(signum, frame):
+        """Marks background jobs whose process has exited as done, as soon as
+        it exits. Only background jobs are reaped here, and only through their
+        own poll() method, so that the status of foreground processes, which
+        are being waited on, and of other children, is never taken from them.
+        The finished jobs are reported at the next prompt.
+        """
+        all_jobs = getattr(builtins, '__xonsh_all_jobs__', None)
+        if not all_jobs:
+            return
+        for num, job in list(all_jobs.items()):
+            if not job['bg'] or job['status'] == 'done':
+                continue
+            if job['obj'].poll() is not None:
+                job['status'] = 'done'
+                _finished_jobs.append(num)
+
+
+    def install_sigchld_handler():
+        """Installs the SIGCHLD handler that keeps the job table up to date,
+        rather than polling every job before each command. This must be called
+        from the main thread.
+        """
+        global _sigchld_installed
+        signal.signal(signal.SIGCHLD, _sigchld_handler)
+        # don't let the signal interrupt system calls, such as reading input
+        signal.siginterrupt(signal.SIGCHLD, False)
+        _sigchld_installed = True
+
+
     _shell_pgrp = os.getpgrp()
 
     _block_when_giving = (signal.SIGTTOU, signal.SIGTTIN, signal.SIGTSTP)
@@ -102,6 +352,9 @@ else:
         obj = job['obj']
         if job['bg'] and job['status'] == 'running':
             return
+        if obj.pid is None:
+            # a group of commands is waited for by the thread that runs it
+            return
         pgrp = job['pgrp']
 
         # give the terminal over to the fg process
@@ -119,21 +372,32 @@ else:
                 _give_terminal_to(_shell_pgrp)
                 return
 
-        _, wcode = os.waitpid(obj.pid, os.WUNTRACED)
-        if os.WIFSTOPPED(wcode):
+        try:
+            _, wcode = os.waitpid(obj.pid, os.WUNTRACED)
+        except ChildProcessError:
+            # it has already been reaped, e.g. by a tee'd pseudo-terminal
+            wcode = None
+        if wcode is None:
+            obj.poll()
+            job['status'] = 'done'
+        elif os.WIFSTOPPED(wcode):
             job['bg'] = True
             job['status'] = 'stopped'
+            if job.get('output') is not None:
+                job['output'].to_buffer()
             print()  # get a newline because ^Z will have been printed
             print_one_job(act)
         elif os.WIFSIGNALED(wcode):
             print()  # get a newline because ^C will have been printed
             obj.signal = (os.WTERMSIG(wcode), os.WCOREDUMP(wcode))
             obj.returncode = None
+            job['status'] = 'done'
         else:
             obj.returncode = os.WEXITSTATUS(wcode)
             obj.signal = None
+            job['status'] = 'done'
 
-        if obj.poll() is not None:
+        if job['status'] == 'done':
             builtins.__xonsh_active_job__ = None
 
         _give_terminal_to(_shell_pgrp)  # give terminal back to the shell
@@ -141,12 +405,19 @@ else:
 
 def _clear_dead_jobs():
     to_remove = set()
-    for num, job in builtins.__xonsh_all_jobs__.items():
-        obj = job['obj']
-        if obj.poll() is not None:
-            to_remove.add(num)
+    for num, job in list(builtins.__xonsh_all_jobs__.items()):
+        # background jobs are kept up to date by the SIGCHLD handler
+        polled = not (_sigchld_installed and job['bg'])
+        if job['status'] != 'done' and polled and job['obj'].poll() is not None:
+            job['status'] = 'done'
+        if job['status'] == 'done' and num not in _finished_jobs:
+            output = job.get('output')
+            if output is None or output.done:
+                to_remove.add(num)
     for i in to_remove:
-        del builtins.__xonsh_all_jobs__[i]
+        job = builtins.__xonsh_all_jobs__.pop(i, None)
+        if job is not None and job.get('output') is not None:
+            job['output'].close()
         if builtins.__xonsh_active_job__ == i:
             builtins.__xonsh_active_job__ = None
     if builtins.__xonsh_active_job__ is None:
@@ -161,6 +432,17 @@ def _reactivate_job():
 
 
 
+def print_finished_jobs():
+    """Prints the background jobs that have finished since this was last
+    called, and removes them from the job table.
+    """
+    if len(_finished_jobs) == 0:
+        return
+    while len(_finished_jobs) > 0:
+        print_one_job(_finished_jobs.pop(0))
+    _clear_dead_jobs()
+
+
 def print_one_job(num):
     """Print a line describing job number ``num``."""
     try:
@@ -171,7 +453,7 @@ def print_one_job(num):
     status = job['status']
     cmd = [' '.join(i) if isinstance(i, list) else i for i in job['cmds']]
     cmd = ' '.join(cmd)
-    pid = job['pids'][-1]
+    pid = job['pids'][-1] if len(job['pids']) > 0 else ''
     bg = ' &' if job['bg'] else ''
     print('{}[{}] {}: {}{} ({})'.format(act, num, status, cmd, bg, pid))
 
@@ -200,6 +482,18 @@ def add_job(info):
         print_one_job(num)
 
 
+def cancel_thread_jobs(threads):
+    """Cancels the groups of commands, such as those of parallel, that are
+    run from any of the given threads. Callable aliases run in threads of
+    their own, which never get KeyboardInterrupt, so the shell passes ctrl-c
+    on to their groups this way.
+    """
+    all_jobs = getattr(builtins, '__xonsh_all_jobs__', {})
+    for job in list(all_jobs.values()):
+        if job.get('thread') in threads:
+            job['obj'].cancel()
+
+
 def _default_sigint_handler(num, frame):
     raise KeyboardInterrupt
 
@@ -213,15 +507,42 @@ def kill_all_jobs():
         _kill(job['obj'])
 
 
+def _job_output(args):
+    """Returns the captured output of the job numbered args[0]."""
+    try:
+        num = int(args[0])
+    except ValueError:
+        return '', 'Invalid job: {}\n'.format(args[0])
+    job = builtins.__xonsh_all_jobs__.get(num)
+    if job is None:
+        return '', 'Invalid job: {}\n'.format(args[0])
+    output = job.get('output')
+    if output is None:
+        return '', 'Output of job {} is not captured\n'.format(num)
+    env = builtins.__xonsh_env__
+    out = output.getvalue().decode(encoding=env.get('XONSH_ENCODING'),
+                                   errors=env.get('XONSH_ENCODING_ERRORS'))
+    _clear_dead_jobs()
+    return out, None
+
+
 def jobs(args, stdin=None):
     """
     xonsh command: jobs
 
-    Display a list of all current jobs.
+    Display a list of all current jobs, or with ``--output N``, the output
+    that background job N has written since it was started.
     """
     _clear_dead_jobs()
+    if len(args) == 2 and args[0] in ('-o', '--output'):
+        return _job_output(args[1:])
+    elif len(args) != 0:
+        return '', 'usage: jobs [--output N]\n'
     for j in sorted(builtins.__xonsh_all_jobs__):
         print_one_job(j)
+    # finished jobs have now been reported
+    del _finished_jobs[:]
+    _clear_dead_jobs()
     return None, None
 
 
@@ -247,8 +568,17 @@ def fg(args, stdin=None):
             return '', 'Invalid job: {}\n'.format(args[0])
     else:
         return '', 'fg expects 0 or 1 arguments, not {}\n'.format(len(args))
-    builtins.__xonsh_active_job__ = act
     job = builtins.__xonsh_all_jobs__[act]
+    output = job.get('output')
+    if output is not None:
+        # show what was kept, and the rest as it is written
+        output.to_terminal()
+    if job['status'] == 'done':
+        _clear_dead_jobs()
+        return '', 'Job has terminated: {}\n'.format(act)
+    if job['obj'].pid is None:
+        return '', 'Job is not a single process: {}\n'.format(act)
+    builtins.__xonsh_active_job__ = act
     job['bg'] = False
     job['status'] = 'running'
     print_one_job(act)
@@ -277,9 +607,15 @@ def bg(args, stdin=None):
             return '', 'Invalid job: {}\n'.format(args[0])
     else:
         return '', 'bg expects 0 or 1 arguments, not {}\n'.format(len(args))
-    builtins.__xonsh_active_job__ = act
     job = builtins.__xonsh_all_jobs__[act]
+    if job['status'] == 'done':
+        return '', 'Job has terminated: {}\n'.format(act)
+    if job['obj'].pid is None:
+        return '', 'Job is not a single process: {}\n'.format(act)
+    builtins.__xonsh_active_job__ = act
     job['bg'] = True
+    if job.get('output') is not None:
+        job['output'].to_buffer()
     # When the SIGCONT is sent job['status'] is set to running.
     print_one_job(act)
     wait_for_active_job(_continue(job['obj']))
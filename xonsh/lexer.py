@@ -184,6 +184,23 @@ def handle_dollar(state, token, stream):
         yield _new_token("ERRORTOKEN", m, token.start)
 
 
+def handle_bang(state, token, stream):
+    """
+    Function for generating PLY tokens associated with ``!``.
+    """
+    n = next(stream, None)
+
+    if n is not None and n.type == tokenize.OP and n.string == '(' and \
+            n.start == token.end:
+        state['pymode'].append((False, '!(', ')', token.start))
+        state['last'] = n
+        yield _new_token('BANG_LPAREN', '!(', token.start)
+    else:
+        yield from handle_error_token(state, token, stream)
+        if n is not None:
+            yield from handle_token(state, n, stream)
+
+
 def handle_at(state, token, stream):
     """
     Function for generating PLY tokens associated with ``@``.
@@ -371,6 +388,7 @@ special_handlers = {
     (tokenize.OP, '['): handle_lbracket,
     (tokenize.OP, ']'): handle_rbracket,
     (tokenize.ERRORTOKEN, '$'): handle_dollar,
+    (tokenize.ERRORTOKEN, '!'): handle_bang,
     (tokenize.ERRORTOKEN, '`'): handle_backtick,
     (tokenize.ERRORTOKEN, '?'): handle_question,
     (tokenize.ERRORTOKEN, ' '): handle_error_space,
@@ -423,12 +441,21 @@ def handle_token(state, token, stream):
         yield _new_token("ERRORTOKEN", m, token.start)
 
 
-def get_tokens(s):
+def _watched(tokstream, watch):
+    for token in tokstream:
+        watch(token)
+        yield token
+
+
+def get_tokens(s, watch=None):
     """
     Given a string containing xonsh code, generates a stream of relevant PLY
-    tokens using ``handle_token``.
+    tokens using ``handle_token``. If given, watch is called with each
+    ``tokenize`` token as it is read.
     """
     tokstream = tokenize.tokenize(BytesIO(s.encode('utf-8')).readline)
+    if watch is not None:
+        tokstream = _watched(tokstream, watch)
     state = {'indents': [0], 'pymode': [(True, '', '', (0, 0))], 'last': None}
     while True:
         try:
@@ -522,4 +549,5 @@ class Lexer(object):
         'DOLLAR_LPAREN',         # $(
         'DOLLAR_LBRACE',         # ${
         'DOLLAR_LBRACKET',       # $[
+        'BANG_LPAREN',           # !(
     ) + tuple(i.upper() for i in kwlist) + tuple(i.upper() for i in future_kwlist)
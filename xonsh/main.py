@@ -9,7 +9,7 @@ from contextlib import contextmanager
 from xonsh import __version__
 from xonsh.shell import Shell
 from xonsh.pretty import pprint
-from xonsh.jobs import ignore_sigtstp
+from xonsh.jobs import ignore_sigtstp, install_sigchld_handler
 
 def path_argument(s):
     """Return a path only if the path is actually legal
@@ -135,6 +135,7 @@ def main(argv=None):
         # otherwise, enter the shell
         env['XONSH_INTERACTIVE'] = True
         ignore_sigtstp()
+        install_sigchld_handler()
         shell.cmdloop()
     postmain(args)
 
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""Runs many commands at once, with bounded concurrency, for the xonsh shell."""
+import os
+import sys
+import time
+import queue
+import signal
+import inspect
+import builtins
+import threading
+from collections import deque
+from argparse import ArgumentParser, REMAINDER
+from subprocess import Popen, PIPE, STDOUT, DEVNULL
+
+from xonsh.jobs import JobOutput, get_next_job_number
+from xonsh.proc import ProcProxy, SimpleProcProxy
+
+OUTPUT_MODES = frozenset(['group', 'line'])
+
+
+def _env_get(key, default):
+    env = getattr(builtins, '__xonsh_env__', None)
+    return default if env is None else env.get(key, default)
+
+
+class ParallelJobs(object):
+    """Runs a list of commands, at most ``max_procs`` at a time. Each command
+    is a list of arguments, whose first element names a subprocess or an alias,
+    or is itself a callable alias. While running, the group is listed in the
+    xonsh job table as a single job.
+    """
+
+    def __init__(self, cmds, max_procs=None, output='group', keep_order=False,
+                 stdout=None, name='parallel'):
+        """
+        Parameters
+        ----------
+        cmds : list of lists
+            The commands to run.
+        max_procs : int, optional
+            The number of commands to run at once, the number of CPUs if None.
+        output : str, optional
+            With 'group', the output of each command is kept until it finishes
+            and then written all at once. With 'line', output is written a
+            line at a time, as soon as the line is complete.
+        keep_order : bool, optional
+            With 'group' output, write the outputs in the order of the
+            commands, rather than in the order that they finish.
+        stdout : text file-like, optional
+            Where the output goes, sys.stdout by default. The stdout and
+            stderr of the commands are both written here.
+        name : str, optional
+            The name of the group in the job table.
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError('output must be one of {0}, not {1!r}'.format(
+                             sorted(OUTPUT_MODES), output))
+        self.cmds = [list(cmd) for cmd in cmds]
+        self.max_procs = max(1, max_procs or os.cpu_count() or 1)
+        self.output = output
+        self.keep_order = keep_order
+        self.stdout = sys.stdout if stdout is None else stdout
+        self.name = name
+        self.returncodes = [None] * len(self.cmds)
+        self.returncode = None
+        self.cancelled = False
+        self.pid = None
+        self._running = {}  # command index -> process
+        self._finished = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._encoding = _env_get('XONSH_ENCODING', 'utf-8')
+        self._errors = _env_get('XONSH_ENCODING_ERRORS', 'surrogateescape')
+        self._job_num = None
+
+    def poll(self):
+        """The number of failed commands, or None while still running."""
+        return self.returncode
+
+    def run(self):
+        """Runs all of the commands and returns their return codes. A command
+        that was not run, because the group was cancelled, has None. A Ctrl-C,
+        or a command that is interrupted by one, cancels the whole group.
+        When this runs in an alias's thread, the shell calls cancel() on
+        Ctrl-C instead.
+        """
+        pending = deque(range(len(self.cmds)))
+        kept = {}  # finished outputs that wait for earlier ones to be written
+        next_out = 0
+        self._add_job()
+        try:
+            while len(pending) > 0 or len(self._running) > 0:
+                while len(pending) > 0 and not self.cancelled and \
+                        len(self._running) < self.max_procs:
+                    self._start(pending.popleft())
+                if len(self._running) == 0:
+                    break
+                i, out = self._finished.get()
+                del self._running[i]
+                if self.returncodes[i] == -signal.SIGINT:
+                    self.cancel()
+                if not self.keep_order:
+                    self._write_output(out)
+                    continue
+                kept[i] = out
+                while next_out in kept:
+                    self._write_output(kept.pop(next_out))
+                    next_out += 1
+        except KeyboardInterrupt:
+            self.cancel()
+            while len(self._running) > 0:
+                i, out = self._finished.get()
+                del self._running[i]
+                kept[i] = out
+            raise
+        finally:
+            for i in sorted(kept):
+                self._write_output(kept[i])
+            self._remove_job()
+        return self.returncodes
+
+    def cancel(self):
+        """Starts no more commands and interrupts the running subprocesses.
+        Callable aliases cannot be interrupted, and are left to finish.
+        """
+        self.cancelled = True
+        for proc in list(self._running.values()):
+            self._interrupt(proc)
+
+    def _interrupt(self, proc):
+        if isinstance(proc, Popen) and proc.poll() is None:
+            try:
+                proc.send_signal(signal.SIGINT)
+            except OSError:
+                pass
+
+    def kill(self):
+        """Kills the running subprocesses, as when exiting xonsh."""
+        self.cancelled = True
+        for proc in list(self._running.values()):
+            if isinstance(proc, Popen):
+                proc.kill()
+
+    def _spawn(self, cmd):
+        aliases = getattr(builtins, 'aliases', {})
+        alias = cmd[0] if callable(cmd[0]) else aliases.get(cmd[0], None)
+        if callable(alias):
+            numargs = len(inspect.signature(alias).parameters)
+            cls = SimpleProcProxy if numargs == 2 else ProcProxy
+            return cls(alias, cmd[1:], None, PIPE, STDOUT)
+        elif alias is not None:
+            cmd = alias + cmd[1:]
+        env = getattr(builtins, '__xonsh_env__', None)
+        return Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT,
+                     env=None if env is None else env.detype())
+
+    def _start(self, i):
+        cmd = self.cmds[i]
+        try:
+            proc = self._spawn(cmd)
+        except (FileNotFoundError, PermissionError) as e:
+            msg = 'xonsh: parallel: {0}: {1}\n'.format(cmd[0], e.strerror)
+            self.returncodes[i] = 127 if isinstance(e, FileNotFoundError) \
+                                      else 126
+            self._running[i] = None
+            self._finished.put((i, msg.encode(self._encoding, self._errors)))
+            return
+        self._running[i] = proc
+        if self.cancelled:
+            # cancelled from another thread while this was being started
+            self._interrupt(proc)
+        if self._job_num is not None:
+            self._job['pids'].append(proc.pid)
+        target = self._read_lines if self.output == 'line' else self._read_all
+        t = threading.Thread(target=target, args=(i, proc), daemon=True)
+        t.start()
+
+    def _read_all(self, i, proc):
+        out = JobOutput(maxsize=_env_get('XONSH_JOB_OUTPUT_SIZE', 1048576),
+                        maxmem=_env_get('XONSH_JOB_OUTPUT_MEMORY', 8388608))
+        try:
+            read = getattr(proc.stdout, 'read1', proc.stdout.read)
+            for data in iter(lambda: read(65536), b''):
+                out.write(data)
+        finally:
+            self._wait(i, proc)
+            self._finished.put((i, out))
+
+    def _read_lines(self, i, proc):
+        try:
+            for line in iter(proc.stdout.readline, b''):
+                self._write_output(line)
+        finally:
+            self._wait(i, proc)
+            self._finished.put((i, None))
+
+    def _wait(self, i, proc):
+        proc.stdout.close()
+        proc.wait()
+        rtn = proc.returncode
+        self.returncodes[i] = 0 if rtn is None else rtn
+
+    def _write_output(self, out):
+        if out is None:
+            return
+        data = out if isinstance(out, bytes) else out.getvalue()
+        if isinstance(out, JobOutput):
+            out.close()
+        if len(data) == 0:
+            return
+        with self._write_lock:
+            self.stdout.write(data.decode(self._encoding, self._errors))
+            self.stdout.flush()
+
+    def _add_job(self):
+        """Lists the group in the job table, without making it the active
+        job, which is waited on by the shell. The thread that runs the group
+        is noted, so that the shell can cancel it on ctrl-c when that is an
+        alias's thread, which does not get KeyboardInterrupt itself.
+        """
+        all_jobs = getattr(builtins, '__xonsh_all_jobs__', None)
+        if all_jobs is None:
+            return
+        self._job = {
+            'cmds': [[self.name, '({0} commands)'.format(len(self.cmds))]],
+            'pids': [],
+            'obj': self,
+            'bg': False,
+            'thread': threading.current_thread(),
+            'status': 'running',
+            'started': time.time(),
+        }
+        self._job_num = get_next_job_number()
+        all_jobs[self._job_num] = self._job
+
+    def _remove_job(self):
+        # removed before the return code is set, so that the group is never
+        # reported as a finished background job
+        if self._job_num is not None:
+            builtins.__xonsh_all_jobs__.pop(self._job_num, None)
+            self._job_num = None
+        self.returncode = sum(1 for r in self.returncodes if r != 0)
+
+
+def run_parallel(cmds, max_procs=None, output='group', keep_order=False,
+                 stdout=None):
+    """Runs the commands, at most max_procs at a time, and returns their
+    return codes. See ParallelJobs for the arguments.
+    """
+    group = ParallelJobs(cmds, max_procs=max_procs, output=output,
+                         keep_order=keep_order, stdout=stdout)
+    return group.run()
+
+
+_PARALLEL_PARSER = None
+
+
+def _ensure_parallel_parser():
+    global _PARALLEL_PARSER
+    if _PARALLEL_PARSER is not None:
+        return _PARALLEL_PARSER
+    desc = ("Runs a command once for each input, several at a time. The "
+            "inputs are the arguments after ':::', or else the lines of "
+            "stdin. Each occurrence of '{}' in the command is replaced by "
+            "the input, which is otherwise added as the last argument.")
+    parser = ArgumentParser('parallel', description=desc)
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        dest='max_procs',
+                        help='number of commands to run at once, the number '
+                             'of CPUs by default')
+    parser.add_argument('-k', '--keep-order', action='store_true',
+                        default=False, dest='keep_order',
+                        help='write the outputs in the order of the inputs')
+    parser.add_argument('--line-buffer', action='store_const', const='line',
+                        default='group', dest='output',
+                        help='write output a line at a time, as it is '
+                             'produced, rather than all of the output of '
+                             'each command once it finishes')
+    parser.add_argument('command', nargs=REMAINDER,
+                        help='the command and its arguments')
+    _PARALLEL_PARSER = parser
+    return parser
+
+
+def _make_cmds(command, inputs):
+    cmds = []
+    has_slot = any('{}' in arg for arg in command)
+    for item in inputs:
+        if has_slot:
+            cmds.append([arg.replace('{}', item) for arg in command])
+        else:
+            cmds.append(command + [item])
+    return cmds
+
+
+def parallel(args, stdin, stdout, stderr):
+    """Runs a command for each of many inputs concurrently, like GNU parallel
+    or ``xargs -P``. The return code is the number of commands that failed,
+    up to 101.
+    """
+    parser = _ensure_parallel_parser()
+    ns = parser.parse_args(args)
+    command = ns.command
+    if ':::' in command:
+        i = command.index(':::')
+        command, inputs = command[:i], command[i+1:]
+    else:
+        inputs = [line.rstrip('\n') for line in stdin]
+        inputs = [line for line in inputs if len(line) > 0]
+    if len(command) == 0:
+        stderr.write('parallel: no command given\n')
+        return 2
+    group = ParallelJobs(_make_cmds(command, inputs), max_procs=ns.max_procs,
+                         output=ns.output, keep_order=ns.keep_order,
+                         stdout=stdout)
+    group.run()
+    return min(group.returncode, 101)
@@ -1722,6 +1722,7 @@ class Parser(object):
                 | DOLLAR_LBRACE test RBRACE
                 | DOLLAR_LPAREN subproc RPAREN
                 | DOLLAR_LBRACKET subproc RBRACKET
+                | BANG_LPAREN subproc RPAREN
         """
         p1 = p[1]
         if len(p) == 2:
@@ -1809,7 +1810,7 @@ class Parser(object):
                               col_offset=self.col)
         elif p1 == '{':
             p0 = p2
-        elif p1.startswith('$'):
+        elif p1.startswith('$') or p1 == '!(':
             p0 = self._dollar_rules(p)
         else:
             assert False
@@ -2287,6 +2288,10 @@ class Parser(object):
             p0 = xonsh_call('__xonsh_subproc_uncaptured__', p2,
                             lineno=lineno,
                             col=col)
+        elif p1 == '!(':
+            p0 = xonsh_call('__xonsh_subproc_captured_iter__', p2,
+                            lineno=lineno,
+                            col=col)
         else:
             assert False
         return p0
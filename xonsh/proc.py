@@ -11,9 +11,11 @@ import io
 import os
 import sys
 import time
+import codecs
 import builtins
-from threading import Thread
-from collections import Sequence
+from itertools import chain
+from threading import Thread, Condition
+from collections import Sequence, deque
 from subprocess import Popen, PIPE, DEVNULL, STDOUT, TimeoutExpired
 
 from xonsh.tools import (redirect_stdout, redirect_stderr, ON_WINDOWS, ON_LINUX,
@@ -49,6 +51,200 @@ if ON_WINDOWS:
         __str__ = __repr__
 
 
+class StreamPipe(object):
+    """An in-process pipe that connects two callable aliases in a pipeline.
+
+    Strings written to one end are handed to the reader as they are, without
+    being encoded, copied into an OS pipe or decoded again. Like a buffered
+    file, small writes are gathered until bufsize characters are waiting or
+    the pipe is flushed. The writer blocks once maxsize such chunks are
+    waiting to be read, and gets a BrokenPipeError if the reader has gone
+    away. The reading end supports the usual file methods as well as
+    iterating over lines, or over the written chunks with ``chunks()``.
+    """
+
+    def __init__(self, maxsize=16, bufsize=io.DEFAULT_BUFFER_SIZE):
+        self.maxsize = maxsize
+        self.bufsize = bufsize
+        self.closed = False
+        self._chunks = deque()
+        self._cond = Condition()
+        self._read_closed = False
+        # writer side
+        self._pending = []
+        self._npending = 0
+        # reader side, complete lines waiting to be read and the start of
+        # a line whose end has not been written yet
+        self._rbuf = io.StringIO()
+        self._tail = ''
+
+    #
+    # writing end
+    #
+
+    def write(self, s):
+        """Sends a string to the reader."""
+        self._pending.append(s)
+        self._npending += len(s)
+        if self._npending >= self.bufsize:
+            self.flush()
+        return len(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Hands everything written so far to the reader."""
+        if self.closed:
+            raise ValueError('write to closed pipe')
+        if self._npending == 0:
+            return
+        chunk = ''.join(self._pending)
+        self._pending.clear()
+        self._npending = 0
+        with self._cond:
+            while len(self._chunks) >= self.maxsize and not self._read_closed:
+                self._cond.wait()
+            if self._read_closed:
+                raise BrokenPipeError('reader has closed the pipe')
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def close(self):
+        """Closes the writing end, the reader will see end-of-file once it has
+        read everything that was written.
+        """
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self.closed = True
+                self._cond.notify_all()
+
+    #
+    # reading end
+    #
+
+    def _pop_chunk(self):
+        """Returns the next chunk from the writer, blocking until one is
+        written. Returns None at end-of-file.
+        """
+        with self._cond:
+            while len(self._chunks) == 0 and not self.closed:
+                self._cond.wait()
+            if len(self._chunks) == 0:
+                return None
+            chunk = self._chunks.popleft()
+            self._cond.notify_all()
+        return chunk
+
+    def _next_chunk(self):
+        """Refills the read buffer from the next chunk. Only complete lines go
+        into the read buffer, a trailing partial line is kept back until the
+        rest of it arrives. Returns False at end-of-file.
+        """
+        chunk = self._pop_chunk()
+        if chunk is None:
+            if len(self._tail) == 0:
+                return False
+            chunk, self._tail = self._tail, ''
+        else:
+            if self._tail:
+                chunk, self._tail = self._tail + chunk, ''
+            i = chunk.rfind('\n') + 1
+            if i < len(chunk):
+                chunk, self._tail = chunk[:i], chunk[i:]
+        self._rbuf = io.StringIO(chunk, newline='\n')
+        return True
+
+    def chunks(self):
+        """Iterates over the strings as they were handed over by the writer."""
+        chunk = self._rbuf.read() + self._tail
+        self._tail = ''
+        if not chunk:
+            chunk = self._pop_chunk()
+        while chunk is not None:
+            yield chunk
+            chunk = self._pop_chunk()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return ''.join(self.chunks())
+        parts = []
+        while size > 0:
+            s = self._rbuf.read(size)
+            if len(s) == 0 and len(self._tail) > 0:
+                s, self._tail = self._tail[:size], self._tail[size:]
+            if len(s) == 0 and not self._next_chunk():
+                break
+            parts.append(s)
+            size -= len(s)
+        return ''.join(parts)
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        line = self._rbuf.readline(size)
+        while len(line) == 0:
+            if 0 <= size <= len(self._tail):
+                line, self._tail = self._tail[:size], self._tail[size:]
+            elif self._next_chunk():
+                line = self._rbuf.readline(size)
+            else:
+                break
+        return line
+
+    def readlines(self):
+        return list(self)
+
+    def _iter_rbufs(self):
+        rbuf = self._rbuf
+        yield rbuf
+        while True:
+            # readline() may have moved on to the next chunk in between
+            if self._rbuf is rbuf and not self._next_chunk():
+                return
+            rbuf = self._rbuf
+            yield rbuf
+
+    def __iter__(self):
+        # iterating over each buffer with chain keeps the per-line work in C
+        return chain.from_iterable(self._iter_rbufs())
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close_read(self):
+        """Closes the reading end, discarding anything that is still waiting
+        to be read. Later writes raise BrokenPipeError.
+        """
+        with self._cond:
+            self._read_closed = True
+            self._chunks.clear()
+            self._cond.notify_all()
+        self._rbuf = io.StringIO()
+        self._tail = ''
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise io.UnsupportedOperation('in-process pipes have no file '
+                                      'descriptor')
+
+
 class ProcProxy(Thread):
     """
     Class representing a function to be run as a subprocess-mode command.
@@ -69,11 +265,12 @@ class ProcProxy(Thread):
             A file-like object representing stdin (input can be read from
             here).  If `stdin` is not provided or if it is explicitly set to
             `None`, then an instance of `io.StringIO` representing an empty
-            file is used.
+            file is used.  A `StreamPipe` is handed to the function as is.
         stdout : file-like, optional
             A file-like object representing stdout (normal output can be
             written here).  If `stdout` is not provided or if it is explicitly
-            set to `None`, then `sys.stdout` is used.
+            set to `None`, then `sys.stdout` is used.  A `StreamPipe` is
+            handed to the function as is, and closed when it returns.
         stderr : file-like, optional
             A file-like object representing stderr (error output can be
             written here).  If `stderr` is not provided or if it is explicitly
@@ -104,6 +301,15 @@ class ProcProxy(Thread):
         self.returncode = None
         self.wait = self.join
 
+        # in-process pipes bypass the OS handles entirely
+        self._pipe_in = self._pipe_out = None
+        self._err_to_pipe = False
+        if isinstance(stdin, StreamPipe):
+            self._pipe_in, stdin = stdin, None
+        if isinstance(stdout, StreamPipe):
+            self._pipe_out, stdout = stdout, None
+            if stderr is STDOUT:
+                self._err_to_pipe, stderr = True, None
         handles = self._get_handles(stdin, stdout, stderr)
         (self.p2cread, self.p2cwrite,
          self.c2pread, self.c2pwrite,
@@ -137,6 +343,11 @@ class ProcProxy(Thread):
             if universal_newlines:
                 self.stderr = io.TextIOWrapper(self.stderr)
 
+        if self._pipe_in is not None:
+            self.stdin = self._pipe_in
+        if self._pipe_out is not None:
+            self.stdout = self._pipe_out
+
         Thread.__init__(self)
         self.start()
 
@@ -147,7 +358,9 @@ class ProcProxy(Thread):
         """
         if self.f is None:
             return
-        if self.stdin is not None:
+        if self._pipe_in is not None:
+            sp_stdin = self._pipe_in
+        elif self.stdin is not None:
             sp_stdin = io.TextIOWrapper(self.stdin)
         else:
             sp_stdin = io.StringIO("")
@@ -158,18 +371,35 @@ class ProcProxy(Thread):
             if self.errwrite != -1:
                 self.errwrite = msvcrt.open_osfhandle(self.errwrite.Detach(), 0)
 
-        if self.c2pwrite != -1:
+        if self._pipe_out is not None:
+            sp_stdout = self._pipe_out
+        elif self.c2pwrite != -1:
             sp_stdout = io.TextIOWrapper(io.open(self.c2pwrite, 'wb', -1))
         else:
             sp_stdout = sys.stdout
-        if self.errwrite == self.c2pwrite:
+        if self._err_to_pipe:
+            sp_stderr = sp_stdout
+        elif self.errwrite == self.c2pwrite and self._pipe_out is None:
             sp_stderr = sp_stdout
         elif self.errwrite != -1:
             sp_stderr = io.TextIOWrapper(io.open(self.errwrite, 'wb', -1))
         else:
             sp_stderr = sys.stderr
 
-        r = self.f(self.args, sp_stdin, sp_stdout, sp_stderr)
+        try:
+            r = self.f(self.args, sp_stdin, sp_stdout, sp_stderr)
+        except BrokenPipeError:
+            # the next command stopped reading, as with SIGPIPE
+            r = 1
+        finally:
+            if self._pipe_out is not None:
+                try:
+                    self._pipe_out.close()
+                except BrokenPipeError:
+                    # the next command finished without reading the rest
+                    r = 1
+            if self._pipe_in is not None:
+                self._pipe_in.close_read()
         self.returncode = 0 if r is None else r
 
     def poll(self):
@@ -350,6 +580,8 @@ class SimpleProcProxy(ProcProxy):
                 elif r is not None:
                     stdout.write(str(r))
                 return cmd_result
+            except BrokenPipeError:
+                return 1
             except Exception:
                 print_exception()
                 return 1  # returncode for failure
@@ -358,6 +590,102 @@ class SimpleProcProxy(ProcProxy):
                          universal_newlines)
 
 
+class CapturedLines(object):
+    """Lazily iterates over the output of a pipeline of commands, decoding
+    it as it is written rather than once the commands are done. Only a
+    buffer's worth of output is held in memory at a time. As an iterator it
+    gives lines, with any kind of line ending turned into a newline, and
+    ``chunks()`` gives whatever text is available at once. Only one of them
+    should be used. Once the output is exhausted, the commands are waited for
+    and the return code of the last one is stored in ``returncode``.
+    """
+
+    def __init__(self, procs, encoding='utf-8', errors='strict'):
+        """Parameters
+        ----------
+        procs : list
+            The processes (or process proxies) of the pipeline, the last of
+            which writes to a binary pipe that is read here.
+        encoding : str, optional
+            The encoding of the output.
+        errors : str, optional
+            How decoding errors are handled.
+        """
+        self.procs = procs
+        self.proc = procs[-1]
+        self.encoding = encoding
+        self.errors = errors
+        self.returncode = None
+        self.closed = False
+        self._exhausted = False
+        # the output may have been redirected elsewhere
+        stdout = self.proc.stdout if self.proc.stdout is not None \
+                                  else io.BytesIO()
+        self._stdout = io.TextIOWrapper(stdout, encoding=encoding,
+                                        errors=errors)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            line = self._stdout.readline()
+        except BaseException:
+            self.close()
+            raise
+        if len(line) == 0:
+            self._exhausted = True
+            self.close()
+            raise StopIteration
+        return line
+
+    def chunks(self, size=io.DEFAULT_BUFFER_SIZE):
+        """Iterates over the decoded output, giving up to size bytes worth
+        of text as soon as it is available.
+        """
+        decoder = codecs.getincrementaldecoder(self.encoding)(self.errors)
+        decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        read1 = self._stdout.buffer.read1
+        try:
+            while True:
+                b = read1(size)
+                s = decoder.decode(b, final=len(b) == 0)
+                if len(s) > 0:
+                    yield s
+                if len(b) == 0:
+                    self._exhausted = True
+                    break
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops reading the output. If it has all been read, waits for the
+        commands and stores the return code. Otherwise, commands that are
+        still writing get a broken pipe.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._stdout.close()
+        if self._exhausted:
+            for proc in self.procs:
+                proc.wait()
+            self.returncode = self.proc.returncode
+        else:
+            self.returncode = self.proc.poll()
+        if self.returncode is not None and \
+                hasattr(builtins, '__xonsh_history__'):
+            builtins.__xonsh_history__.last_cmd_rtn = self.returncode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 @fallback(ON_LINUX, Popen)
 class TeePTYProc(object):
 
@@ -381,11 +709,11 @@ class TeePTYProc(object):
         elif not os.access(args[0], os.X_OK) or os.path.isdir(args[0]):
             raise PermissionError('permission denied: {0!r}'.format(args[0]))
         self._tpty = tpty = TeePTY(encoding=xenv.get('XONSH_ENCODING'),
-                                   errors=xenv.get('XONSH_ENCODING_ERRORS'))
+                                   errors=xenv.get('XONSH_ENCODING_ERRORS'),
+                                   max_size=xenv.get('TEEPTY_MAX_SIZE'))
         if preexec_fn is not None:
             preexec_fn()
-        delay = xenv.get('TEEPTY_PIPE_DELAY')
-        tpty.spawn(args, env=env, stdin=stdin, delay=delay)
+        tpty.spawn(args, env=env, stdin=stdin)
 
     @property
     def pid(self):
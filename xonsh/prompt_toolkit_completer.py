@@ -17,20 +17,30 @@ class PromptToolkitCompleter(Completer):
     def get_completions(self, document, complete_event):
         """Returns a generator for list of completions."""
 
-        #  Only generate completions when the user hits tab.
+        #  Only generate completions when the user hits tab, or when the
+        #  completions that tab gave can be narrowed down as the word is typed.
+        if not (complete_event.completion_requested or
+                complete_event.text_inserted):
+            return
+        line = document.current_line
+        endidx = document.cursor_position_col
+        space_pos = document.find_backwards(' ')
+        if space_pos is None:
+            begidx = 0
+        else:
+            begidx = space_pos + endidx + 1
+        prefix = line[begidx:endidx]
         if complete_event.completion_requested:
-            line = document.current_line
-            endidx = document.cursor_position_col
-            space_pos = document.find_backwards(' ')
-            if space_pos is None:
-                begidx = 0
-            else:
-                begidx = space_pos + endidx + 1
-            prefix = line[begidx:endidx]
-            completions, l = self.completer.complete(prefix,
-                                                     line,
-                                                     begidx,
-                                                     endidx,
-                                                     self.ctx)
+            # each source is delivered as soon as it is done, within its
+            # budget, so a slow one does not hold up the others
+            batches = self.completer.complete_iter(prefix, line, begidx,
+                                                   endidx, self.ctx)
+        else:
+            rtn = self.completer.narrow(prefix, line, begidx, endidx,
+                                        self.ctx)
+            if rtn is None:
+                return
+            batches = [rtn]
+        for completions, l in batches:
             for comp in completions:
                 yield Completion(comp, -l)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""Lexer implementation to use with prompt_toolkit."""
+from prompt_toolkit.layout.lexers import Lexer
+
+from xonsh.pyghooks import IncrementalXonshLexer
+
+
+class PromptToolkitLexer(Lexer):
+    """Highlights the buffer with xonsh's own lexer.
+
+    Only the lines from the one that was edited are lexed again, and
+    statements are shown in Python or subprocess mode as xonsh would run
+    them in the shell's context.
+    """
+
+    def __init__(self, ctx):
+        """Takes the dict with the context of the shell."""
+        self.lexer = IncrementalXonshLexer(ctx)
+
+    def get_tokens(self, cli, text):
+        """Returns the list of (token, string) pairs for the text."""
+        return self.lexer.get_tokens(text)
@@ -6,7 +6,6 @@ from warnings import warn
 from prompt_toolkit.shortcuts import prompt
 from prompt_toolkit.key_binding.manager import KeyBindingManager
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.layout.lexers import PygmentsLexer
 from prompt_toolkit.filters import Condition
 from pygments.style import Style
 from pygments.styles.default import DefaultStyle
@@ -14,11 +13,13 @@ from pygments.token import (Keyword, Name, Comment, String, Error, Number,
                             Operator, Generic, Whitespace, Token)
 
 from xonsh.base_shell import BaseShell
-from xonsh.tools import format_prompt_for_prompt_toolkit, _make_style
+from xonsh.environ import format_prompt, PROMPT_FIELDS
+from xonsh.tools import prompt_color_parts, _make_style, TERM_COLORS, \
+    print_exception
 from xonsh.prompt_toolkit_completer import PromptToolkitCompleter
 from xonsh.prompt_toolkit_history import PromptToolkitHistory
 from xonsh.prompt_toolkit_key_bindings import load_xonsh_bindings
-from xonsh.pyghooks import XonshLexer
+from xonsh.prompt_toolkit_lexer import PromptToolkitLexer
 
 
 
@@ -36,6 +37,11 @@ class PromptToolkitShell(BaseShell):
             enable_vi_mode=Condition(lambda cli: builtins.__xonsh_env__.get('VI_MODE')),
             enable_open_in_editor=True)
         load_xonsh_bindings(self.key_bindings_manager)
+        self.lexer = PromptToolkitLexer(self.ctx)
+        # the prompt is redrawn when its slow fields change in the background
+        self._cli = None
+        self._prompt_changed = False
+        PROMPT_FIELDS.on_change = self._on_prompt_change
 
     def cmdloop(self, intro=None):
         """Enters a loop that reads and execute input from user."""
@@ -59,7 +65,7 @@ class PromptToolkitShell(BaseShell):
                     get_prompt_tokens=token_func,
                     style=style_cls,
                     completer=completer,
-                    lexer=PygmentsLexer(XonshLexer),
+                    lexer=self.lexer,
                     history=self.history,
                     enable_history_search=True,
                     key_bindings_registry=self.key_bindings_manager.registry,
@@ -77,17 +83,66 @@ class PromptToolkitShell(BaseShell):
                 else:
                     break
 
+    def _on_prompt_change(self):
+        """Asks prompt_toolkit to redraw, with the new field values. Called
+        from the thread that evaluated them.
+        """
+        self._prompt_changed = True
+        cli = self._cli
+        if cli is not None:
+            cli.invalidate()
+
     def _get_prompt_tokens_and_style(self):
         """Returns function to pass as prompt to prompt_toolkit."""
-        token_names, cstyles, strings = format_prompt_for_prompt_toolkit(self.prompt)
-        tokens = [getattr(Token, n) for n in token_names]
+        self._prompt_changed = False
+        multiline = self.need_more_lines
+        tokens = [self._prompt_tokens(self.prompt)]
 
         def get_tokens(cli):
-            return list(zip(tokens, strings))
+            self._cli = cli
+            if self._prompt_changed and not multiline:
+                self._prompt_changed = False
+                try:
+                    p = format_prompt(builtins.__xonsh_env__.get('PROMPT'))
+                    tokens[0] = self._prompt_tokens(p)
+                except Exception:  # pylint: disable=broad-except
+                    print_exception()
+            return tokens[0]
+
+        return get_tokens, _prompt_style()
+
+    def _prompt_tokens(self, prompt):
+        token_names, strings = prompt_color_parts(prompt)
+        return list(zip([getattr(Token, n) for n in token_names], strings))
+
+
+# (colors, user styles) -> style class
+_PROMPT_STYLES = {}
 
-        custom_style = _xonsh_style(tokens, cstyles)
 
-        return get_tokens, custom_style
+def _prompt_style():
+    """Returns the style class for prompts, which styles every color, as the
+    prompt may change color when redrawn. It is only made anew when
+    $PROMPT_TOOLKIT_COLORS or $PROMPT_TOOLKIT_STYLES change.
+    """
+    env = builtins.__xonsh_env__
+    colors = env.get('PROMPT_TOOLKIT_COLORS')
+    userstyle = env.get('PROMPT_TOOLKIT_STYLES')
+    try:
+        key = (frozenset(colors.items()),
+               None if userstyle is None else frozenset(userstyle.items()))
+        style = _PROMPT_STYLES.get(key)
+    except TypeError:
+        key = style = None
+    if style is None:
+        names = ['NO_COLOR'] + sorted(TERM_COLORS)
+        style = _xonsh_style([getattr(Token, n) for n in names],
+                             [_make_style(n) for n in names])
+        if key is not None:
+            if len(_PROMPT_STYLES) >= 8:
+                _PROMPT_STYLES.clear()
+            _PROMPT_STYLES[key] = style
+    return style
 
 
 def _xonsh_style(tokens=tuple(), cstyles=tuple()):
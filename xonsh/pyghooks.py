@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 """Hooks for pygments syntax highlighting."""
+import re
+import builtins
+import tokenize
+from keyword import kwlist
+
 from pygments.lexer import inherit, bygroups, using, this
-from pygments.token import Name, Generic, Keyword, Text, String
+from pygments.token import (Name, Generic, Keyword, Text, String, Comment,
+                            Number, Operator, Punctuation, Error)
 from pygments.lexers.shell import BashLexer
 from pygments.lexers.agile import PythonLexer
 
+from xonsh.lexer import get_tokens
+
 
 class XonshSubprocLexer(BashLexer):
     """Lexer for xonsh subproc mode."""
@@ -66,3 +74,410 @@ XonshSubprocLexer.tokens['root'] = [
     (r'(\$\{)(.*)(\})', bygroups(Keyword, using(XonshLexer), Keyword)),
     (r'(@\()(.+)(\))', bygroups(Keyword, using(XonshLexer), Keyword)),
 ] + XonshSubprocLexer.tokens['root']
+
+
+#
+# Incremental highlighting with xonsh's own lexer
+#
+
+_KEYWORDS = frozenset(k.upper() for k in kwlist + ['async', 'await'])
+_OPERATOR_WORDS = frozenset(['AND', 'OR', 'NOT', 'IN', 'IS'])
+_CONSTANTS = frozenset(['TRUE', 'FALSE', 'NONE'])
+_PUNCTUATION = frozenset(['COMMA', 'PERIOD', 'SEMI', 'COLON', 'LPAREN',
+                          'RPAREN', 'LBRACKET', 'RBRACKET', 'LBRACE',
+                          'RBRACE'])
+_SPECIALS = frozenset(['DOLLAR_LPAREN', 'DOLLAR_LBRACKET', 'DOLLAR_LBRACE',
+                       'AT_LPAREN', 'BANG_LPAREN', 'QUESTION',
+                       'DOUBLE_QUESTION', 'SPECIAL_END'])
+_SUBPROC_OPERATORS = frozenset(['PIPE', 'IOREDIRECT', 'AMPERSAND', 'GT', 'LT',
+                                'RSHIFT', 'SEMI'])
+_ASSIGNMENTS = frozenset(['EQUALS', 'PLUSEQUAL', 'MINUSEQUAL', 'TIMESEQUAL',
+                          'ATEQUAL', 'DIVEQUAL', 'MODEQUAL', 'POWEQUAL',
+                          'LSHIFTEQUAL', 'RSHIFTEQUAL', 'AMPERSANDEQUAL',
+                          'XOREQUAL', 'PIPEEQUAL', 'DOUBLEDIVEQUAL'])
+# openers and whether they start subprocess mode, as in xonsh.lexer
+_OPENERS = {'LPAREN': False, 'LBRACKET': False, 'LBRACE': False,
+            'DOLLAR_LBRACE': False, 'AT_LPAREN': False,
+            'DOLLAR_LPAREN': True, 'DOLLAR_LBRACKET': True,
+            'BANG_LPAREN': True}
+_PLAIN_OPENERS = frozenset(['LPAREN', 'LBRACKET', 'LBRACE'])
+_CLOSERS = frozenset(['RPAREN', 'RBRACKET', 'RBRACE'])
+_QUOTES = re.compile(r'[rRbBuUfF]{0,2}(\'|")')
+
+
+def _token_type(kind, value, subproc, command):
+    """Returns the pygments token type of a xonsh token in Python or
+    subprocess mode.
+    """
+    if kind == 'ERRORTOKEN':
+        return Error
+    elif kind == 'STRING':
+        return String
+    elif kind == 'DOLLAR_NAME':
+        return Name.Variable
+    elif kind == 'REGEXPATH':
+        return String.Backtick
+    elif kind in _SPECIALS:
+        return Keyword
+    elif subproc:
+        if kind == 'NAME' and command:
+            return Name.Builtin
+        return Operator if kind in _SUBPROC_OPERATORS else Text
+    elif kind == 'NAME':
+        return Name.Builtin if hasattr(builtins, value) else Name
+    elif kind == 'NUMBER':
+        return Number
+    elif kind in _CONSTANTS:
+        return Keyword.Constant
+    elif kind in _OPERATOR_WORDS:
+        return Operator.Word
+    elif kind in _KEYWORDS:
+        return Keyword
+    elif kind in _PUNCTUATION:
+        return Punctuation
+    return Operator
+
+
+def _gap_tokens(s):
+    """Tokens for the text between two xonsh tokens, which the xonsh lexer
+    drops: whitespace and comments.
+    """
+    stripped = s.lstrip()
+    ws = s[:len(s) - len(stripped)]
+    if len(stripped) == 0:
+        return [(Text, s)]
+    toks = [(Text, ws)] if ws else []
+    if stripped.startswith('#'):
+        toks.append((Comment.Single, stripped))
+    else:
+        toks.append((Text, stripped))
+    return toks
+
+
+def _span_end(line, col, kind, value):
+    if kind not in ('ERRORTOKEN', 'REGEXPATH') or \
+            line.startswith(value, col):
+        return col + len(value)
+    elif kind == 'REGEXPATH':
+        # the lexer drops the whitespace inside backticks
+        end = line.find('`', col + 1)
+        return len(line) if end < 0 else end + 1
+    # the values of other errors are messages
+    return col + 1
+
+
+class _Statement(object):
+    """What the highlighter needs to know of a statement to tell if xonsh
+    would run it in subprocess mode: its leftmost name, if it starts with
+    one, whether it assigns, and the names it binds.
+    """
+
+    __slots__ = ('first', 'lead', 'assigns', 'binds', 'names', 'binding')
+
+    def __init__(self, kind, value):
+        self.first = kind
+        self.lead = value if kind == 'NAME' else None
+        self.assigns = False
+        self.binds = set()
+        self.names = []
+        self.binding = None
+
+    def add(self, kind, value):
+        """Adds a token at the top level of the statement."""
+        if kind == 'NAME':
+            if self.binding is not None:
+                self.binds.add(value)
+                if self.binding != 'FOR':
+                    self.binding = None
+            elif not self.assigns:
+                self.names.append(value)
+        elif kind in _ASSIGNMENTS:
+            if not self.assigns:
+                self.assigns = True
+                self.binds.update(self.names)
+        elif kind in ('DEF', 'CLASS', 'AS', 'IMPORT', 'FOR'):
+            self.binding = kind
+        elif kind == 'COMMA' and self.binding is None and \
+                self.first in ('IMPORT', 'FROM'):
+            self.binding = 'IMPORT'
+        elif kind == 'IN' and self.binding == 'FOR':
+            self.binding = None
+
+    def is_subproc(self, known, ctx):
+        """Whether xonsh would run the statement in subprocess mode, as
+        its leftmost name is not known.
+        """
+        lead = self.lead
+        return (lead is not None and not self.assigns and lead not in known
+                and lead not in ctx and not hasattr(builtins, lead))
+
+
+class _Line(object):
+    """A lexed line: its text, the indentation the tokenizer can be restarted
+    with at its start, or None if it cannot be, the spans of its tokens, and
+    the statement it is part of.
+    """
+
+    __slots__ = ('text', 'state', 'spans', 'stmt', 'rendered')
+
+    def __init__(self, text, state, stmt):
+        self.text = text
+        self.state = state
+        self.spans = []
+        self.stmt = stmt
+        self.rendered = {}
+
+    def tokens(self, subproc):
+        """The pygments tokens of the line, with the top level of its
+        statement in subprocess mode or not.
+        """
+        toks = self.rendered.get(subproc)
+        if toks is not None:
+            return toks
+        toks = []
+        text = self.text
+        pos = 0
+        for start, end, kind, mode, command in self.spans:
+            start = max(start, pos)
+            if start >= end:
+                continue
+            if start > pos:
+                toks.extend(_gap_tokens(text[pos:start]))
+            sub = subproc if mode is None else mode
+            value = text[start:end]
+            toks.append((_token_type(kind, value, sub, command), value))
+            pos = end
+        if pos < len(text):
+            toks.extend(_gap_tokens(text[pos:]))
+        self.rendered[subproc] = toks
+        return toks
+
+
+class _Resync(Exception):
+    pass
+
+
+class _TokenizeWatcher(object):
+    """Watches the tokens of ``tokenize`` go by, to tell which lines it
+    starts outside of brackets, strings and continued lines, where it can be
+    restarted, and with what indentation.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.indents = []
+        self.level = 0
+        self.row = 0
+        self.ended = True
+
+    def __call__(self, token):
+        row = token.start[0]
+        if row > self.row:
+            self.row = row
+            if self.ended and self.level == 0:
+                self.starts[row] = tuple(self.indents)
+        typ = token.type
+        if typ == tokenize.OP:
+            if token.string in ('(', '[', '{'):
+                self.level += 1
+            elif token.string in (')', ']', '}'):
+                self.level -= 1
+        elif typ == tokenize.INDENT:
+            self.indents.append(token.string)
+        elif typ == tokenize.DEDENT:
+            self.indents.pop()
+        self.ended = typ in (tokenize.NEWLINE, tokenize.NL,
+                             tokenize.ENCODING)
+
+
+class IncrementalXonshLexer(object):
+    """Highlights xonsh code with the tokens of ``xonsh.lexer``, for use while
+    the code is being edited. The tokens of each line are kept, with the
+    indentation at the start of every line the tokenizer can be restarted on,
+    so that after an edit only the lines from the last such line before it
+    are lexed again, and only until the lexer is back in step with the
+    lines after the edit.
+
+    The top level of a statement is shown in subprocess mode when xonsh
+    would run it so, which is when its leftmost name is not in the context,
+    a builtin, or bound earlier in the code. Code in ``$()``, ``$[]`` and
+    ``!()`` always is.
+    """
+
+    def __init__(self, ctx=None):
+        """
+        Parameters
+        ----------
+        ctx : dict, optional
+            The names known to the shell.
+        """
+        self.ctx = {} if ctx is None else ctx
+        self.lexed = 0
+        self._lines = []
+        self._text = None
+        self._tokens = []
+
+    def get_tokens(self, text):
+        """Returns a list of (token type, string) pairs covering text."""
+        if text == self._text:
+            return self._tokens
+        lines = text.split('\n')
+        old = self._lines
+        n = min(len(old), len(lines))
+        i = 0
+        while i < n and old[i].text == lines[i]:
+            i += 1
+        s = 0
+        while s < n - i and old[-1 - s].text == lines[-1 - s]:
+            s += 1
+        k = min(i, len(old) - 1, len(lines) - 1)
+        while k > 0 and old[k].state is None:
+            k -= 1
+        state = old[k].state if k >= 0 else ()
+        k = max(k, 0)
+        self._lines = old[:k] + self._lex(lines, k, state, old,
+                                          len(lines) - s)
+        self._text = text
+        self._tokens = self._render()
+        return self._tokens
+
+    def _render(self):
+        tokens = []
+        known = set()
+        stmt = None
+        subproc = False
+        for i, line in enumerate(self._lines):
+            if line.stmt is not stmt:
+                stmt = line.stmt
+                subproc = stmt is not None and \
+                          stmt.is_subproc(known, self.ctx)
+                if stmt is not None:
+                    known.update(stmt.binds)
+            if i > 0:
+                tokens.append((Text, '\n'))
+            tokens.extend(line.tokens(subproc))
+        return tokens
+
+    def _lex(self, lines, k, state, old, stop):
+        """Lexes lines from the k-th, which the tokenizer is restarted on with
+        the given indentation, until the end or until it reaches a line at or
+        after stop where the lexer is as it was at the matching line of the
+        old lines. Returns the lines lexed, followed by the old ones from
+        there.
+        """
+        delta = len(lines) - len(old)
+        # the tokenizer gets its indentation back from a line per level
+        prefix = [indent + 'pass\n' for indent in state]
+        shift = k - len(prefix) - 1
+        src = ''.join(prefix) + '\n'.join(lines[k:])
+        watcher = _TokenizeWatcher()
+        new = [_Line(lines[k], state, None)]
+        # open brackets, as [subprocess mode, expecting a command, kind]
+        stack = []
+        stmt = None
+        fresh = True
+        command = False
+        eof_string = False
+
+        def line_at(m):
+            while k + len(new) <= m:
+                j = k + len(new)
+                at = watcher.starts.get(j - shift)
+                if at is not None and fresh and len(stack) == 0:
+                    if j >= stop and j - delta < len(old) and \
+                            old[j - delta].state == at:
+                        raise _Resync(j)
+                else:
+                    at = None
+                new.append(_Line(lines[j], at, stmt))
+            return new[m - k]
+
+        try:
+            for tok in get_tokens(src, watcher):
+                m = tok.lineno + shift
+                if m < k:
+                    if tok.lineno == 0 and str(tok.value).startswith(
+                            'EOF in multi-line string'):
+                        eof_string = True
+                    continue
+                elif m >= len(lines):
+                    continue
+                line = line_at(m)
+                kind = tok.type
+                if kind == 'NEWLINE':
+                    fresh = True
+                    stmt = None
+                    continue
+                elif kind in ('INDENT', 'DEDENT', 'WS'):
+                    continue
+                if fresh:
+                    fresh = False
+                    stmt = line.stmt = _Statement(kind, tok.value)
+                    command = True
+                if kind in _CLOSERS or (kind == 'ERRORTOKEN' and
+                                        line.text[tok.lexpos:tok.lexpos + 1]
+                                        in (')', ']', '}')):
+                    # the lexer takes its mode back, even on a mismatch
+                    if len(stack) > 0:
+                        opener = stack.pop()[2]
+                        if opener not in _PLAIN_OPENERS and \
+                                kind != 'ERRORTOKEN':
+                            kind = 'SPECIAL_END'
+                if len(stack) == 0:
+                    mode = None
+                    cmd = command and kind == 'NAME'
+                    stmt.add(kind, tok.value)
+                    command = kind in ('PIPE', 'SEMI')
+                else:
+                    top = stack[-1]
+                    mode = top[0]
+                    cmd = mode and top[1] and kind == 'NAME'
+                    top[1] = kind in ('PIPE', 'SEMI')
+                if kind in _OPENERS:
+                    stack.append([_OPENERS[kind], True, kind])
+                col = tok.lexpos
+                value = tok.value
+                if kind == 'STRING' and '\n' in value:
+                    parts = value.split('\n')
+                    for d, part in enumerate(parts):
+                        if m + d >= len(lines):
+                            break
+                        start = col if d == 0 else 0
+                        end = start + len(part)
+                        line_at(m + d).spans.append(
+                            (start, end, kind, mode, False))
+                    continue
+                end = _span_end(line.text, col, kind, value)
+                line.spans.append((col, end, kind, mode, cmd))
+        except _Resync as e:
+            j = e.args[0]
+            self.lexed = j - k
+            return new + old[j - delta:]
+        # lines no token reached cannot be restarted on, as they may be in
+        # an unterminated string
+        while k + len(new) < len(lines):
+            new.append(_Line(lines[k + len(new)], None, stmt))
+        self.lexed = len(new)
+        if eof_string:
+            _unterminated_string(new)
+        return new
+
+
+def _unterminated_string(lines):
+    """Shows the text from an unterminated triple quoted string at the end
+    of the code as a string, as the lexer gives no tokens for it.
+    """
+    m = len(lines) - 1
+    while m >= 0 and len(lines[m].spans) == 0:
+        m -= 1
+    for j in range(max(m, 0), len(lines)):
+        line = lines[j]
+        pos = line.spans[-1][1] if j == m else 0
+        rest = line.text[pos:]
+        stripped = rest.lstrip()
+        if _QUOTES.match(stripped) is not None:
+            line.spans.append((pos + len(rest) - len(stripped),
+                               len(line.text), 'STRING', None, False))
+            for after in lines[j + 1:]:
+                after.spans = [(0, len(after.text), 'STRING', None, False)]
+            return
@@ -67,7 +67,7 @@ class Replayer(object):
             if e == 'replay':
                 new_env.update(re_env)
             elif e == 'native':
-                new_env.update(builtins.__xonsh_env__)
+                new_env.update(builtins.__xonsh_env__.lazy_items())
             elif isinstance(e, Mapping):
                 new_env.update(e)
             else:
@@ -12,13 +12,12 @@ import os
 import sys
 import tty
 import pty
-import time
 import array
+import errno
 import fcntl
 import select
 import signal
 import termios
-import tempfile
 import threading
 
 # The following escape codes are xterm codes.
@@ -31,18 +30,108 @@ ALTERNATE_MODE_FLAGS = tuple(START_ALTERNATE_MODE) + tuple(END_ALTERNATE_MODE)
 RE_HIDDEN = re.compile(b'(\001.*?\002)')
 RE_COLOR = re.compile(b'\033\[\d+;?\d*m')
 
-def _findfirst(s, substrs):
-    """Finds whichever of the given substrings occurs first in the given string
-    and returns that substring, or returns None if no such strings occur.
+RE_ALT_MODE = re.compile(b'\033\\[\\?(?:' + '|'.join(MODE_NUMS).encode() +
+                         b')[hl]')
+# an escape sequence at the very end of a chunk that may not be complete yet
+RE_PARTIAL_ESCAPE = re.compile(b'\033(\\[[\\d;?]*)?\\Z')
+
+# the largest hidden (\001...\002) sequence that is held back while its end
+# has not been read yet.
+MAX_HIDDEN_CARRY = 4096
+MAX_READ_SIZE = 65536
+
+
+def _utf8_head(b):
+    """Returns the length of the given bytes without a trailing, incomplete
+    UTF-8 sequence.
+    """
+    n = len(b)
+    for i in range(n - 1, max(n - 4, 0) - 1, -1):
+        c = b[i]
+        if c < 0x80:
+            return n
+        elif c >= 0xC0:
+            # lead byte, check that its sequence is complete
+            need = 2 if c < 0xE0 else 3 if c < 0xF0 else 4
+            return n if n - i >= need else i
+    return n
+
+
+def _utf8_tail(b):
+    """Returns the index of the first byte in the given bytes that does not
+    continue a UTF-8 sequence that started before it.
+    """
+    i = 0
+    while i < min(len(b), 3) and 0x80 <= b[i] < 0xC0:
+        i += 1
+    return i
+
+
+class TeeBuffer(object):
+    """A bytes buffer for tee'd output that may be bounded in size. When the
+    total output exceeds the maximum size, only the first and last halves are
+    kept and the middle is replaced by a marker stating how many bytes were
+    omitted. Writing is amortized O(len(data)) regardless of how much has been
+    written so far.
     """
-    i = len(s)
-    result = None
-    for substr in substrs:
-        pos = s.find(substr)
-        if -1 < pos < i:
-            i = pos
-            result = substr
-    return i, result
+
+    def __init__(self, maxsize=None):
+        """
+        Parameters
+        ----------
+        maxsize : int or None, optional
+            The maximum number of bytes to keep, None or a non-positive value
+            means unbounded.
+        """
+        self.maxsize = maxsize if maxsize is not None and maxsize > 0 else None
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def __len__(self):
+        return len(self.head) + len(self.tail)
+
+    def write(self, data):
+        """Appends bytes to the buffer, returns the number of bytes written."""
+        n = len(data)
+        maxsize = self.maxsize
+        if maxsize is None:
+            self.head += data
+            return n
+        head = self.head
+        room = maxsize // 2 - len(head)
+        if room > 0:
+            head += data[:room]
+            if n <= room:
+                return n
+            data = data[room:]
+        tail = self.tail
+        tail += data
+        excess = len(tail) - (maxsize - maxsize // 2)
+        if excess > 0:
+            # deleting from the front of a bytearray does not copy the rest
+            del tail[:excess]
+            self.omitted += excess
+        return n
+
+    def getvalue(self):
+        """Returns the buffered bytes, with an omission marker if the output
+        was truncated.
+        """
+        if self.omitted == 0:
+            return bytes(self.head + self.tail)
+        head, tail = self.head, self.tail
+        h = _utf8_head(head)
+        t = _utf8_tail(tail)
+        omitted = self.omitted + (len(head) - h) + t
+        marker = '\n[... {0} bytes omitted ...]\n'.format(omitted).encode()
+        return bytes(head[:h]) + marker + bytes(tail[t:])
+
+    def clear(self):
+        """Removes all data from the buffer."""
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
 
 
 def _on_main_thread():
@@ -65,43 +154,99 @@ def _find_error_code(e):
     return code
 
 
+class _Poller(object):
+    """A minimal level-triggered poller over file descriptors that uses epoll
+    where it is available and select otherwise.
+    """
+
+    def __init__(self):
+        self._epoll = select.epoll() if hasattr(select, 'epoll') else None
+        self._rlist = []
+        self._wlist = []
+        self._ready = []  # regular files, which epoll refuses, are always ready
+
+    def register(self, fd, write=False):
+        """Waits on fd for reading, or writing if write is True."""
+        if self._epoll is not None:
+            try:
+                self._epoll.register(fd, select.EPOLLOUT if write
+                                         else select.EPOLLIN)
+            except PermissionError:
+                self._ready.append(fd)
+        else:
+            (self._wlist if write else self._rlist).append(fd)
+
+    def unregister(self, fd):
+        """Stops waiting on fd."""
+        if fd in self._ready:
+            self._ready.remove(fd)
+        elif self._epoll is not None:
+            self._epoll.unregister(fd)
+        elif fd in self._rlist:
+            self._rlist.remove(fd)
+        else:
+            self._wlist.remove(fd)
+
+    def poll(self):
+        """Blocks until any of the file descriptors is ready, returns the
+        ready ones.
+        """
+        ready = self._ready
+        if self._epoll is not None:
+            events = self._epoll.poll(0 if ready else -1)
+            return ready + [fd for fd, _ in events]
+        rfds, wfds, _ = select.select(self._rlist, self._wlist, [])
+        return rfds + wfds
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+
+
 class TeePTY(object):
     """This class is a pseudo terminal that tees the stdout and stderr into a buffer."""
 
     def __init__(self, bufsize=1024, remove_color=True, encoding='utf-8',
-                 errors='strict'):
+                 errors='strict', max_size=None):
         """
         Parameters
         ----------
         bufsize : int, optional
-            The buffer size to read from the root terminal to/from the tee'd terminal.
+            The initial buffer size to read from the root terminal to/from the
+            tee'd terminal. This grows up to MAX_READ_SIZE while the child is
+            writing a lot of output and shrinks back when it is not.
         remove_color : bool, optional
             Removes color codes from the tee'd buffer, though not the TTY.
         encoding : str, optional
             The encoding to use when decoding into a str.
         errors : str, optional
             The encoding error flag to use when decoding into a str.
+        max_size : int or None, optional
+            The maximum number of bytes kept in the tee'd buffer. Larger output
+            keeps only its head and tail, see TeeBuffer. None means unbounded.
         """
         self.bufsize = bufsize
         self.pid = self.master_fd = None
         self._in_alt_mode = False
+        self._carry = b''
         self.remove_color = remove_color
         self.encoding = encoding
         self.errors = errors
-        self.buffer = io.BytesIO()
+        self.teebuf = TeeBuffer(max_size)
         self.wcode = None  # os.wait encoded retval 
-        self._temp_stdin = None
+        self._stdin_fd = None  # write end of the child's stdin pipe
+        self._stdin_src = None  # in-memory data to feed into that pipe
 
     def __str__(self):
-        return self.buffer.getvalue().decode(encoding=self.encoding,
+        return self.teebuf.getvalue().decode(encoding=self.encoding,
                                              errors=self.errors)
 
-    def __del__(self):
-        if self._temp_stdin is not None:
-            self._temp_stdin.close()
-            self._temp_stdin = None
+    @property
+    def buffer(self):
+        """A bytes file object of the tee'd output, positioned at the start."""
+        return io.BytesIO(self.teebuf.getvalue())
 
-    def spawn(self, argv=None, env=None, stdin=None, delay=None):
+    def spawn(self, argv=None, env=None, stdin=None):
         """Create a spawned process. Based on the code for pty.spawn().
         This cannot be used except from the main thread.
 
@@ -111,12 +256,11 @@ class TeePTY(object):
             Arguments to pass in as subprocess. In None, will execute $SHELL.
         env : Mapping, optional
             Environment to pass execute in.
-        delay : float, optional
-            Delay timing before executing process if piping in data. The value
-            is passed into time.sleep() so it is in [seconds]. If delay is None,
-            its value will attempted to be looked up from the environment
-            variable $TEEPTY_PIPE_DELAY, from the passed in env or os.environ.
-            If not present or not positive valued, no delay is used.
+        stdin : file-like, str, bytes, or int, optional
+            Data for the spawned process's stdin, which is otherwise the
+            terminal. Anything with a file descriptor (pipes, files) becomes the
+            child's stdin directly. Other data is streamed into a pipe by the
+            copy loop as the child reads it.
 
         Returns
         -------
@@ -125,27 +269,26 @@ class TeePTY(object):
         """
         assert self.master_fd is None
         self._in_alt_mode = False
+        self._carry = b''
         if not argv:
             argv = [os.environ.get('SHELL', 'sh')]
-        argv = self._put_stdin_in_argv(argv, stdin)
+        child_stdin = self._open_stdin(stdin)
 
         pid, master_fd = pty.fork()
         self.pid = pid
         self.master_fd = master_fd
         if pid == pty.CHILD:
-            # determine if a piping delay is needed.
-            if self._temp_stdin is not None:
-                self._delay_for_pipe(env=env, delay=delay)
-            # ok, go
             try:
+                if child_stdin is not None:
+                    os.dup2(child_stdin, pty.STDIN_FILENO)
                 if env is None:
                     os.execvp(argv[0], argv)
                 else:
                     os.execvpe(argv[0], argv, env)
             except OSError as e:
                 os._exit(_find_error_code(e))
-        else:
-            self._pipe_stdin(stdin)
+        elif child_stdin is not None and self._stdin_fd is not None:
+            os.close(child_stdin)  # the read end of our pipe
 
         on_main_thread = _on_main_thread()
         if on_main_thread:
@@ -160,9 +303,13 @@ class TeePTY(object):
         try:
             self._copy()
         except (IOError, OSError):
+            pass
+        finally:
             if restore:
                 tty.tcsetattr(pty.STDIN_FILENO, tty.TCSAFLUSH, mode)
 
+        self._close_stdin()
+        self._flush_carry()
         _, self.wcode = os.waitpid(pid, 0)
         os.close(master_fd)
         self.master_fd = None
@@ -191,55 +338,133 @@ class TeePTY(object):
         fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, buf)
 
     def _copy(self):
-        """Main select loop. Passes all data to self.master_read() or self.stdin_read().
+        """Main copy loop. Passes all data to self.write_stdout() or
+        self.write_stdin(), and feeds in-memory stdin data to the child as
+        its pipe has room for it, so that no more than one chunk of it is
+        held at a time. This uses epoll, where available, so that the cost of
+        waiting does not depend on the file descriptor numbers. The read size
+        doubles while reads fill it and halves when they do not, so that bulk
+        output takes few system calls and interactive output stays responsive.
+        Returns when the child closes the terminal.
         """
         assert self.master_fd is not None
         master_fd = self.master_fd
-        bufsize = self.bufsize
-        while True:
-            try:
-                rfds, wfds, xfds = select.select([master_fd, pty.STDIN_FILENO], [], [])
-            except OSError as e:
-                if e.errno == 4:  # Interrupted system call.
-                    continue      # This happens at terminal resize.
-            if master_fd in rfds:
-                data = os.read(master_fd, bufsize)
-                self.write_stdout(data)
-            if pty.STDIN_FILENO in rfds:
-                data = os.read(pty.STDIN_FILENO, bufsize)
-                self.write_stdin(data)
+        stdin_fd = pty.STDIN_FILENO
+        feed_fd = self._stdin_fd
+        minsize = bufsize = self.bufsize
+        poller = _Poller()
+        poller.register(master_fd)
+        poller.register(stdin_fd)
+        if feed_fd is not None:
+            poller.register(feed_fd, write=True)
+        pending = b''
+        try:
+            while True:
+                try:
+                    rfds = poller.poll()
+                except InterruptedError:
+                    continue  # This happens at terminal resize.
+                if master_fd in rfds:
+                    try:
+                        data = os.read(master_fd, bufsize)
+                    except OSError as e:
+                        if e.errno == errno.EIO:
+                            return  # Linux signals the child's exit this way
+                        raise
+                    if len(data) == 0:
+                        return
+                    self.write_stdout(data)
+                    if len(data) == bufsize:
+                        bufsize = min(2 * bufsize, MAX_READ_SIZE)
+                    elif bufsize > minsize and len(data) < bufsize // 2:
+                        bufsize = max(bufsize // 2, minsize)
+                if stdin_fd in rfds:
+                    data = os.read(stdin_fd, self.bufsize)
+                    if len(data) == 0:
+                        poller.unregister(stdin_fd)
+                    else:
+                        self.write_stdin(data)
+                if feed_fd is not None and feed_fd in rfds:
+                    if len(pending) == 0:
+                        pending = memoryview(self._read_stdin_src())
+                    try:
+                        if len(pending) == 0:
+                            raise BrokenPipeError  # all of stdin was fed
+                        pending = pending[os.write(feed_fd, pending):]
+                    except BlockingIOError:
+                        pass
+                    except BrokenPipeError:
+                        # either we are done or the child stopped reading
+                        poller.unregister(feed_fd)
+                        self._close_stdin()
+                        feed_fd = None
+        finally:
+            poller.close()
 
     def _sanatize_data(self, data):
-        i, flag = _findfirst(data, ALTERNATE_MODE_FLAGS)
-        if flag is None and self._in_alt_mode:
-            return  b''
-        elif flag is not None:
-            if flag in START_ALTERNATE_MODE:
-                # This code is executed when the child process switches the terminal into
-                # alternate mode. The line below assumes that the user has opened vim,
-                # less, or similar, and writes writes to stdin.
-                d0 = data[:i]
-                self._in_alt_mode = True
-                d1 = self._sanatize_data(data[i+len(flag):])
-                data = d0 + d1
-            elif flag in END_ALTERNATE_MODE:
-                # This code is executed when the child process switches the terminal back
-                # out of alternate mode. The line below assumes that the user has
-                # returned to the command prompt.
-                self._in_alt_mode = False
-                data = self._sanatize_data(data[i+len(flag):])
-        data = RE_HIDDEN.sub(b'', data)
-        if self.remove_color:
+        """Removes alternate mode output, hidden sequences and (optionally)
+        colors from the data. This keeps state across calls: bytes that may be
+        the start of an escape or hidden sequence that is split across reads
+        are held back and prepended to the next call's data.
+        """
+        if self._carry:
+            data = self._carry + data
+            self._carry = b''
+        # hold back an incomplete sequence at the end of the data
+        i = data.rfind(b'\033', -16)
+        if i >= 0 and RE_PARTIAL_ESCAPE.match(data, i) is not None:
+            self._carry = data[i:]
+            data = data[:i]
+        i = data.rfind(b'\001')
+        if i >= 0 and data.find(b'\002', i) < 0 and \
+                len(data) - i <= MAX_HIDDEN_CARRY:
+            self._carry = data[i:] + self._carry
+            data = data[:i]
+        if self._in_alt_mode or b'\033[?' in data:
+            data = self._remove_alt_mode(data)
+        # The membership tests are much cheaper than a regex scan of output
+        # that has nothing to remove. Separate substitutions, which can each
+        # skip ahead to their literal first byte, are faster than a single
+        # pass of their alternation.
+        if b'\001' in data:
+            data = RE_HIDDEN.sub(b'', data)
+        if self.remove_color and b'\033' in data:
             data = RE_COLOR.sub(b'', data)
         return data
 
+    def _remove_alt_mode(self, data):
+        """Removes the output written while the terminal is in alternate mode.
+        Entering alternate mode assumes that the user has opened vim, less, or
+        similar, and leaving it that they have returned to the command prompt.
+        """
+        in_alt_mode = self._in_alt_mode
+        parts = []
+        pos = 0
+        for m in RE_ALT_MODE.finditer(data):
+            if not in_alt_mode:
+                parts.append(data[pos:m.start()])
+            pos = m.end()
+            in_alt_mode = m.group() in START_ALTERNATE_MODE
+        if not in_alt_mode:
+            parts.append(data[pos:])
+        self._in_alt_mode = in_alt_mode
+        return b''.join(parts)
+
+    def _flush_carry(self):
+        """Writes any held back bytes to the buffer once the output has ended."""
+        carry, self._carry = self._carry, b''
+        if carry and not self._in_alt_mode:
+            self.teebuf.write(carry)
+
     def write_stdout(self, data):
         """Writes to stdout as if the child process had written the data (bytes)."""
-        os.write(pty.STDOUT_FILENO, data)  # write to real terminal
+        view = memoryview(data)
+        while len(view) > 0:  # write to real terminal
+            view = view[os.write(pty.STDOUT_FILENO, view):]
         # tee to buffer
         data = self._sanatize_data(data)
         if len(data) > 0:
-            self.buffer.write(data)
+            self.teebuf.write(data)
 
     def write_stdin(self, data):
         """Writes to the child process from its controlling terminal."""
@@ -249,83 +474,52 @@ class TeePTY(object):
             n = os.write(master_fd, data)
             data = data[n:]
 
-    def _stdin_filename(self, stdin):
+    def _open_stdin(self, stdin):
+        """Returns the file descriptor that becomes the child's stdin, or None
+        to keep the terminal. Data without a file descriptor is kept to be fed
+        into a new pipe by the copy loop.
+        """
         if stdin is None:
-            rtn = None
-        elif isinstance(stdin, io.FileIO) and os.path.isfile(stdin.name):
-            rtn = stdin.name
-        elif isinstance(stdin, (io.BufferedIOBase, str, bytes)):
-            self._temp_stdin = tsi = tempfile.NamedTemporaryFile()
-            rtn = tsi.name
-        else:
-            raise ValueError('stdin not understood {0!r}'.format(stdin))
-        return rtn
-
-    def _put_stdin_in_argv(self, argv, stdin):
-        stdin_filename = self._stdin_filename(stdin)
-        if stdin_filename is None:
-            return argv
-        argv = list(argv)
-        # a lone dash '-' argument means stdin
-        if argv.count('-') == 0:
-            argv.append(stdin_filename)
-        else:
-            argv[argv.index('-')] = stdin_filename
-        return argv
-
-    def _pipe_stdin(self, stdin):
-        if stdin is None or isinstance(stdin, io.FileIO):
             return None
-        tsi = self._temp_stdin
-        bufsize = self.bufsize
-        if isinstance(stdin, io.BufferedIOBase):
-            buf = stdin.read(bufsize)
-            while len(buf) != 0:
-                tsi.write(buf)
-                tsi.flush()
-                buf = stdin.read(bufsize)
-        elif isinstance(stdin, (str, bytes)):
-            raw = stdin.encode() if isinstance(stdin, str) else stdin
-            for i in range((len(raw)//bufsize) + 1):
-                tsi.write(raw[i*bufsize:(i + 1)*bufsize])
-                tsi.flush()
-        else:
+        elif isinstance(stdin, int):
+            return stdin
+        elif isinstance(stdin, str):
+            stdin = io.BytesIO(stdin.encode(self.encoding, self.errors))
+        elif isinstance(stdin, (bytes, bytearray)):
+            stdin = io.BytesIO(stdin)
+        elif not hasattr(stdin, 'read'):
             raise ValueError('stdin not understood {0!r}'.format(stdin))
+        else:
+            try:
+                return stdin.fileno()
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+        r, w = os.pipe()
+        flags = fcntl.fcntl(w, fcntl.F_GETFL)
+        fcntl.fcntl(w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._stdin_fd = w
+        self._stdin_src = stdin
+        return r
+
+    def _read_stdin_src(self):
+        """Reads the next chunk of in-memory stdin data, as bytes."""
+        data = self._stdin_src.read(self.bufsize)
+        if isinstance(data, str):
+            data = data.encode(self.encoding, self.errors)
+        return data
 
-    def _delay_for_pipe(self, env=None, delay=None):
-        # This delay is sometimes needed because the temporary stdin file that
-        # is being written (the pipe) may not have even hits its first flush()
-        # call by the time the spawned process starts up and determines there
-        # is nothing in the file. The spawn can thus exit, without doing any
-        # real work.  Consider the case of piping something into grep:
-        #
-        #   $ ps aux | grep root
-        #
-        # grep will exit on EOF and so there is a race between the buffersize
-        # and flushing the temporary file and grep.  However, this race is not
-        # always meaningful. Pagers, for example, update when the file is written
-        # to. So what is important is that we start the spawned process ASAP:
-        #
-        #   $ ps aux | less
-        #
-        # So there is a push-and-pull between the the competing objectives of
-        # not blocking and letting the spawned process have enough to work with
-        # such that it doesn't exit prematurely.  Unfortunately, there is no
-        # way to know a priori how big the file is, how long the spawned process
-        # will run for, etc. Thus as user-definable delay let's the user
-        # find something that works for them.
-        if delay is None:
-            delay = (env or os.environ).get('TEEPTY_PIPE_DELAY', -1.0)
-        delay = float(delay)
-        if 0.0 < delay:
-            time.sleep(delay)
+    def _close_stdin(self):
+        """Closes the pipe to the child's stdin, if there is one."""
+        if self._stdin_fd is not None:
+            os.close(self._stdin_fd)
+            self._stdin_fd = self._stdin_src = None
 
 
 if __name__ == '__main__':
     tpty = TeePTY()
     tpty.spawn(sys.argv[1:])
     print('-=-'*10)
-    print(tpty.buffer.getvalue())
+    print(tpty.teebuf.getvalue())
     print('-=-'*10)
     print(tpty)
     print('-=-'*10)
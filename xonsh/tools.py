@@ -19,6 +19,7 @@ Implementations:
 """
 import ctypes
 import os
+import math
 import re
 import sys
 import builtins
@@ -26,6 +27,7 @@ import platform
 import traceback
 import threading
 import subprocess
+from functools import lru_cache
 from contextlib import contextmanager
 from collections import OrderedDict, Sequence
 from warnings import warn
@@ -49,6 +51,7 @@ IS_ROOT = ctypes.windll.shell32.IsUserAnAdmin() != 0 if ON_WINDOWS else os.getui
 VER_3_4 = (3, 4)
 VER_3_5 = (3, 5)
 VER_3_5_1 = (3, 5, 1)
+VER_3_11 = (3, 11)
 VER_FULL = sys.version_info[:3]
 VER_MAJOR_MINOR = sys.version_info[:2]
 V_MAJOR_MINOR = 'v{0}{1}'.format(*sys.version_info[:2])
@@ -346,9 +349,11 @@ def command_not_found(cmd):
     elif not os.path.isfile('/usr/lib/command-not-found'):
         # utility is not on PATH
         return ''
-    c = '/usr/lib/command-not-found {0}; exit 0'
-    s = subprocess.check_output(c.format(cmd), universal_newlines=True,
-                                stderr=subprocess.STDOUT, shell=True)
+    # run directly, rather than through a shell
+    proc = subprocess.Popen(['/usr/lib/command-not-found', cmd],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    s = proc.communicate()[0]
     s = '\n'.join(s.splitlines()[:-1]).strip()
     return s
 
@@ -365,17 +370,16 @@ def suggest_commands(cmd, env, aliases):
 
     cmd = cmd.lower()
     suggested = {}
-    for a in builtins.aliases:
+    for a in aliases:
         if a not in suggested:
             if levenshtein(a.lower(), cmd, thresh) < thresh:
                 suggested[a] = 'Alias'
 
-    for d in filter(os.path.isdir, env.get('PATH')):
-        for f in os.listdir(d):
-            if f not in suggested:
-                if levenshtein(f.lower(), cmd, thresh) < thresh:
-                    fname = os.path.join(d, f)
-                    suggested[f] = 'Command ({0})'.format(fname)
+    # only the commands near cmd are looked at, through an index
+    cache = builtins.__xonsh_commands_cache__
+    for _, f in cache.fuzzy(cmd, thresh):
+        if f not in suggested:
+            suggested[f] = 'Command ({0})'.format(cache.lookup(f, hit=False))
     suggested = OrderedDict(
         sorted(suggested.items(),
                key=lambda x: suggestion_sort_helper(x[0].lower(), cmd)))
@@ -412,7 +416,10 @@ def print_exception():
 # Modified from Public Domain code, by Magnus Lie Hetland
 # from http://hetland.org/coding/python/levenshtein.py
 def levenshtein(a, b, max_dist=float('inf')):
-    """Calculates the Levenshtein distance between a and b."""
+    """Calculates the Levenshtein distance between a and b. Distances greater
+    than max_dist are not worked out exactly; infinity is returned as soon as
+    the distance is known to exceed it.
+    """
     n, m = len(a), len(b)
     if abs(n - m) > max_dist:
         return float('inf')
@@ -420,16 +427,89 @@ def levenshtein(a, b, max_dist=float('inf')):
         # Make sure n <= m, to use O(min(n,m)) space
         a, b = b, a
         n, m = m, n
-    current = range(n + 1)
+    previous = list(range(n + 1))
+    current = [0] * (n + 1)
     for i in range(1, m + 1):
-        previous, current = current, [i] + [0] * n
+        bi = b[i - 1]
+        current[0] = lowest = i
         for j in range(1, n + 1):
-            add, delete = previous[j] + 1, current[j - 1] + 1
-            change = previous[j - 1]
-            if a[j - 1] != b[i - 1]:
-                change = change + 1
-            current[j] = min(add, delete, change)
-    return current[n]
+            d = previous[j - 1] if a[j - 1] == bi else previous[j - 1] + 1
+            if previous[j] + 1 < d:
+                d = previous[j] + 1
+            if current[j - 1] + 1 < d:
+                d = current[j - 1] + 1
+            current[j] = d
+            if d < lowest:
+                lowest = d
+        if lowest > max_dist:
+            # no row can get any lower than this one
+            return float('inf')
+        previous, current = current, previous
+    return previous[n]
+
+
+def _char_mask(s):
+    """A bit mask of the characters in s, some of which may share a bit."""
+    mask = 0
+    for c in s:
+        mask |= 1 << (ord(c) & 63)
+    return mask
+
+
+class FuzzyIndex(object):
+    """An index of strings, for finding those within a small Levenshtein
+    distance of a string without working out its distance to all of them.
+
+    The strings are kept by length, along with a bit mask of the characters
+    in each. A single edit changes the length by at most one, and adds or
+    removes at most one character, so both rule out most strings at the cost
+    of a few integer operations.
+    """
+
+    def __init__(self, words=()):
+        self._bylen = {}  # length -> {word: character mask}
+        self._len = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Adds a word to the index, if it is not already there."""
+        words = self._bylen.setdefault(len(word), {})
+        if word not in words:
+            words[word] = _char_mask(word)
+            self._len += 1
+
+    def discard(self, word):
+        """Removes a word from the index, if it is there."""
+        words = self._bylen.get(len(word), {})
+        if words.pop(word, None) is not None:
+            self._len -= 1
+
+    def search(self, word, thresh):
+        """Returns a list of (distance, word) pairs for the words in the index
+        that are less than thresh away from word.
+        """
+        rtn = []
+        n = len(word)
+        mask = _char_mask(word)
+        # the largest distance that is less than thresh
+        within = thresh - 1 if thresh == float('inf') else math.ceil(thresh) - 1
+        lengths = [m for m in self._bylen if abs(m - n) <= within]
+        for m in lengths:
+            for w, wmask in self._bylen[m].items():
+                if bin(wmask & ~mask).count('1') > within or \
+                        bin(mask & ~wmask).count('1') > within:
+                    continue
+                d = levenshtein(word, w, within)
+                if d <= within:
+                    rtn.append((d, w))
+        return rtn
+
+    def __contains__(self, word):
+        return word in self._bylen.get(len(word), ())
+
+    def __len__(self):
+        return self._len
 
 
 def suggestion_sort_helper(x, y):
@@ -784,14 +864,23 @@ def _make_style(color_name):
 
 def get_xonsh_color_names(color_code):
     """ Makes a reverse lookup in TERM_COLORS  """
-    try:
-        return next(k for k, v in TERM_COLORS.items() if v == color_code)
-    except StopIteration:
-        return 'NO_COLOR'
+    names = _term_color_names()
+    return names.get(color_code, 'NO_COLOR')
 
 
-def format_prompt_for_prompt_toolkit(prompt):
-    """Converts a prompt with color codes to a pygments style and tokens
+@lru_cache(maxsize=1)
+def _term_color_names():
+    names = {}
+    for k, v in TERM_COLORS.items():
+        names.setdefault(v, k)
+    return names
+
+
+@lru_cache(maxsize=64)
+def prompt_color_parts(prompt):
+    """Splits a prompt with color codes into the names of its colors and the
+    strings that they color, as a pair of tuples. The parts of recent prompts
+    are remembered.
     """
     parts = RE_HIDDEN_MAX.split(prompt)
     # ensure that parts is [colorcode, string, colorcode, string,...]
@@ -801,10 +890,17 @@ def format_prompt_for_prompt_toolkit(prompt):
         parts.insert(0, '')
     if len(parts) % 2 != 0:
         parts.append()
-    strings = parts[1::2]
-    token_names = [get_xonsh_color_names(c) for c in parts[::2]]
+    strings = tuple(parts[1::2])
+    token_names = tuple(get_xonsh_color_names(c) for c in parts[::2])
+    return token_names, strings
+
+
+def format_prompt_for_prompt_toolkit(prompt):
+    """Converts a prompt with color codes to a pygments style and tokens
+    """
+    token_names, strings = prompt_color_parts(prompt)
     cstyles = [_make_style(c) for c in token_names]
-    return token_names, cstyles, strings
+    return list(token_names), cstyles, list(strings)
 
 
 def print_color(string, file=sys.stdout):
@@ -916,7 +1012,7 @@ def check_for_partial_string(x):
 
 def _is_in_env(name):
     ENV = builtins.__xonsh_env__
-    return name in ENV._d or name in ENV.defaults
+    return name in ENV._d or name in ENV._raw or name in ENV.defaults
 
 def _get_env_string(name):
     ENV = builtins.__xonsh_env__
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""Reads the branch and status of git and mercurial repositories for the
+prompt, from the files in their ``.git`` and ``.hg`` directories rather than
+by running git or hg.
+
+The branch comes straight from ``HEAD`` (with ``packed-refs``) or
+``.hg/branch``. Whether the working directory is dirty is worked out by
+comparing the stat of every tracked file with what the git index or the hg
+dirstate records. Only when that cannot settle the question, e.g. a file was
+touched without being changed, or files may be untracked, is git or hg asked,
+and the answer is kept until any of the files it depends on changes. For git
+that includes every directory of the work tree that is not ignored, since
+untracked files may appear in any of them.
+"""
+import os
+import re
+import stat
+import time
+import struct
+import threading
+import subprocess
+
+# path -> ((mtime, size), contents)
+_FILES = {}
+# (path, parse function) -> ((mtime, size), parsed contents)
+_PARSED = {}
+# repository root -> (signature, dirty)
+_DIRTY = {}
+# git work tree root -> directories that are watched for untracked files
+_GIT_DIRS = {}
+_LOCK = threading.Lock()
+
+# file systems keep coarse timestamps, so a directory changed this close to
+# a run of git may change again without its mtime changing
+RACY_NS = 2 * 10**9
+
+RE_SHA256 = re.compile(r'^\s*objectformat\s*=\s*sha256\s*$', re.I | re.M)
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read(path):
+    """Returns the contents of a small text file, or None if there is none,
+    reading it again only when it changes.
+    """
+    key = _stat_key(path)
+    if key is None:
+        return None
+    with _LOCK:
+        cached = _FILES.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, 'r', errors='replace') as f:
+            s = f.read()
+    except OSError:
+        return None
+    with _LOCK:
+        _FILES[path] = (key, s)
+    return s
+
+
+def _parsed(path, parse):
+    """Returns parse(contents of the binary file at path), or None if there
+    is no such file, parsing it again only when it changes.
+    """
+    key = _stat_key(path)
+    if key is None:
+        return None
+    with _LOCK:
+        cached = _PARSED.get((path, parse))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, 'rb') as f:
+            rtn = parse(f.read())
+    except (OSError, ValueError, struct.error):
+        rtn = None
+    with _LOCK:
+        _PARSED[(path, parse)] = (key, rtn)
+    return rtn
+
+
+def find_repo(cwd):
+    """Finds the repository that cwd is in, walking up from it. Returns a
+    (kind, root) pair, where kind is 'git' or 'hg', or None.
+    """
+    if cwd is None:
+        return None
+    path = os.path.abspath(cwd)
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            return 'git', path
+        if os.path.isdir(os.path.join(path, '.hg')):
+            return 'hg', path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _git_dirs(root):
+    """Returns the git directory of a work tree, and the common directory
+    that holds its refs, which differ for linked work trees.
+    """
+    gitdir = os.path.join(root, '.git')
+    if os.path.isfile(gitdir):
+        s = _read(gitdir) or ''
+        if not s.startswith('gitdir:'):
+            return None, None
+        gitdir = os.path.join(root, s[len('gitdir:'):].strip())
+    common = _read(os.path.join(gitdir, 'commondir'))
+    common = gitdir if common is None else \
+             os.path.normpath(os.path.join(gitdir, common.strip()))
+    return gitdir, common
+
+
+def _parse_packed_refs(data):
+    refs = {}
+    for line in data.decode('utf-8', 'replace').splitlines():
+        if line.startswith(('#', '^')):
+            continue
+        sha, _, ref = line.partition(' ')
+        refs[ref.strip()] = sha
+    return refs
+
+
+def _git_ref(common, ref):
+    """Returns the commit that ref points to, or None."""
+    sha = _read(os.path.join(common, ref))
+    if sha is not None:
+        return sha.strip()
+    packed = _parsed(os.path.join(common, 'packed-refs'), _parse_packed_refs)
+    return None if packed is None else packed.get(ref)
+
+
+def git_head(root):
+    """Returns what HEAD of the work tree at root is: a ('ref', name) or
+    ('sha', commit) pair, or None if it cannot be read.
+    """
+    gitdir, _ = _git_dirs(root)
+    if gitdir is None:
+        return None
+    head = _read(os.path.join(gitdir, 'HEAD'))
+    if head is None:
+        return None
+    head = head.strip()
+    if head.startswith('ref:'):
+        return 'ref', head[len('ref:'):].strip()
+    return 'sha', head
+
+
+def git_branch(root):
+    """Returns the name of the branch checked out in the work tree at root,
+    the abbreviated commit if HEAD is detached, or None. As with
+    __git_ps1, a merge or rebase in progress is noted after a bar.
+    """
+    head = git_head(root)
+    if head is None:
+        return None
+    kind, name = head
+    if kind == 'ref':
+        branch = name[len('refs/heads/'):] if \
+                 name.startswith('refs/heads/') else name
+    else:
+        branch = '({0}...)'.format(name[:7])
+    gitdir, _ = _git_dirs(root)
+    if os.path.isdir(os.path.join(gitdir, 'rebase-merge')) or \
+            os.path.isdir(os.path.join(gitdir, 'rebase-apply')):
+        branch += '|REBASE'
+    elif os.path.exists(os.path.join(gitdir, 'MERGE_HEAD')):
+        branch += '|MERGING'
+    return branch
+
+
+def _parse_git_index(data):
+    """Parses a version 2, 3 or 4 git index, returning a list of (path,
+    mtime in ns, size, mode, ctime in ns) for the entries whose files git
+    would check.
+    """
+    sig, version, n = struct.unpack_from('>4sLL', data)
+    if sig != b'DIRC' or version not in (2, 3, 4):
+        raise ValueError('unsupported git index')
+    entries = []
+    pos = 12
+    last = b''
+    for _ in range(n):
+        (ctime, ctime_ns, mtime, mtime_ns, _, _, mode, _, _, size) = \
+            struct.unpack_from('>10L', data, pos)
+        flags, = struct.unpack_from('>H', data, pos + 60)
+        start = pos
+        pos += 62
+        skip = flags & 0x8000  # assume-valid
+        if flags & 0x4000:
+            extended, = struct.unpack_from('>H', data, pos)
+            pos += 2
+            skip = skip or extended & 0x4000  # skip-worktree
+        if version == 4:
+            # the path shares all but some bytes of the end of the last one
+            strip = 0
+            while True:
+                b = data[pos]
+                pos += 1
+                strip = (strip << 7) | (b & 0x7f)
+                if not b & 0x80:
+                    break
+                strip += 1
+            end = data.index(b'\0', pos)
+            path = last[:len(last) - strip] + data[pos:end]
+            pos = end + 1
+        else:
+            end = data.index(b'\0', pos)
+            path = data[pos:end]
+            # entries are padded with NULs to a multiple of eight bytes
+            pos = start + ((end - start + 8) & ~7)
+        last = path
+        # gitlinks are submodules, which are checked out on their own
+        if not skip and mode >> 12 != 0o16:
+            entries.append((os.fsdecode(path), mtime * 10**9 + mtime_ns,
+                            size, mode, ctime * 10**9 + ctime_ns))
+    return entries
+
+
+def _git_status(root):
+    """Asks git whether the work tree at root is dirty. Returns a (dirty,
+    ignored) pair, where ignored is the set of the paths that git ignores,
+    or None if git could not tell.
+    """
+    try:
+        s = subprocess.check_output(['git', 'status', '--porcelain', '-z',
+                                     '--ignored'],
+                                    stderr=subprocess.PIPE, cwd=root)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    dirty = False
+    ignored = set()
+    entries = iter(s.split(b'\0'))
+    for entry in entries:
+        if len(entry) == 0:
+            continue
+        if entry.startswith(b'!! '):
+            path = os.fsdecode(entry[3:]).rstrip('/')
+            ignored.add(os.path.normpath(path))
+            continue
+        dirty = True
+        if entry[:1] in (b'R', b'C'):
+            next(entries, None)  # the path it was renamed or copied from
+    return dirty, ignored
+
+
+def _git_mode(st_mode):
+    """The mode that git records for a file with the given stat mode."""
+    if stat.S_ISLNK(st_mode):
+        return 0o120000
+    elif stat.S_ISREG(st_mode):
+        return 0o100755 if st_mode & 0o100 else 0o100644
+    return stat.S_IFMT(st_mode)
+
+
+def _git_watched_dirs(root, ignored):
+    """Returns the directories in the work tree at root that git looks in
+    for untracked files, that is, every one that is neither ignored nor
+    inside another repository.
+    """
+    dirs = []
+    for path, dirnames, _ in os.walk(root):
+        rel = os.path.relpath(path, root)
+        dirs.append(rel)
+        dirnames[:] = [name for name in dirnames if name != '.git' and
+                       os.path.normpath(os.path.join(rel, name))
+                       not in ignored and
+                       not os.path.exists(os.path.join(path, name, '.git'))]
+    return tuple(sorted(dirs))
+
+
+def _dir_keys(root, dirs, since=None):
+    """Returns the (mtime, size) of each of the directories. With since, a
+    time in ns, directories changed within RACY_NS of it get 'racy' instead,
+    which no later key matches.
+    """
+    keys = []
+    for d in dirs:
+        key = _stat_key(os.path.join(root, d))
+        if since is not None and key is not None and \
+                key[0] >= since - RACY_NS:
+            key = 'racy'
+        keys.append(key)
+    return tuple(keys)
+
+
+def git_dirty(root):
+    """Returns whether the work tree at root has changes that git status
+    would report, or None if that cannot be worked out. git is only run when
+    the index, HEAD, a tracked file, or a directory that is not ignored has
+    changed since it was last run. Until then the directories are only
+    stat'd; they are walked after each run of git.
+    """
+    gitdir, common = _git_dirs(root)
+    if gitdir is None:
+        return None
+    config = _read(os.path.join(common, 'config')) or ''
+    if RE_SHA256.search(config) is not None:
+        # the index is laid out for sha-1
+        status = _git_status(root)
+        return None if status is None else status[0]
+    index = os.path.join(gitdir, 'index')
+    index_key = _stat_key(index)
+    entries = _parsed(index, _parse_git_index)
+    if index_key is None or entries is None:
+        status = _git_status(root)
+        return None if status is None else status[0]
+    head = git_head(root)
+    if head is not None and head[0] == 'ref':
+        head = (head, _git_ref(common, head[1]))
+    changed = []
+    for path, mtime, size, mode, ctime in entries:
+        try:
+            st = os.lstat(os.path.join(root, path))
+        except OSError:
+            changed.append((path, None))
+            continue
+        # files changed in the same instant as the index are racily clean
+        if st.st_mtime_ns != mtime or st.st_size != size or \
+                st.st_ctime_ns != ctime or _git_mode(st.st_mode) != mode or \
+                mtime >= index_key[0]:
+            changed.append((path, st.st_mtime_ns, st.st_size,
+                            st.st_ctime_ns, st.st_mode))
+    files = (index_key, head, tuple(changed))
+    with _LOCK:
+        cached = _DIRTY.get(root)
+        dirs = _GIT_DIRS.get(root)
+    if cached is not None and dirs is not None and \
+            cached[0] == (files, _dir_keys(root, dirs)):
+        return cached[1]
+    since = int(time.time() * 10**9)
+    status = _git_status(root)
+    if status is None:
+        return None
+    dirty, ignored = status
+    # new directories only show up as changes to their parents, after
+    # which git is run and they are walked
+    dirs = _git_watched_dirs(root, ignored)
+    signature = (files, _dir_keys(root, dirs, since=since))
+    with _LOCK:
+        _DIRTY[root] = (signature, dirty)
+        _GIT_DIRS[root] = dirs
+    return dirty
+
+
+def _memoized_dirty(root, signature, status):
+    with _LOCK:
+        cached = _DIRTY.get(root)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    dirty = status(root)
+    if dirty is not None:
+        with _LOCK:
+            _DIRTY[root] = (signature, dirty)
+    return dirty
+
+
+def hg_branch(root):
+    """Returns the branch of the mercurial repository at root, followed by
+    its active bookmark, if any.
+    """
+    hgdir = os.path.join(root, '.hg')
+    branch = _read(os.path.join(hgdir, 'branch'))
+    branch = 'default' if branch is None else branch.strip()
+    bookmark = _read(os.path.join(hgdir, 'bookmarks.current'))
+    if bookmark is not None and len(bookmark.strip()) > 0:
+        return '{0}, {1}'.format(branch, bookmark.strip())
+    return branch
+
+
+def _parse_hg_dirstate(data):
+    """Parses a version 1 dirstate, returning whether any file is added,
+    removed or merged, and a list of (path, mtime in s, size) for the others.
+    """
+    pending = False
+    entries = []
+    pos = 40  # the two parents
+    n = len(data)
+    while pos < n:
+        state, mode, size, mtime, length = \
+            struct.unpack_from('>cllll', data, pos)
+        pos += 17
+        path = data[pos:pos + length].split(b'\0', 1)[0]
+        pos += length
+        if state != b'n':
+            pending = True
+        else:
+            entries.append((os.fsdecode(path), mtime, size))
+    return pending, entries
+
+
+def _hg_status(root):
+    env = os.environ.copy()
+    env['HGRCPATH'] = ''
+    try:
+        s = subprocess.check_output(['hg', 'identify', '--id'],
+                                    stderr=subprocess.PIPE, cwd=root,
+                                    universal_newlines=True, env=env)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return s.strip().endswith('+')
+
+
+def hg_dirty(root):
+    """Returns whether the working directory of the mercurial repository at
+    root has uncommitted changes to tracked files, as with hg identify, or
+    None if that cannot be worked out. hg is only run when a file does not
+    match the dirstate, and only until it changes again.
+    """
+    hgdir = os.path.join(root, '.hg')
+    requires = _read(os.path.join(hgdir, 'requires')) or ''
+    if 'dirstate-v2' in requires.split():
+        return _hg_status(root)
+    dirstate = os.path.join(hgdir, 'dirstate')
+    parsed = _parsed(dirstate, _parse_hg_dirstate)
+    if parsed is None:
+        return _hg_status(root)
+    pending, entries = parsed
+    if pending:
+        return True
+    changed = []
+    for path, mtime, size in entries:
+        try:
+            st = os.lstat(os.path.join(root, path))
+        except OSError:
+            return True
+        # hg keeps the low 31 bits, and -1 for files it needs to look at
+        if (int(st.st_mtime) & 0x7fffffff) != mtime or \
+                (st.st_size & 0x7fffffff) != size:
+            changed.append((path, st.st_mtime_ns, st.st_size))
+    if len(changed) == 0:
+        return False
+    signature = (_stat_key(dirstate), tuple(changed))
+    return _memoized_dirty(root, signature, _hg_status)